@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Micro-benchmarks of every basic_coder entry point
+
+Each of these sits under the encoding/decoding of every packet,
+so keep an eye on this output when touching basic_coder
+
+    python -m benchmarks.bench_basic_coder
+
+"""
+import random
+
+from mdht.coding import basic_coder
+from benchmarks.common import rate, report
+
+NUMBER = 200000
+
+
+def main():
+    network_id = random.getrandbits(160)
+    network_id_string = basic_coder.encode_network_id(network_id)
+    token = random.getrandbits(32) | (1 << 31)
+    token_string = basic_coder.ltob(token)
+    port = 6881
+    port_string = basic_coder.encode_port(port)
+    address = ("67.18.187.143", port)
+    address_string = basic_coder.encode_address(address)
+    addresses_string = address_string * 8
+
+    benchmarks = [
+        ("btol (2 bytes)", lambda: basic_coder.btol(port_string)),
+        ("btol (4 bytes)", lambda: basic_coder.btol(token_string)),
+        ("btol (20 bytes)", lambda: basic_coder.btol(network_id_string)),
+        ("ltob (32 bits)", lambda: basic_coder.ltob(token)),
+        ("ltob (160 bits)", lambda: basic_coder.ltob(network_id)),
+        ("encode_network_id",
+         lambda: basic_coder.encode_network_id(network_id)),
+        ("decode_network_id",
+         lambda: basic_coder.decode_network_id(network_id_string)),
+        ("encode_port", lambda: basic_coder.encode_port(port)),
+        ("decode_port", lambda: basic_coder.decode_port(port_string)),
+        ("encode_address", lambda: basic_coder.encode_address(address)),
+        ("decode_address",
+         lambda: basic_coder.decode_address(address_string)),
+        ("decode_addresses (8 peers)",
+         lambda: basic_coder.decode_addresses(addresses_string)),
+    ]
+    for label, func in benchmarks:
+        report(label, rate(func, number=NUMBER))
+
+if __name__ == "__main__":
+    main()
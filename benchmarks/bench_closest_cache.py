@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Benchmark the closest nodes cache of the routing tables
+
+Lookups of targets drawn mostly from a hot set (popular infohashes
+and ids close to our own), with one of the nodes of the table removed
+and offered back every `interval' lookups (churn, which invalidates
+the cached candidates drawn from its kbucket)
+
+    walk: the uncached lookup (_find_closest_nodes)
+    cached: get_closest_nodes, along with the cache hit rate and
+        the number of outdated entries it ran into
+
+The table size can be given on the command line
+
+    python -m benchmarks.bench_closest_cache [size]
+
+"""
+import sys
+import random
+
+from config import constants
+from mdht.kademlia.routing_table import TreeRoutingTable, FlatRoutingTable
+from benchmarks.common import rate, report, random_node
+
+SIZE = 100000
+LOOKUPS = 1000
+HOT_TARGETS = 64
+HOT_SHARE = 0.9
+# Lookups between two churned nodes (None: no churn)
+INTERVALS = [None, 100, 10]
+
+
+def make_targets(own_id):
+    hot = [random.getrandbits(constants.id_size)
+           for _ in range(HOT_TARGETS / 2)]
+    hot.extend(own_id ^ random.getrandbits(constants.id_size - 24)
+               for _ in range(HOT_TARGETS / 2))
+    targets = []
+    for _ in range(LOOKUPS):
+        if random.random() < HOT_SHARE:
+            targets.append(random.choice(hot))
+        else:
+            targets.append(random.getrandbits(constants.id_size))
+    return targets
+
+
+def main(size):
+    own_id = random.getrandbits(constants.id_size)
+    targets = make_targets(own_id)
+    for table_class in [TreeRoutingTable, FlatRoutingTable]:
+        table = table_class()
+        while len(table.get_nodes()) < size:
+            table.offer_node(random_node())
+        name = table_class.__name__
+        for interval in INTERVALS:
+            churned = random.sample(table.get_nodes().values(), LOOKUPS)
+
+            def run(lookup):
+                for i, target in enumerate(targets):
+                    if interval and i % interval == 0:
+                        table.remove_node(churned[i])
+                        table.offer_node(churned[i])
+                    lookup(target, constants.k)
+
+            baseline = rate(lambda: run(table._find_closest_nodes),
+                            number=5) * LOOKUPS
+            label = "%s churn every %s" % (name, interval or "-")
+            report("%s (walk)" % label, baseline)
+            table.closest_cache_hits = table.closest_cache_misses = 0
+            table.closest_cache_stale = 0
+            cached = rate(lambda: run(table.get_closest_nodes),
+                          number=5) * LOOKUPS
+            report("%s (cached)" % label, cached, baseline)
+            stats = table.get_closest_cache_stats()
+            print "    hit rate %.1f%%, %d stale" % (
+                100.0 * stats["hits"] / (stats["hits"] + stats["misses"]),
+                stats["stale"])
+        print
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if sys.argv[1:] else SIZE)
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Benchmark the TreeRoutingTable closest nodes lookup across table sizes
+
+    recursive: the former lookup, which gathered whole kbuckets along
+        the path of the target before sorting everything it gathered
+    ordered walk: the current (uncached) lookup, which visits the kbuckets in
+        distance order and stops once it holds enough nodes
+
+The results of the ordered walk are also checked against a full
+sort of the table. The table sizes can be given on the command line
+
+    python -m benchmarks.bench_closest_nodes [size ...]
+
+"""
+import sys
+import random
+
+from config import constants
+from mdht.kademlia.routing_table import TreeRoutingTable
+from benchmarks.common import rate, report, random_node
+
+SIZES = [1000, 10000, 100000, 1000000]
+TARGETS = 100
+
+
+def legacy_closest_nodes(table, node_id, num_nodes=constants.k):
+    """The recursive get_closest_nodes, as it was"""
+    closest_nodes = []
+
+    def collect(tnode):
+        if len(closest_nodes) >= num_nodes:
+            return
+        if tnode.is_leaf():
+            closest_nodes.extend(tnode.kbucket.get_nodes())
+            return
+        if tnode.lchild.kbucket.key_in_range(node_id):
+            collect(tnode.lchild)
+            collect(tnode.rchild)
+        elif tnode.rchild.kbucket.key_in_range(node_id):
+            collect(tnode.rchild)
+            collect(tnode.lchild)
+
+    collect(table.root)
+    closest_nodes.sort(key=lambda node: node.distance(node_id))
+    return closest_nodes[:num_nodes]
+
+
+def check(table, targets):
+    """Make sure the ordered walk finds the true closest nodes"""
+    nodes = table.get_nodes().values()
+    for target in targets[:10]:
+        expected = sorted(nodes, key=lambda node: node.distance(target))
+        found = table._find_closest_nodes(target, constants.k)
+        assert found == expected[:constants.k], "wrong closest nodes"
+
+
+def main(sizes):
+    for size in sizes:
+        table = TreeRoutingTable()
+        while len(table.get_nodes()) < size:
+            table.offer_node(random_node())
+        targets = [random.getrandbits(constants.id_size)
+                   for _ in range(TARGETS)]
+        if size <= 100000:
+            check(table, targets)
+
+        def recursive():
+            for target in targets:
+                legacy_closest_nodes(table, target)
+
+        def ordered_walk():
+            for target in targets:
+                table._find_closest_nodes(target, constants.k)
+
+        baseline = rate(recursive, number=20) * TARGETS
+        report("%d nodes (recursive)" % size, baseline)
+        report("%d nodes (ordered walk)" % size,
+               rate(ordered_walk, number=20) * TARGETS, baseline)
+
+if __name__ == "__main__":
+    main([int(size) for size in sys.argv[1:]] or SIZES)
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Benchmark the decoding of compact node lists and peer lists
+
+    per entry: every 26 (or 6) byte entry is sliced out and decoded
+        on its own through the validating Node() constructor
+    bulk: contact.decode_nodes / basic_coder.decode_addresses
+
+    python -m benchmarks.bench_compact_lists
+
+"""
+from mdht import contact
+from mdht.coding import basic_coder
+from benchmarks.common import rate, report, random_node
+
+
+def chunks(string, n):
+    return [string[i:i+n] for i in xrange(0, len(string), n)]
+
+
+def main():
+    nodes = [random_node() for _ in range(8)]
+    nodes_string = "".join(contact.encode_node(node) for node in nodes)
+    addresses_string = "".join(basic_coder.encode_address(node.address)
+                               for node in nodes)
+
+    def nodes_per_entry():
+        [contact.Node(basic_coder.decode_network_id(s[:20]),
+                      basic_coder.decode_address(s[20:]))
+         for s in chunks(nodes_string, 26)]
+
+    def addresses_per_entry():
+        [basic_coder.decode_address(s) for s in chunks(addresses_string, 6)]
+
+    baseline = rate(nodes_per_entry)
+    report("8 nodes (per entry)", baseline)
+    report("8 nodes (bulk)",
+           rate(lambda: contact.decode_nodes(nodes_string)), baseline)
+
+    baseline = rate(addresses_per_entry)
+    report("8 peers (per entry)", baseline)
+    report("8 peers (bulk)",
+           rate(lambda: basic_coder.decode_addresses(addresses_string)),
+           baseline)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Benchmark the node selection of a full KBucket across bucket sizes
+
+    stalest node: KBucket.get_stalest_node
+    offer (turned down): offering a node to a full KBucket, which
+        looks for its worst node before turning the new node down
+
+Each is timed against the former set based KBucket, which scanned
+all of its nodes (comparing them pairwise with better_than)
+
+    python -m benchmarks.bench_kbucket
+
+"""
+from mdht.kademlia.kbucket import KBucket
+from benchmarks.common import rate, report, random_node
+
+SIZES = [8, 64, 256]
+
+
+class _ScanningKBucket(KBucket):
+    """A KBucket selecting its nodes like before (by scanning them)"""
+
+    def get_stalest_node(self):
+        return min(self._nodes.itervalues(),
+                   key=lambda node: node.last_updated)
+
+    def _get_worst_node(self):
+        nodes = set(self._nodes.itervalues())
+        worst_node = nodes.pop()
+        nodes.add(worst_node)
+        for node in nodes:
+            if worst_node.better_than(node):
+                worst_node = node
+        return worst_node
+
+
+def fill(kbucket_class, nodes):
+    kbucket = kbucket_class(0, 2**160, maxsize=len(nodes))
+    for node in nodes:
+        node.successful_query(node.last_updated - 0.1)
+        kbucket.offer_node(node)
+    return kbucket
+
+
+def main():
+    for size in SIZES:
+        nodes = [random_node() for _ in range(size)]
+        # Slower than every node of the KBucket
+        candidate = random_node()
+        buckets = [("scan", fill(_ScanningKBucket, nodes)),
+                   ("ordered", fill(KBucket, nodes))]
+
+        for label, bench in [
+                ("stalest node", lambda k: k.get_stalest_node),
+                ("offer (turned down)", lambda k: lambda:
+                    k.offer_node(candidate))]:
+            baseline = None
+            for name, kbucket in buckets:
+                ops = rate(bench(kbucket), number=5000)
+                report("%d nodes %s (%s)" % (size, label, name), ops,
+                       baseline)
+                baseline = baseline or ops
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Compare the packets/sec of the different KRPC decoding stages
+
+    bdecode vs bscan: generic tree decoding vs the offset scanner
+    generic vs fast: krpc_coder._decode vs krpc_coder.decode (which
+        tries the single pass decoder before the generic one)
+
+    python -m benchmarks.bench_krpc_decode
+
+"""
+from mdht.coding import krpc_coder
+from mdht.coding.bencode import bdecode
+from mdht.coding.bscan import bscan
+from benchmarks.common import rate, report, sample_packets
+
+
+def main():
+    for name, packet in sorted(sample_packets().items()):
+        baseline = rate(lambda: bdecode(packet))
+        report("bdecode %s" % name, baseline)
+        report("bscan   %s" % name,
+               rate(lambda: bscan(packet, krpc_coder._krpc_fields)), baseline)
+
+    print
+    for name, packet in sorted(sample_packets().items()):
+        baseline = rate(lambda: krpc_coder._decode(packet))
+        report("generic %s" % name, baseline)
+        report("fast    %s" % name,
+               rate(lambda: krpc_coder.decode(packet)), baseline)
+
+if __name__ == "__main__":
+    main()
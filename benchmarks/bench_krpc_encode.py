@@ -0,0 +1,24 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Compare the messages/sec of the generic and the direct KRPC encoders
+
+    generic: krpc_coder._encode (intermediate dicts + bencode())
+    direct: krpc_coder.encode (pre-sorted key layouts per message type)
+
+    python -m benchmarks.bench_krpc_encode
+
+"""
+from mdht.coding import krpc_coder
+from benchmarks.common import rate, report, sample_messages
+
+
+def main():
+    for name, message in sorted(sample_messages().items()):
+        baseline = rate(lambda: krpc_coder._encode(message))
+        report("generic %s" % name, baseline)
+        report("direct  %s" % name,
+               rate(lambda: krpc_coder.encode(message)), baseline)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Simulate iterative lookups over a network of nodes for each table type
+
+    tree: TreeRoutingTable (splits its kbuckets for every node)
+    kademlia: MultiOwnerRoutingTable (splits around its own id only)
+    subsecond: SubsecondRoutingTable (same, with larger far kbuckets)
+
+Every simulated node is offered a random sample of the network (the
+nodes it happened to hear about), then lookups of random node ids are
+run from random nodes: each round queries the `alpha' closest nodes
+not queried yet, which answer with the k nodes they know closest to
+the target, until the target is found or no closer node turns up.
+Reported are the average number of rounds (hops) and of queries
+(messages) per lookup, the share of successful lookups, and the
+average number of nodes held by a table
+
+The network size, sample size and number of lookups can be given
+on the command line
+
+    python -m benchmarks.bench_lookup_hops [network [sample [lookups]]]
+
+"""
+import sys
+import random
+
+from config import constants
+from mdht.kademlia.routing_table import (TreeRoutingTable,
+                                         MultiOwnerRoutingTable,
+                                         SubsecondRoutingTable)
+from benchmarks.common import random_node
+
+NETWORK = 2000
+SAMPLE = 400
+LOOKUPS = 500
+ALPHA = 3
+
+
+def build_network(table_class, nodes, sample):
+    tables = {}
+    for node in nodes:
+        table = table_class()
+        table.add_owner(node.node_id)
+        for other in random.sample(nodes, sample):
+            if other is not node:
+                table.offer_node(other)
+        tables[node.node_id] = table
+    return tables
+
+
+def lookup(tables, origin, target_id):
+    """
+    Run an iterative lookup of target_id from origin
+
+    @returns a tuple (hops, messages, found)
+
+    """
+    distance = lambda node: node.node_id ^ target_id
+    shortlist = set(tables[origin.node_id].get_closest_nodes(target_id))
+    queried = set()
+    hops = messages = 0
+    while True:
+        closest = sorted(shortlist, key=distance)
+        if closest and closest[0].node_id == target_id:
+            return (hops, messages, True)
+        candidates = [node for node in closest[:constants.k]
+                      if node not in queried][:ALPHA]
+        if not candidates:
+            return (hops, messages, False)
+        hops += 1
+        for node in candidates:
+            queried.add(node)
+            messages += 1
+            shortlist.update(
+                tables[node.node_id].get_closest_nodes(target_id))
+
+
+def main(network, sample, lookups):
+    nodes = [random_node() for _ in range(network)]
+    runs = [(random.choice(nodes), random.choice(nodes).node_id)
+            for _ in range(lookups)]
+
+    print "%d nodes, tables offered %d nodes each, %d lookups" % (
+        network, sample, lookups)
+    print "%-10s %8s %10s %9s %12s" % (
+        "", "hops", "messages", "found", "table nodes")
+    for name, table_class in [("tree", TreeRoutingTable),
+                              ("kademlia", MultiOwnerRoutingTable),
+                              ("subsecond", SubsecondRoutingTable)]:
+        tables = build_network(table_class, nodes, sample)
+        results = [lookup(tables, origin, target_id)
+                   for (origin, target_id) in runs]
+        print "%-10s %8.2f %10.2f %8.1f%% %12.1f" % (
+            name,
+            sum(hops for (hops, _, _) in results) / float(lookups),
+            sum(messages for (_, messages, _) in results) / float(lookups),
+            100.0 * sum(found for (_, _, found) in results) / lookups,
+            sum(len(table.get_nodes()) for table in tables.itervalues()) /
+            float(network))
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    main(*(args + [NETWORK, SAMPLE, LOOKUPS][len(args):]))
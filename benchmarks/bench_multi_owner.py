@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Compare the ways of routing for many virtual node ids (as main.py runs)
+
+    shared tree: the TreeRoutingTable singleton shared by all the
+        virtual nodes, which splits its kbuckets for every node
+    independent: one kademlia table per virtual node (a
+        MultiOwnerRoutingTable with a single owner each)
+    multi-owner: a single MultiOwnerRoutingTable owned by all
+        the virtual nodes
+
+Each of them is offered the same stream of nodes. Reported are the
+number of kbuckets, the nodes they hold, a rough estimate of their
+memory, and the latency and precision (share of the true closest
+nodes found) of get_closest_nodes near the owner ids
+
+The number of owners and the number of offered nodes can be given
+on the command line
+
+    python -m benchmarks.bench_multi_owner [owners [nodes]]
+
+"""
+import sys
+import random
+
+from config import constants
+from mdht.kademlia.routing_table import (TreeRoutingTable,
+                                         MultiOwnerRoutingTable)
+from benchmarks.common import rate, random_node
+
+OWNERS = 100
+NODES = 50000
+
+
+def memory(tables):
+    """Rough size of the tables' kbuckets and nodes (bytes)"""
+    size = 0
+    nodes = {}
+    for table in tables:
+        for k in table.get_kbuckets():
+            size += (sys.getsizeof(k) + sys.getsizeof(k.__dict__) +
+                     sys.getsizeof(k._nodes) + sys.getsizeof(k._replacements))
+            for node in k.get_nodes() + k.get_replacements():
+                nodes[id(node)] = node
+        size += sys.getsizeof(table.nodes_dict)
+    for node in nodes.itervalues():
+        size += sys.getsizeof(node) + sys.getsizeof(node.address)
+    return size
+
+
+def main(owners, count):
+    # Spread the owner ids over the id space like main.py
+    piece = 2**constants.id_size / owners
+    owner_ids = [random.randrange(piece) + i * piece for i in range(owners)]
+    nodes = [random_node() for _ in range(count)]
+    # Ids next to the owner ids, as find_self looks up
+    targets = [owner_id ^ random.getrandbits(32) for owner_id in owner_ids]
+
+    shared = TreeRoutingTable()
+    multi = MultiOwnerRoutingTable()
+    independent = {}
+    for owner_id in owner_ids:
+        multi.add_owner(owner_id)
+        independent[owner_id] = MultiOwnerRoutingTable()
+        independent[owner_id].add_owner(owner_id)
+    for node in nodes:
+        shared.offer_node(node)
+        multi.offer_node(node)
+        for table in independent.itervalues():
+            table.offer_node(node)
+
+    def closest(table, target):
+        return table.get_closest_nodes(target)
+
+    setups = [("shared tree", [shared], lambda owner_id: shared),
+              ("independent", independent.values(),
+               lambda owner_id: independent[owner_id]),
+              ("multi-owner", [multi], lambda owner_id: multi)]
+
+    print "%d owners, %d offered nodes" % (owners, count)
+    print "%-12s %9s %9s %9s %12s %10s" % (
+        "", "kbuckets", "nodes", "MB", "lookups/s", "precision")
+    for name, tables, table_of in setups:
+        found = 0
+        for owner_id, target in zip(owner_ids, targets):
+            expected = sorted(nodes, key=lambda node: node.distance(target))
+            expected = set(expected[:constants.k])
+            found += len(expected & set(closest(table_of(owner_id), target)))
+
+        def lookups():
+            for owner_id, target in zip(owner_ids, targets):
+                table_of(owner_id).get_closest_nodes(target)
+
+        print "%-12s %9d %9d %9.1f %12.0f %9.1f%%" % (
+            name,
+            sum(len(table.get_kbuckets()) for table in tables),
+            sum(len(table.get_nodes()) for table in tables),
+            memory(tables) / 1024.0 / 1024,
+            rate(lookups, number=20) * owners,
+            100.0 * found / (owners * constants.k))
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    main(*(args + [OWNERS, NODES][len(args):]))
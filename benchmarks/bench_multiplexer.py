@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Benchmark serving many node ids on many sockets vs on a single one
+
+    sockets: a KRPC_Responder listening on a port of its own per
+        node id (as it was)
+    multiplexer: the KRPC_Responders hosted by a single
+        KRPC_Multiplexer (mdht.protocols.krpc_multiplexer)
+
+A client spreads ping queries over the node ids (round robin,
+64 of them in flight) through the loopback interface, and the
+ping responses per second are reported, for 100 and 1000 node ids
+(or the numbers given on the command line)
+
+    python -m benchmarks.bench_multiplexer [node ids ...]
+
+"""
+import sys
+import time
+import random
+
+from twisted.internet import reactor, defer, protocol
+
+from mdht.coding import krpc_coder
+from mdht.krpc_types import Query
+from mdht.send_scheduler import SendScheduler
+from mdht.protocols.krpc_responder import KRPC_Responder
+from mdht.protocols.krpc_multiplexer import KRPC_Multiplexer
+from mdht.kademlia.routing_table import FlatRoutingTable
+from benchmarks.common import report
+
+NODE_IDS = [100, 1000]
+PINGS = 20000
+IN_FLIGHT = 64
+LOCALHOST = "127.0.0.1"
+
+
+class _PingClient(protocol.DatagramProtocol):
+    """Keeps IN_FLIGHT pings going round the given addresses"""
+
+    def __init__(self, addresses, total):
+        self.addresses = addresses
+        self.total = total
+        self.received = 0
+        self.sent = 0
+        self.done = defer.Deferred()
+        query = Query(rpctype="ping", _from=random.getrandbits(160))
+        query._transaction_id = "aa"
+        self.packet = krpc_coder.encode(query)
+
+    def start(self):
+        self.started = time.time()
+        for _ in range(IN_FLIGHT):
+            self._send()
+
+    def _send(self):
+        address = self.addresses[self.sent % len(self.addresses)]
+        self.sent += 1
+        self.transport.write(self.packet, address)
+
+    def datagramReceived(self, data, address):
+        self.received += 1
+        if self.received == self.total:
+            self.done.callback(self.total / (time.time() - self.started))
+        elif self.sent < self.total:
+            self._send()
+
+
+def _responders(count):
+    return [KRPC_Responder(routing_table_class=FlatRoutingTable)
+            for _ in range(count)]
+
+
+@defer.inlineCallbacks
+def serve(count, multiplex):
+    ports = []
+    if multiplex:
+        multiplexer = KRPC_Multiplexer()
+        for responder in _responders(count):
+            multiplexer.host(responder)
+        ports.append(reactor.listenUDP(0, multiplexer, interface=LOCALHOST))
+    else:
+        for responder in _responders(count):
+            ports.append(reactor.listenUDP(0, responder, interface=LOCALHOST))
+    addresses = [(LOCALHOST, port.getHost().port) for port in ports]
+    # Spread the pings over the node ids
+    # (ie over the sockets, or repeatedly over the single one)
+    addresses = [addresses[i % len(addresses)] for i in range(count)]
+
+    client = _PingClient(addresses, PINGS)
+    client_port = reactor.listenUDP(0, client, interface=LOCALHOST)
+    client.start()
+    timeout = reactor.callLater(60, client.done.errback,
+                                Exception("pings were lost"))
+    try:
+        pings = yield client.done
+    finally:
+        if timeout.active():
+            timeout.cancel()
+        for port in ports + [client_port]:
+            yield port.stopListening()
+    defer.returnValue((pings, len(ports)))
+
+
+@defer.inlineCallbacks
+def main(sizes):
+    # Measure the sockets, not the bandwidth shaping
+    SendScheduler._instance = SendScheduler(global_rate=0, host_rate=0)
+    try:
+        for count in sizes:
+            baseline, sockets = yield serve(count, False)
+            report("%d node ids, %d sockets" % (count, sockets), baseline)
+            pings, sockets = yield serve(count, True)
+            report("%d node ids, %d socket (multiplexer)" % (count, sockets),
+                   pings, baseline)
+    finally:
+        reactor.stop()
+
+if __name__ == "__main__":
+    reactor.callWhenRunning(main, [int(size) for size in sys.argv[1:]]
+                            or NODE_IDS)
+    reactor.run()
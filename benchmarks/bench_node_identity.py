@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Benchmark the contact.Node identity model in its hot spots
+
+    sets: the membership tests/unions done by the iterators
+        (MDHT.queried, KRPC_Iterator._iterate)
+    kbucket: KBucket.offer_node / remove_node
+    routing table: TreeRoutingTable.offer_node / remove_node
+
+Each operation is timed with nodes hashed the way they used to be
+(a long built out of the re-encoded node, compared through the hash)
+and with the current node_id based identity
+
+    python -m benchmarks.bench_node_identity
+
+"""
+import random
+
+from mdht import contact
+from mdht.coding import basic_coder
+from mdht.kademlia.kbucket import KBucket
+from mdht.kademlia.routing_table import TreeRoutingTable
+from benchmarks.common import rate, report, random_node
+
+
+class _EncodedIdentityNode(contact.Node):
+    """A node hashed and compared like before (by its encoded form)"""
+
+    def __eq__(self, other):
+        return not self.__ne__(other)
+
+    def __hash__(self):
+        return basic_coder.btol(contact.encode_node(self))
+
+    def __ne__(self, other):
+        return other.__hash__() ^ self.__hash__()
+
+
+def make_nodes(count, node_class):
+    nodes = []
+    for _ in range(count):
+        node = random_node()
+        nodes.append(node_class(node.node_id, node.address))
+    return nodes
+
+
+def bench(label, setup, number):
+    """Time the function built by setup(node_class) for both node classes"""
+    baseline = rate(setup(_EncodedIdentityNode), number=number)
+    report("%s (encoded)" % label, baseline)
+    report("%s (node_id)" % label, rate(setup(contact.Node), number=number),
+           baseline)
+
+
+def sets(node_class):
+    nodes = make_nodes(1000, node_class)
+    queried = set(random.sample(nodes, 500))
+
+    def run():
+        new_nodes = [node for node in nodes if node not in queried]
+        set(nodes).union(new_nodes)
+    return run
+
+
+def kbucket(node_class):
+    nodes = make_nodes(8, node_class)
+    bucket = KBucket(0, 2**160)
+
+    def run():
+        for node in nodes:
+            bucket.offer_node(node)
+        for node in nodes:
+            bucket.remove_node(node)
+    return run
+
+
+def routing_table(node_class):
+    nodes = make_nodes(1000, node_class)
+    table = TreeRoutingTable()
+    for node in nodes:
+        table.offer_node(node)
+    nodes = table.get_nodes().values()
+
+    def run():
+        for node in nodes:
+            table.remove_node(node)
+        for node in nodes:
+            table.offer_node(node)
+    return run
+
+
+def main():
+    bench("1000 node set ops", sets, 100)
+    bench("kbucket offer/remove 8 nodes", kbucket, 5000)
+    bench("routing table remove/offer", routing_table, 20)
+
+if __name__ == "__main__":
+    main()
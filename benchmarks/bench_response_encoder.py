@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Benchmark krpc_coder._response_encoder for an 8 node find_node response
+
+    cold: the compact form of every node is recomputed on each call
+          (as it was before nodes cached their compact form)
+    warm: the compact form cached on each node is reused
+
+    python -m benchmarks.bench_response_encoder
+
+"""
+import os
+import random
+
+from mdht.coding import krpc_coder
+from mdht.krpc_types import Response
+from benchmarks.common import rate, report, random_node
+
+
+def main():
+    nodes = [random_node() for _ in range(8)]
+    response = Response(_transaction_id=os.urandom(2),
+                        _from=random.getrandbits(160), nodes=nodes)
+
+    def cold():
+        for node in nodes:
+            node._compact = None
+        krpc_coder._response_encoder(response)
+
+    def warm():
+        krpc_coder._response_encoder(response)
+
+    baseline = rate(cold)
+    report("_response_encoder 8 nodes (cold)", baseline)
+    report("_response_encoder 8 nodes (warm)", rate(warm), baseline)
+
+if __name__ == "__main__":
+    main()
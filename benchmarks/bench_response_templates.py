@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Compare building ping/find_node responses against the response templates
+
+    build: Query.build_response() + krpc_coder.encode()
+    template: krpc_coder.ResponseTemplates (as used by KRPC_Responder)
+
+    python -m benchmarks.bench_response_templates
+
+"""
+import random
+
+from mdht.coding import krpc_coder
+from benchmarks.common import rate, report, random_node, sample_messages
+
+
+def main():
+    node_id = random.getrandbits(160)
+    templates = krpc_coder.ResponseTemplates(node_id)
+    nodes = [random_node() for _ in range(8)]
+    messages = sample_messages()
+    ping = messages["ping query"]
+    find_node = messages["find_node query"]
+
+    def build(query, **kwargs):
+        response = query.build_response(**kwargs)
+        response._from = node_id
+        return krpc_coder.encode(response)
+
+    baseline = rate(lambda: build(ping))
+    report("ping response (build)", baseline)
+    report("ping response (template)",
+           rate(lambda: templates.ping(ping._transaction_id)), baseline)
+
+    baseline = rate(lambda: build(find_node, nodes=nodes))
+    report("find_node response (build)", baseline)
+    report("find_node response (template)",
+           rate(lambda: templates.find_node(find_node._transaction_id, nodes)),
+           baseline)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Compare the routing table implementations across table sizes
+
+    offer/remove: remove then offer back 1000 of the table's nodes
+    get_closest_nodes: uncached lookup of 100 random targets
+    evicting offer: offer 1000 fresh nodes to a table of stale
+        nodes (each of them taking the place of a stale node), after
+        which the nodes of the table have to match those of its
+        kbuckets
+
+The table sizes can be given on the command line
+
+    python -m benchmarks.bench_routing_tables [size ...]
+
+"""
+import sys
+import time
+import random
+
+from config import constants
+from mdht.kademlia.routing_table import TreeRoutingTable, FlatRoutingTable
+from benchmarks.common import rate, report, random_node
+
+SIZES = [1000, 10000, 100000]
+SAMPLE = 1000
+TARGETS = 100
+
+
+def fill(table_class, nodes):
+    table = table_class()
+    for node in nodes:
+        table.offer_node(node)
+    return table
+
+
+def stale_node():
+    node = random_node()
+    node.last_updated -= 2 * constants.node_timeout
+    return node
+
+
+def evicting_offer(table_class, size):
+    table = fill(table_class, [stale_node() for _ in range(size)])
+    fresh_nodes = [random_node() for _ in range(SAMPLE)]
+    start = time.time()
+    for node in fresh_nodes:
+        table.offer_node(node)
+    elapsed = time.time() - start
+    bucket_nodes = sum(len(k.get_nodes()) for k in table.get_kbuckets())
+    assert len(table.nodes_dict) == bucket_nodes, "evicted nodes were kept"
+    return len(fresh_nodes) / elapsed
+
+
+def main(sizes):
+    for size in sizes:
+        nodes = [random_node() for _ in range(size)]
+        sample = random.sample(nodes, min(size, SAMPLE))
+        targets = [random.getrandbits(constants.id_size)
+                   for _ in range(TARGETS)]
+        tree = fill(TreeRoutingTable, nodes)
+        flat = fill(FlatRoutingTable, nodes)
+
+        def offer_remove(table):
+            def run():
+                for node in sample:
+                    table.remove_node(node)
+                for node in sample:
+                    table.offer_node(node)
+            return rate(run, number=10) * len(sample)
+
+        def get_closest_nodes(table):
+            def run():
+                for target in targets:
+                    table._find_closest_nodes(target, constants.k)
+            return rate(run, number=20) * TARGETS
+
+        for label, bench in [("offer/remove", offer_remove),
+                             ("get_closest_nodes", get_closest_nodes)]:
+            baseline = bench(tree)
+            report("%d nodes %s (tree)" % (size, label), baseline)
+            report("%d nodes %s (flat)" % (size, label), bench(flat),
+                   baseline)
+        baseline = evicting_offer(TreeRoutingTable, size)
+        report("%d nodes evicting offer (tree)" % size, baseline)
+        report("%d nodes evicting offer (flat)" % size,
+               evicting_offer(FlatRoutingTable, size), baseline)
+        print
+
+if __name__ == "__main__":
+    main([int(size) for size in sys.argv[1:]] or SIZES)
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Benchmark the outbound bandwidth shaping (mdht.send_scheduler)
+
+    overhead: the cost of sending a packet that fits in the budgets,
+        compared to writing it straight out
+    overload: 10 simulated seconds (on a task.Clock) of packets
+        offered at twice the global rate, to 200 hosts (40% responses,
+        10% pings, 50% lookup queries), with the throughput, the
+        queueing delay and the drops of each priority class
+
+    python -m benchmarks.bench_send_scheduler
+
+"""
+import random
+
+from twisted.internet import task
+
+from config import constants
+from mdht.send_scheduler import (SendScheduler, PRIORITY_RESPONSE,
+                                 PRIORITY_PING, PRIORITY_QUERY)
+from benchmarks.common import rate, report, sample_packets
+
+DURATION = 10
+STEP = 0.01
+HOSTS = ["10.0.%d.%d" % (i / 250, i % 250 + 1) for i in range(200)]
+MIX = [(PRIORITY_RESPONSE, "responses", 0.4),
+       (PRIORITY_PING, "pings", 0.1),
+       (PRIORITY_QUERY, "queries", 0.5)]
+
+
+def overhead():
+    packet = sample_packets()["find_node response"]
+    address = ("10.0.0.1", 6881)
+    write = lambda packet, address: None
+    unlimited = SendScheduler(global_rate=0, host_rate=0)
+    # Budgets that never run out
+    limited = SendScheduler(global_rate=2**60, host_rate=2**60)
+
+    baseline = rate(lambda: write(packet, address), number=200000)
+    report("write", baseline)
+    report("scheduler (no limits)",
+           rate(lambda: unlimited.send(write, packet, address,
+                                       PRIORITY_RESPONSE), number=200000),
+           baseline)
+    report("scheduler (within the limits)",
+           rate(lambda: limited.send(write, packet, address,
+                                     PRIORITY_RESPONSE), number=200000),
+           baseline)
+
+
+def overload():
+    clock = task.Clock()
+    scheduler = SendScheduler(_reactor=clock)
+    packets = sample_packets()
+    sizes = {PRIORITY_RESPONSE: len(packets["find_node response"]),
+             PRIORITY_PING: len(packets["ping query"]),
+             PRIORITY_QUERY: len(packets["get_peers query"])}
+    average_size = sum(sizes[priority] * share
+                       for priority, _, share in MIX)
+    # Packets offered per step, at twice the global rate
+    per_step = 2 * constants.global_bandwidth_rate * STEP / average_size
+
+    offered = dict((priority, 0) for priority, _, _ in MIX)
+    sent = dict((priority, []) for priority, _, _ in MIX)
+
+    def writer(priority, sent_at):
+        def write(packet, address):
+            sent[priority].append(clock.seconds() - sent_at)
+        return write
+
+    owed = 0.0
+    max_depth = 0
+    for _ in xrange(int(DURATION / STEP)):
+        owed += per_step
+        while owed >= 1:
+            owed -= 1
+            draw = random.random()
+            for priority, _, share in MIX:
+                draw -= share
+                if draw < 0:
+                    break
+            offered[priority] += 1
+            scheduler.send(writer(priority, clock.seconds()),
+                           "x" * sizes[priority],
+                           (random.choice(HOSTS), 6881), priority)
+        max_depth = max(max_depth, sum(scheduler.queue_depths()))
+        clock.advance(STEP)
+
+    stats = scheduler.get_stats()
+    print "global rate %d bytes/s, offered %d bytes/s, sent %d bytes/s" % (
+        constants.global_bandwidth_rate,
+        sum(offered[p] * sizes[p] for p in offered) / DURATION,
+        stats["sent_bytes"] / DURATION)
+    print "shaped %d bytes, dropped %d packets, max queue depth %d" % (
+        stats["shaped_bytes"], stats["dropped"], max_depth)
+    for priority, name, _ in MIX:
+        delays = sent[priority]
+        print "%-10s offered %5d  sent %5d  mean delay %.3fs" % (
+            name, offered[priority], len(delays),
+            sum(delays) / len(delays) if delays else 0)
+
+
+def main():
+    overhead()
+    print
+    overload()
+
+if __name__ == "__main__":
+    main()
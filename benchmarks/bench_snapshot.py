@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Benchmark warm starting a routing table
+
+    documents: what restoring from the database does once the
+        documents are fetched (parse the decimal id, build a
+        validating Node, offer it)
+    snapshot: snapshot.load of a snapshot file, then offering
+        the nodes
+
+The time taken to fetch the documents from MongoDB comes on top of
+the first one. The snapshot is then restored into the bounded tables
+(MultiOwnerRoutingTable and SubsecondRoutingTable), their 10 owner
+ids registered first as the protocols do, with the number of nodes
+they keep. The table sizes can be given on the command line
+
+    python -m benchmarks.bench_snapshot [size ...]
+
+"""
+import os
+import sys
+import time
+import random
+import tempfile
+
+from mdht import contact
+from mdht.kademlia import snapshot
+from mdht.kademlia.routing_table import (FlatRoutingTable,
+                                         MultiOwnerRoutingTable,
+                                         SubsecondRoutingTable,
+                                         _node_document)
+from benchmarks.common import random_node
+
+SIZES = [10000, 100000]
+OWNERS = 10
+
+
+def best_time(func, repeat=3):
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        times.append(time.time() - start)
+    return min(times)
+
+
+def main(sizes):
+    path = os.path.join(tempfile.mkdtemp(), "routing_table.snapshot")
+    for size in sizes:
+        nodes = [random_node() for _ in range(size)]
+        documents = [_node_document(node) for node in nodes]
+        snapshot.save(nodes, path)
+
+        def from_documents():
+            table = FlatRoutingTable()
+            for _node in documents:
+                table.offer_node(contact.Node(
+                    node_id=int(_node["_id"]),
+                    address=(_node["ip"], _node["port"]),
+                    last_updated=_node["last_updated"],
+                    totalrtt=_node["totalrtt"],
+                    successcount=_node["successcount"],
+                    failcount=_node["failcount"]))
+
+        def from_snapshot():
+            table = FlatRoutingTable()
+            for node in snapshot.load(path):
+                table.offer_node(node)
+
+        baseline = best_time(from_documents)
+        print "%d nodes (%d byte snapshot)" % (size, os.path.getsize(path))
+        print "  %-28s %8.1f ms" % ("documents", baseline * 1000)
+        elapsed = best_time(lambda: snapshot.load(path))
+        print "  %-28s %8.1f ms" % ("snapshot.load", elapsed * 1000)
+        elapsed = best_time(from_snapshot)
+        print "  %-28s %8.1f ms   x%.2f" % ("snapshot.load + offer",
+                                           elapsed * 1000, baseline / elapsed)
+        owner_ids = [random.getrandbits(160) for _ in range(OWNERS)]
+        for table_class in (MultiOwnerRoutingTable, SubsecondRoutingTable):
+            tables = []
+
+            def restore():
+                table = table_class()
+                for owner_id in owner_ids:
+                    table.add_owner(owner_id)
+                for node in snapshot.load(path):
+                    table.offer_node(node)
+                tables.append(table)
+
+            elapsed = best_time(restore)
+            print "  %-28s %8.1f ms   %d nodes kept" % (
+                table_class.__name__, elapsed * 1000,
+                len(tables[-1].get_nodes()))
+    os.remove(path)
+    os.rmdir(os.path.dirname(path))
+
+if __name__ == "__main__":
+    main([int(size) for size in sys.argv[1:]] or SIZES)
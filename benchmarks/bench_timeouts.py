@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Benchmark timing the outstanding transactions out with many of them
+
+    callLater: a reactor DelayedCall per transaction (as it was)
+    wheel: the KRPC_Sender's TimerWheel (mdht.timer_wheel)
+
+with 10k, 50k and 100k transactions outstanding
+
+    timers: scheduling a timeout and cancelling the oldest one,
+        with a reactor iteration every 100 timeouts
+    queries: KRPC_Sender.sendQuery, then the response to the oldest
+        outstanding query (which cancels its timeout), with a reactor
+        iteration every 100 queries. The queries are spread over as
+        many senders as their transaction tables require, all sharing
+        the same timeouts
+    reactor iteration: reactor.runUntilCurrent() + reactor.timeout()
+
+The reactor is not run, its iterations are done by hand. The
+numbers of outstanding transactions can be given on the command line
+
+    python -m benchmarks.bench_timeouts [outstanding ...]
+
+"""
+import sys
+import random
+from itertools import cycle
+from collections import deque
+
+from twisted.internet import reactor
+
+from mdht.krpc_types import Query, Response
+from mdht.timer_wheel import TimerWheel
+from mdht.send_scheduler import SendScheduler
+from mdht.protocols.krpc_sender import KRPC_Sender
+from mdht.kademlia.routing_table import FlatRoutingTable
+from benchmarks.common import rate, report
+
+OUTSTANDING = [10000, 50000, 100000]
+BATCH = 100
+
+
+class _ReactorTimeouts(object):
+    """Times the transactions out with reactor.callLater"""
+
+    def call_later(self, delay, func, *args):
+        return reactor.callLater(delay, func, *args)
+
+
+class _LocalRoutingTable(FlatRoutingTable):
+    """A fresh routing table per sender (nothing is read from the disk)"""
+
+    @classmethod
+    def instance(cls):
+        return cls()
+
+
+class _NullTransport(object):
+
+    def write(self, packet, address):
+        pass
+
+
+def iterate():
+    reactor.runUntilCurrent()
+    reactor.timeout()
+
+
+def make_sender(timeouts):
+    sender = KRPC_Sender(_LocalRoutingTable, random.getrandbits(160))
+    sender.transport = _NullTransport()
+    sender._timeouts = timeouts
+    # Not limited by any bandwidth budget
+    sender.send_scheduler = SendScheduler(global_rate=0, host_rate=0)
+    return sender
+
+
+def send_ping(sender):
+    query = Query()
+    query.rpctype = "ping"
+    d = sender.sendQuery(query, ("127.0.0.1", 6881), None)
+    d.addErrback(lambda failure: None)
+    return query
+
+
+def bench(outstanding, timeouts):
+    """@returns the timers, queries and reactor iteration rates"""
+    noop = lambda: None
+    timers = deque(timeouts.call_later(30, noop)
+                   for _ in xrange(outstanding))
+    iterate()
+
+    def schedule_cancel():
+        for _ in xrange(BATCH):
+            timers.append(timeouts.call_later(30, noop))
+            timers.popleft().cancel()
+        iterate()
+    timer_rate = rate(schedule_cancel, number=200) * BATCH
+    for timer in timers:
+        timer.cancel()
+    iterate()
+
+    senders = [make_sender(timeouts)]
+    # Leave room for the queries sent during a batch
+    capacity = senders[0].transactions.size - BATCH
+    senders.extend(make_sender(timeouts)
+                   for _ in xrange(outstanding / capacity))
+    next_sender = cycle(senders).next
+    queries = deque()
+    for _ in xrange(outstanding):
+        sender = next_sender()
+        queries.append((sender, send_ping(sender)))
+    iterate()
+    responder_id = random.getrandbits(160)
+
+    def query_answer():
+        for _ in xrange(BATCH):
+            sender = next_sender()
+            queries.append((sender, send_ping(sender)))
+            sender, query = queries.popleft()
+            response = Response(_transaction_id=query._transaction_id,
+                                _from=responder_id)
+            sender.krpcReceived(response, ("127.0.0.1", 6881))
+        iterate()
+    query_rate = rate(query_answer, number=50) * BATCH
+    iteration_rate = rate(iterate, number=2000)
+    for sender in senders:
+        for transaction in sender.transactions.transactions():
+            transaction.timeout_call.cancel()
+    iterate()
+    return timer_rate, query_rate, iteration_rate
+
+
+def main(sizes):
+    labels = ["timers", "queries", "reactor iteration"]
+    for outstanding in sizes:
+        wheel = TimerWheel()
+        baselines = bench(outstanding, _ReactorTimeouts())
+        results = bench(outstanding, wheel)
+        wheel.stop()
+        for label, baseline, result in zip(labels, baselines, results):
+            label = "%dk outstanding %s" % (outstanding / 1000, label)
+            report("%s (callLater)" % label, baseline)
+            report("%s (wheel)" % label, result, baseline)
+        print
+
+if __name__ == "__main__":
+    main([int(size) for size in sys.argv[1:]] or OUTSTANDING)
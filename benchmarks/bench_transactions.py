@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Benchmark the bookkeeping of the outstanding transactions
+
+    dict: random 32 bit ids drawn until one is free, the transactions
+        (plain objects) kept in a dict by id (as it was)
+    table: mdht.transaction.TransactionTable (2 byte ids) holding
+        slotted Transaction records
+
+Each operation creates a transaction, allocates its id, finds it
+back (as a reply does) and removes it, with the given numbers of
+transactions outstanding. The memory taken by a transaction record
+and the size of a ping query under both kinds of ids are printed
+as well
+
+    python -m benchmarks.bench_transactions [outstanding ...]
+
+"""
+import sys
+import time
+import random
+
+from mdht.coding import basic_coder, krpc_coder
+from mdht.krpc_types import Query
+from mdht.transaction import Transaction, TransactionTable
+from benchmarks.common import rate, report
+
+OUTSTANDING = [100, 1000, 4000]
+ADDRESS = ("127.0.0.1", 6881)
+
+
+class _LegacyTransaction(object):
+    """A Transaction as it was (without __slots__)"""
+
+    def __init__(self):
+        self.query = None
+        self.deferred = None
+        self.timeout_call = None
+        self.address = None
+        self.time = time.time()
+
+
+class _DictTransactions(object):
+    """The transaction bookkeeping of KRPC_Sender, as it was"""
+
+    def __init__(self):
+        self._transactions = {}
+
+    def generate_transaction_id(self):
+        while True:
+            transaction_id = random.getrandbits(32)
+            if transaction_id not in self._transactions:
+                return transaction_id
+
+    def add(self, transaction):
+        transaction_id = self.generate_transaction_id()
+        self._transactions[transaction_id] = transaction
+        return transaction_id
+
+    def get(self, transaction_id, address):
+        return self._transactions.get(transaction_id, None)
+
+    def remove(self, transaction):
+        transaction_id = transaction.query._transaction_id
+        if transaction_id in self._transactions:
+            del self._transactions[transaction_id]
+
+
+def bookkeeping(table, transaction_class, outstanding):
+    def add():
+        transaction = transaction_class()
+        transaction.query = Query()
+        transaction.address = ADDRESS
+        transaction.query._transaction_id = table.add(transaction)
+        return transaction
+
+    for _ in xrange(outstanding):
+        add()
+
+    def run():
+        transaction = add()
+        table.get(transaction.query._transaction_id, ADDRESS)
+        table.remove(transaction)
+    return run
+
+
+def record_size(transaction):
+    size = sys.getsizeof(transaction)
+    if hasattr(transaction, "__dict__"):
+        size += sys.getsizeof(transaction.__dict__)
+    return size
+
+
+def main(sizes):
+    for outstanding in sizes:
+        baseline = rate(bookkeeping(_DictTransactions(), _LegacyTransaction,
+                                    outstanding), number=100000)
+        report("%d outstanding (dict)" % outstanding, baseline)
+        report("%d outstanding (table)" % outstanding,
+               rate(bookkeeping(TransactionTable(), Transaction,
+                                outstanding), number=100000),
+               baseline)
+    print
+
+    print "transaction record (dict): %d bytes" % record_size(
+        _LegacyTransaction())
+    print "transaction record (table): %d bytes" % record_size(Transaction())
+    query = Query(rpctype="ping", _from=random.getrandbits(160))
+    query._transaction_id = basic_coder.ltob(2**31 + random.getrandbits(31))
+    print "ping query with a 32 bit id: %d bytes" % len(
+        krpc_coder.encode(query))
+    query._transaction_id = TransactionTable().add(Transaction())
+    print "ping query with a 2 byte id: %d bytes" % len(
+        krpc_coder.encode(query))
+
+if __name__ == "__main__":
+    main([int(size) for size in sys.argv[1:]] or OUTSTANDING)
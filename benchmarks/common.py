@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Helpers shared by the benchmark scripts
+
+The benchmarks are run from the root of the project, ie:
+
+    python -m benchmarks.bench_krpc_decode
+
+"""
+import os
+import random
+import timeit
+
+from mdht import contact
+from mdht.coding import basic_coder, krpc_coder
+from mdht.coding.bencode import bdecode, bencode
+from mdht.krpc_types import Query, Response, Error
+
+# Default number of calls timed in each run
+NUMBER = 20000
+# Number of runs, the best of which is reported
+REPEAT = 3
+
+
+def rate(func, number=NUMBER, repeat=REPEAT):
+    """Return the number of calls per second of `func' (best run)"""
+    best = min(timeit.repeat(func, number=number, repeat=repeat))
+    return number / best
+
+
+def report(label, ops, baseline=None):
+    """Print a single benchmark result (and its speedup over baseline)"""
+    line = "%-45s %12.0f ops/s" % (label, ops)
+    if baseline:
+        line += "   x%.2f" % (ops / baseline)
+    print line
+
+
+def random_node(port=None):
+    """Create a node with a random id and address"""
+    ip = ".".join(str(random.randint(1, 254)) for _ in range(4))
+    port = port or random.randint(1024, 65535)
+    return contact.Node(random.getrandbits(160), (ip, port))
+
+
+def sample_messages():
+    """
+    Return a dict of KRPC messages typical of the DHT traffic
+
+    The keys name the kind of message
+
+    """
+    messages = {}
+    transaction_id = os.urandom(2)
+
+    q = Query(rpctype="ping", _from=random.getrandbits(160))
+    q._transaction_id = transaction_id
+    messages["ping query"] = q
+
+    q = Query(rpctype="find_node", _from=random.getrandbits(160),
+              target_id=random.getrandbits(160))
+    q._transaction_id = transaction_id
+    messages["find_node query"] = q
+
+    q = Query(rpctype="get_peers", _from=random.getrandbits(160),
+              target_id=random.getrandbits(160))
+    q._transaction_id = transaction_id
+    messages["get_peers query"] = q
+
+    messages["ping response"] = Response(
+        _transaction_id=transaction_id, _from=random.getrandbits(160))
+
+    messages["find_node response"] = Response(
+        _transaction_id=transaction_id, _from=random.getrandbits(160),
+        nodes=[random_node() for _ in range(8)])
+
+    messages["get_peers response"] = Response(
+        _transaction_id=transaction_id, _from=random.getrandbits(160),
+        token=random.getrandbits(32),
+        peers=[random_node().address for _ in range(8)])
+
+    messages["error"] = Error(_transaction_id=transaction_id, code=201,
+                              message="Generic Error")
+    return messages
+
+
+def sample_packets():
+    """
+    Return a dict of bencoded KRPC packets typical of the DHT traffic
+
+    The keys name the kind of packet
+
+    """
+    packets = dict((name, krpc_coder.encode(message))
+                   for name, message in sample_messages().items())
+
+    # Most clients add their version and our external ip
+    # (and sometimes ipv6 nodes) to what they send back
+    rpc_dict = bdecode(packets["find_node response"])
+    rpc_dict["v"] = "LT\x01\x00"
+    rpc_dict["ip"] = basic_coder.encode_address(random_node().address)
+    rpc_dict["r"]["nodes6"] = "\x00" * 38 * 8
+    packets["find_node response (v, ip, nodes6)"] = bencode(rpc_dict)
+    return packets
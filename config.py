@@ -25,6 +25,13 @@ REDIS_SETTING = {
 # nodes num for opening
 NODES_NUM = 100
 
+# worker processes the nodes are spread over (@see mdht.supervisor)
+WORKERS_NUM = 1
+
+# whether the nodes of a process share a single socket
+# (@see mdht.protocols.krpc_multiplexer)
+MULTIPLEX = False
+
 # how many times do we retry node startup action
 STARTUP_RETRIES = 5
 #
@@ -38,6 +45,20 @@ class constants(object):
 # k as used in Kademlia
 constants.k = 8
 
+# Number of recently seen nodes each KBucket keeps as candidates
+# to take the place of its evicted nodes
+constants.replacement_cache_size = 8
+
+# Number of kbuckets whose closest nodes candidates are cached
+# by a routing table (@see _RoutingTable.get_closest_nodes),
+# 0 disables the cache
+constants.closest_cache_size = 1024
+
+# Largest number of closest nodes candidates cached for a kbucket:
+# a sparse kbucket borrowing more of them from its neighbours is
+# looked up with the distance ordered walk instead
+constants.closest_cache_max_candidates = 64
+
 # The size of the identification number used for resources and
 # nodes in the Kademlia network (bits)
 constants.id_size = 160
@@ -45,6 +66,11 @@ constants.id_size = 160
 # Time after which an RPC will timeout and fail (seconds)
 constants.rpctimeout = 30
 
+# Resolution of the timer wheel timing the outstanding RPCs out
+# (seconds), and its number of slots (@see mdht.timer_wheel)
+constants.timer_wheel_tick = 0.5
+constants.timer_wheel_slots = 128
+
 # Time after which a high level query (as used in the SimpleNodeProtocol)
 # should timeout (seconds)
 constants.query_timeout = 60           # 1 minute
@@ -65,10 +91,31 @@ constants.node_timeout = 900         # 15 minutes
 # Time between each call to the NICE routing table update algorithm (seconds)
 constants.NICEinterval = 6
 
+# Time after which a kbucket that has not changed gets refreshed
+# (by looking up a random id in its range) (seconds)
+constants.kbucket_refresh_timeout = 15 * 60    # 15 minutes
+
 # This interval determines how often the DHT's state data will be
 # saved into a file on disk (seconds)
 constants.DUMPinterval = 12 * 60 * 60  # 3 minutes
 
+# Largest number of nodes deleted at once when the changes to
+# the routing table are flushed to the database
+constants.flush_chunk_size = 500
+
+# File the routing table is saved into on shutdown, and
+# restored from on startup (@see mdht.kademlia.snapshot)
+constants.snapshot_file = os.path.join(ROOT_PATH, "routing_table.snapshot")
+
+# Routing table implementation the nodes run with, one of "tree",
+# "flat", "multi_owner" or "subsecond" (@see main.py --routing-table
+# and mdht.kademlia.routing_table.table_class)
+constants.routing_table = "tree"
+
+# MongoDB collection the routing table is flushed into
+# (@see mdht.kademlia.routing_table._RoutingTable.flush)
+constants.routing_table_collection = "routing_table"
+
 # Size of the token (bits)
 constants.tokensize = 32
 
@@ -76,8 +123,13 @@ constants.tokensize = 32
 # will be terminated
 constants.token_timeout = 60 * 10         # 10 minutes
 
-# Transaction ID size (bits)
-constants.transaction_id_size = 32
+# Largest number of outstanding queries of a socket, whose
+# transaction ids are 2 bytes long (@see mdht.transaction)
+constants.transaction_table_size = 4096
+
+# Largest datagram that is considered to possibly be a KRPC (bytes)
+# (anything bigger is dropped before it is decoded)
+constants.max_packet_size = 4096
 
 # Failcount threshold: The number of KRPCs a node can fail before being
 # being remove from the routing table (int)
@@ -96,12 +148,36 @@ constants.bootstrap_addresses = [("67.18.187.143", 1337),
 # bootstrap_addresses = [("dht.transmissionbt.com", 6881)]
 
 
-# Global outgoing bandwidth limit (bytes / second)
+# Global outgoing bandwidth limit (bytes / second), shared out
+# evenly between the worker processes (@see main.run_worker)
 constants.global_bandwidth_rate = 20 * 1024   # 20 kilobytes
 
-# Outgoing bandwidth limit per host (bytes / second)
+# Outgoing bandwidth limit per host (bytes / second), shared out as well
 constants.host_bandwidth_rate = 5 * 1024      # 5 kilobytes
 
+# Burst allowed above these limits (seconds worth of bandwidth)
+constants.bandwidth_burst = 1
+
+# Largest number of outgoing packets held back by the bandwidth
+# limits (@see mdht.send_scheduler)
+constants.send_queue_size = 1024
+
+# Seconds before restarting a worker process that died, doubled
+# every time it dies again shortly after (@see mdht.supervisor)
+constants.worker_restart_delay = 1
+constants.worker_restart_max_delay = 60
+
+# Seconds between two stats reports of the worker processes
+constants.worker_stats_interval = 60
+
+# Largest number of queries outstanding on a socket shared by
+# many node ids (2 byte transaction ids, at most 2**15)
+constants.multiplexer_transaction_table_size = 2**15
+
+# Number of remote addresses for which a shared socket remembers
+# the node id they know us by
+constants.multiplexer_known_addresses = 64 * 1024
+
 
 # The default port on which DHTBot will run
 constants.dht_port = 6900
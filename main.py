@@ -1,35 +1,115 @@
 #!/usr/bin/env python
 # encoding: utf-8
+import os
 import sys
 import random
+import argparse
 from logging import DEBUG
 from twisted.internet import reactor
 
 from logger import Logger
+from mdht import supervisor
 from mdht.mdht_node import MDHT
-from config import ROOT_PATH, NODES_NUM, constants
+from mdht.kademlia.routing_table import TABLE_CLASSES
+from mdht.protocols.krpc_multiplexer import KRPC_Multiplexer
+from config import ROOT_PATH, NODES_NUM, WORKERS_NUM, MULTIPLEX, constants
 
 #add project path
 sys.path.append(ROOT_PATH)
 
 
-def main():
-    #distribute num nodes to crawl infos
-    num = 0
-    node_id_list = []
-    _port = constants.dht_port
+def start_nodes(nums, multiplex=False):
+    """
+    Start the nodes of the given numbers
 
-    Logger.basicConfig(level=DEBUG)
-    #Logger.basicConfig(level=DEBUG, filename=ROOT_PATH+"/log/mdht.log")
+    Node num takes a random id within the num-th piece
+    of the id space, and listens on port dht_port + num.
+    With multiplex, the nodes all share a single socket
+    instead, on the port of the first of them
 
-    while num < NODES_NUM:
+    @return a list of the MDHT nodes
+
+    """
+    multiplexer = None
+    if multiplex and nums:
+        multiplexer = KRPC_Multiplexer()
+        reactor.listenUDP(constants.dht_port + nums[0], multiplexer)
+    nodes = []
+    for num in nums:
         node_id = random.randint(0, constants.piece) + num*constants.piece
-        node_id_list.append(node_id)
-        MDHT(node_id, bootstrap_addresses=constants.bootstrap_addresses, port=_port)
-        num += 1
-        _port += 1
+        _port = constants.dht_port + num
+        nodes.append(MDHT(node_id,
+                          bootstrap_addresses=constants.bootstrap_addresses,
+                          port=_port, multiplexer=multiplexer))
+    return nodes
+
 
+def run_worker(worker, workers, stats_fd, multiplex):
+    """
+    Run the share of the nodes of the given worker
+
+    With several workers, each of them saves its routing table on
+    its own (file and collection), and sends within its share of
+    the bandwidth limits: a SendScheduler only covers its process
+
+    """
+    if workers > 1:
+        # The routing tables of the workers hold different nodes
+        constants.snapshot_file = "%s.%d" % (constants.snapshot_file, worker)
+        constants.routing_table_collection = "%s_%d" % (
+            constants.routing_table_collection, worker)
+        constants.global_bandwidth_rate /= float(workers)
+        constants.host_bandwidth_rate /= float(workers)
+    nodes = start_nodes(supervisor.worker_nums(worker, workers, NODES_NUM),
+                        multiplex)
+    if stats_fd is not None:
+        stream = supervisor.open_stats_stream(stats_fd)
+        reporter = supervisor.StatsReporter([node.proto for node in nodes],
+                                            stream)
+        reporter.start()
     reactor.run()
 
+
+def run_supervisor(workers, multiplex):
+    """Run the nodes in the given number of worker processes"""
+    script = os.path.abspath(__file__)
+    options = ["--routing-table", constants.routing_table]
+    if multiplex:
+        options.append("--multiplex")
+    command = lambda worker: supervisor.python_command(
+        script, "--worker", worker, "--workers", workers, "--stats-fd",
+        supervisor.STATS_FD, *options)
+    supervisor.Supervisor(workers, command).start()
+    reactor.run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the DHT nodes")
+    parser.add_argument("--workers", type=int, default=WORKERS_NUM,
+                        help="number of worker processes running the nodes")
+    parser.add_argument("--worker", type=int,
+                        help="run the share of the nodes of this worker")
+    parser.add_argument("--stats-fd", type=int,
+                        help="report the stats to the supervisor")
+    parser.add_argument("--multiplex", action="store_true",
+                        default=MULTIPLEX,
+                        help="serve all the nodes of a process from "
+                             "a single socket")
+    parser.add_argument("--routing-table", choices=sorted(TABLE_CLASSES),
+                        default=constants.routing_table,
+                        help="routing table implementation of the nodes")
+    args = parser.parse_args()
+    constants.routing_table = args.routing_table
+
+    Logger.basicConfig(level=DEBUG)
+    #Logger.basicConfig(level=DEBUG, filename=ROOT_PATH+"/log/mdht.log")
+
+    if args.worker is not None:
+        run_worker(args.worker, args.workers, args.stats_fd, args.multiplex)
+    elif args.workers > 1:
+        run_supervisor(args.workers, args.multiplex)
+    else:
+        run_worker(0, 1, None, args.multiplex)
+
 if __name__ == "__main__":
     main()
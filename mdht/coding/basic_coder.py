@@ -10,9 +10,19 @@ standard as part of BitTorrent.
 
 """
 import socket
+import struct
+from binascii import hexlify, unhexlify
 
 from config import constants
 
+# Fixed width network formats (big endian)
+_uint16 = struct.Struct("!H")     # ports
+_uint32 = struct.Struct("!I")     # transaction ids and tokens
+_compact_address = struct.Struct("!4sH")  # ip, port
+
+# Network ids fall into the range [0, _network_id_limit)
+_network_id_limit = 2**constants.id_size
+
 
 class InvalidDataError(Exception):
     """
@@ -34,15 +44,17 @@ class InvalidDataError(Exception):
 
 def btol(network_order_byte_string):
     """Convert the bencoded int into a python long"""
-    return long(str(network_order_byte_string).encode("hex"), 16)
+    if len(network_order_byte_string) == 4:
+        return _uint32.unpack(network_order_byte_string)[0]
+    return long(hexlify(network_order_byte_string), 16)
 
 
 def ltob(long_number):
     """Convert a python long into a bencoded int"""
-    numstring = hex(long_number)[2:].rstrip("L")
+    numstring = "%x" % long_number
     if len(numstring) % 2 == 1:
-        numstring = "0%s" % numstring  # keep on adding padding zero
-    return numstring.decode("hex")
+        numstring = "0" + numstring  # keep on adding padding zero
+    return unhexlify(numstring)
 
 
 def encode_network_id(network_id):
@@ -52,12 +64,12 @@ def encode_network_id(network_id):
     @raises InvalidDataError when the network id is invalid
 
     """
-    if network_id < 0 or network_id >= 2**constants.id_size:
+    if network_id < 0 or network_id >= _network_id_limit:
         raise InvalidDataError(
             "The network ID's value falls out of the valid range",
             network_id)
-    encoded_network_id = ltob(network_id)
-    return _pad_zeros(encoded_network_id, 20)
+    # 40 hex digits make up the 20 bytes of a network id
+    return unhexlify("%040x" % network_id)
 
 
 def decode_network_id(network_id_string):
@@ -71,8 +83,7 @@ def decode_network_id(network_id_string):
         raise InvalidDataError(
             "The network id string has an improper length",
             network_id_string)
-    decoded_network_id = btol(network_id_string)
-    return decoded_network_id
+    return long(hexlify(network_id_string), 16)
 
 
 def decode_port(port_string):
@@ -86,7 +97,7 @@ def decode_port(port_string):
         raise InvalidDataError(
             "The port string is too short or too long",
             port_string)
-    return btol(port_string)
+    return _uint16.unpack(port_string)[0]
 
 
 def encode_port(port):
@@ -105,8 +116,7 @@ def encode_port(port):
         raise InvalidDataError(
             "The port number is invalid",
             port)
-    encoded_port = ltob(port)
-    return _pad_zeros(encoded_port, 2)
+    return _uint16.pack(port)
 
 
 def encode_address(address):
@@ -119,11 +129,11 @@ def encode_address(address):
     try:
         (ip, port) = address
         ip_string = socket.inet_aton(ip)  # change ip string to 32 bit string (4 bytes at all)
-        # Make sure that a port's value is padded to two bytes
-        # in the encoding, since each address string must
-        # take up six bytes for the encoding/decoding to work
+        # A port always takes up two bytes in the encoding,
+        # since each address string must take up six bytes
+        # for the encoding/decoding to work
         port_string = encode_port(port)
-        return "%s%s" % (ip_string, port_string)
+        return ip_string + port_string
     except (socket.error, ValueError):
         raise InvalidDataError(
             "The address had an invalid format",
@@ -142,27 +152,38 @@ def decode_address(address_string):
             raise InvalidDataError(
                 "The address string has an invalid length",
                 address_string)
-        ip = socket.inet_ntoa(address_string[:4])
-        port = decode_port(address_string[4:])
-        return (ip, port)
-    except (socket.error, TypeError):
+        ip, port = _compact_address.unpack(address_string)
+        return (socket.inet_ntoa(ip), port)
+    except (socket.error, struct.error, TypeError):
         raise InvalidDataError(
             "The address string has an invalid format",
             address_string)
-#
-# Private
-#
 
 
-def _pad_zeros(string, size):
+def decode_addresses(addresses_string):
     """
-    Pad string to 'size' with zeros on the left  hand side
+    Decodes a concatenation of network format address strings
+
+    The whole string is unpacked in one pass into a list
+    of address tuples
 
-    ie: _pad_zeros('\xff', 2) becomes '\x00\xff'
+    @throws InvalidDataError if the input is not a string or its
+        length is not a multiple of 6
 
     """
-    num_zeros = size - len(string)
-    if num_zeros > 0:
-        return ("\x00" * num_zeros) + string
-    else:
-        return string
+    try:
+        if len(addresses_string) % 6 != 0:
+            raise InvalidDataError(
+                "The addresses string has an invalid length",
+                addresses_string)
+        unpack_from = _compact_address.unpack_from
+        inet_ntoa = socket.inet_ntoa
+        addresses = []
+        for offset in xrange(0, len(addresses_string), 6):
+            ip, port = unpack_from(addresses_string, offset)
+            addresses.append((inet_ntoa(ip), port))
+        return addresses
+    except (struct.error, TypeError):
+        raise InvalidDataError(
+            "The addresses string has an invalid format",
+            addresses_string)
@@ -95,8 +95,9 @@ class Bencached(object):
     def __init__(self, s):
         self.bencoded = s
 
-    def encode_bencached(x, r):
-        r.append(x.bencoded)
+
+def encode_bencached(x, r):
+    r.append(x.bencoded)
 
 
 def encode_int(x, r):
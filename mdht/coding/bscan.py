@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Offset based bencode scanner used on the receive path
+
+bencode.bdecode builds a complete python object tree out of a packet,
+slicing a new string for every key and value it comes across. The
+scanner in this module walks the packet exactly once while only keeping
+track of offsets into the original string. Only the values asked for by
+the caller are sliced out of the packet, everything else (client
+versions, external ips, ipv6 node lists...) is skipped over by offset
+arithmetic alone.
+
+Note: skipped values are only checked for proper framing (lengths,
+terminators and nesting), their contents are never looked at
+
+@see mdht.coding.bencode
+
+"""
+from mdht.coding.bencode import BTFailure, decode_func
+
+
+def bscan(x, fields):
+    """
+    Decode the bencoded dict `x', keeping only the keys found in `fields'
+
+    @param fields: a dict mapping each wanted key onto either None
+        (the value is decoded in full) or onto another dict of the
+        same form (the value must be a bencoded dict which is
+        scanned in turn)
+    @returns a dict with the wanted keys that were present in `x'
+    @raises BTFailure if `x' is not a valid bencoded dict
+
+    """
+    try:
+        if x[0] != 'd':
+            raise ValueError
+        r, l = _scan_dict(x, 0, fields)
+    except (IndexError, KeyError, ValueError):
+        raise BTFailure("not a valid bencoded string")
+    if l != len(x):
+        raise BTFailure("invalid bencoded value (data after valid prefix)")
+    return r
+
+##
+## Private scanning helpers
+##
+
+
+def _scan_dict(x, f, fields):
+    """
+    Scan the dict starting at offset `f' in `x'
+
+    @returns a tuple (dict of wanted values, offset after the dict)
+
+    """
+    r, f = {}, f+1
+    while x[f] != 'e':
+        colon = x.index(':', f)
+        n = int(x[f:colon])
+        if n < 0 or (x[f] == '0' and colon != f+1):
+            raise ValueError
+        colon += 1
+        f = colon + n
+        # KRPC keys are mostly a single character long
+        # and those strings are shared by the interpreter,
+        # so slicing the key out costs next to nothing
+        key = x[colon:f]
+        if key not in fields:
+            f = skip_func[x[f]](x, f)
+            continue
+        subfields = fields[key]
+        if subfields is not None:
+            if x[f] != 'd':
+                raise ValueError
+            r[key], f = _scan_dict(x, f, subfields)
+        elif x[f] in _digits:
+            # Strings are by far the most common values, so
+            # slice them out here rather than in decode_string
+            colon = x.index(':', f)
+            n = int(x[f:colon])
+            if x[f] == '0' and colon != f+1:
+                raise ValueError
+            colon += 1
+            f = colon + n
+            r[key] = x[colon:f]
+        else:
+            r[key], f = decode_func[x[f]](x, f)
+    return (r, f + 1)
+
+_digits = frozenset('0123456789')
+
+
+def _skip_int(x, f):
+    return x.index('e', f+1) + 1
+
+
+def _skip_string(x, f):
+    colon = x.index(':', f)
+    n = int(x[f:colon])
+    if n < 0:
+        raise ValueError
+    return colon + 1 + n
+
+
+def _skip_list(x, f):
+    f += 1
+    while x[f] != 'e':
+        f = skip_func[x[f]](x, f)
+    return f + 1
+
+
+def _skip_dict(x, f):
+    f += 1
+    while x[f] != 'e':
+        f = _skip_string(x, f)
+        f = skip_func[x[f]](x, f)
+    return f + 1
+
+skip_func = {}
+skip_func['l'] = _skip_list
+skip_func['d'] = _skip_dict
+skip_func['i'] = _skip_int
+skip_func['0'] = _skip_string
+skip_func['1'] = _skip_string
+skip_func['2'] = _skip_string
+skip_func['3'] = _skip_string
+skip_func['4'] = _skip_string
+skip_func['5'] = _skip_string
+skip_func['6'] = _skip_string
+skip_func['7'] = _skip_string
+skip_func['8'] = _skip_string
+skip_func['9'] = _skip_string
@@ -7,9 +7,13 @@ originating from and destined to the DHT network
 @see mdht.krpc_types for the representation of KRPCs used by mdht
 
 """
+import re
+
+from config import constants
 from mdht import contact
 from mdht.coding import basic_coder
-from mdht.coding.bencode import bdecode, bencode, BTFailure
+from mdht.coding.bencode import bencode, decode_string, BTFailure
+from mdht.coding.bscan import bscan
 from mdht.krpc_types import Query, Response, Error
 
 
@@ -39,7 +43,11 @@ def decode(packet):
 
    """
     try:
-        dpacket = _decode(packet)
+        # Most packets are decoded in a single pass by the fast
+        # path, anything unusual goes through the generic decoder
+        dpacket = _fast_decode(packet)
+        if dpacket is None:
+            dpacket = _decode(packet)
     except (ValueError, KeyError, AttributeError, _ProtocolFormatError,
             basic_coder.InvalidDataError, BTFailure):
         raise InvalidKRPCError(packet)
@@ -47,6 +55,37 @@ def decode(packet):
         return dpacket
 
 
+def check_packet(packet):
+    """
+    Cheaply tell whether the raw network packet could be a valid KRPC
+
+    Only the size of the packet and a few markers every KRPC has
+    are looked at, which is enough to weed out most garbage (non DHT
+    traffic, scanners) without going through decode()
+
+    @return None if the packet may be a KRPC, otherwise a short
+        string naming the reason why it cannot be one
+
+    """
+    size = len(packet)
+    if size < _min_packet_size:
+        return "too short"
+    if size > constants.max_packet_size:
+        return "too long"
+    if not (packet.startswith("d1:") or packet.startswith("d2:ip")):
+        return "not a krpc dict"
+    if packet[-1] != "e":
+        return "unterminated"
+    if "1:y1:" not in packet:
+        return "no message type"
+    if "1:t" not in packet:
+        return "no transaction id"
+    return None
+
+# The size of the smallest valid KRPC (an error with an empty message)
+_min_packet_size = len("d1:eli201e0:e1:t1:?1:y1:ee")
+
+
 def encode(message):
     """
     Encode a valid KRPC into a raw network packet ready for transmission
@@ -57,7 +96,10 @@ def encode(message):
 
     """
     try:
-        packet = _encode(message)
+        # Only messages of unusual types go through the generic encoder
+        packet = _fast_encode(message)
+        if packet is None:
+            packet = _encode(message)
     except (ValueError, KeyError, AttributeError, _ProtocolFormatError,
             basic_coder.InvalidDataError, TypeError, BTFailure):
         raise InvalidKRPCError(message)
@@ -82,10 +124,24 @@ class _ProtocolFormatError(Exception):
     pass
 
 
+# The only fields of a KRPC dictionary that the decoders
+# below ever read (everything else is skipped while scanning)
+_krpc_fields = {
+    't': None,
+    'y': None,
+    'q': None,
+    'e': None,
+    'a': {'id': None, 'target': None, 'info_hash': None,
+          'port': None, 'token': None},
+    'r': {'id': None, 'nodes': None, 'values': None, 'token': None},
+}
+
+
 def _decode(packet):
     """@see decode"""
-    # Decode the bencoded dict into a python dict
-    rpc_dict = bdecode(packet)
+    # Scan the bencoded dict into a python dict
+    # holding just the fields used by the decoders
+    rpc_dict = bscan(packet, _krpc_fields)
 
     # Decode the message into one of Query/Response/Error (as found
     # in message_types)
@@ -96,10 +152,179 @@ def _decode(packet):
     rpc = message_decoders[msgtype](rpc_dict)
 
     # Attach the transaction id
-    rpc._transaction_id = basic_coder.btol(rpc_dict['t'])
+    rpc._transaction_id = rpc_dict['t']
+    if type(rpc._transaction_id) is not str:
+        raise _ProtocolFormatError()
     return rpc
 
 
+##
+## Single pass decoding of the common KRPC shapes
+##
+
+# The keys of a bencoded dict are sorted, so nearly every client puts
+# its messages on the wire in exactly these layouts (only a few
+# optional keys vary). Each pattern stops right before the 't' key
+_query_re = re.compile(
+    r"d1:ad2:id20:(?P<id>.{20})"
+    r"(?:6:target20:(?P<target>.{20})|9:info_hash20:(?P<info_hash>.{20}))?"
+    r"e1:q(?P<rpctype>4:ping|9:find_node|9:get_peers)", re.S)
+_announce_re = re.compile(
+    r"d1:ad2:id20:(?P<id>.{20})(?:12:implied_porti[01]e)?"
+    r"9:info_hash20:(?P<info_hash>.{20})4:porti(?P<port>0|[1-9][0-9]{0,4})e"
+    r"5:token", re.S)
+_announce_rpctype = "e1:q13:announce_peer"
+_response_re = re.compile(r"d(?:2:ip6:.{6})?1:rd2:id20:(?P<id>.{20})", re.S)
+_error_re = re.compile(r"d1:eli(?P<code>20[123])e")
+
+# Which of id/target/info_hash each query type must carry
+_query_shapes = {
+    "4:ping": ("ping", False, False),
+    "9:find_node": ("find_node", True, False),
+    "9:get_peers": ("get_peers", False, True),
+}
+
+
+def _fast_decode(packet):
+    """
+    Decode the common BEP5 message shapes straight off the wire
+
+    The ids, tokens and node strings are sliced out of the packet
+    at the offsets given by the patterns above and turned into a
+    Query/Response/Error in one pass, without building the generic
+    dictionary tree first
+
+    @see decode
+    @return an instance of either Query, Response, or Error, or None
+        when the packet has an unusual shape (or is invalid) and
+        has to go through the generic _decode
+
+    """
+    try:
+        if packet.startswith("d1:a"):
+            return _fast_query_decoder(packet)
+        elif packet.startswith("d1:r") or packet.startswith("d2:ip"):
+            return _fast_response_decoder(packet)
+        elif packet.startswith("d1:e"):
+            return _fast_error_decoder(packet)
+    except (ValueError, IndexError, basic_coder.InvalidDataError):
+        pass
+    return None
+
+
+def _fast_query_decoder(x):
+    """@see _fast_decode"""
+    m = _query_re.match(x)
+    if m is not None:
+        rpctype, has_target, has_info_hash = _query_shapes[m.group("rpctype")]
+        target_id = m.group("target")
+        info_hash = m.group("info_hash")
+        if (target_id is not None) != has_target:
+            return None
+        if (info_hash is not None) != has_info_hash:
+            return None
+        transaction_id = _fast_transaction_id(x, m.end(), "1:y1:qe")
+        if transaction_id is None:
+            return None
+        q = Query()
+        q.rpctype = rpctype
+        q._from = basic_coder.btol(m.group("id"))
+        if target_id is not None or info_hash is not None:
+            q.target_id = basic_coder.btol(target_id or info_hash)
+        q._transaction_id = transaction_id
+        return q
+
+    m = _announce_re.match(x)
+    if m is not None:
+        token, f = decode_string(x, m.end())
+        if not x.startswith(_announce_rpctype, f):
+            return None
+        transaction_id = _fast_transaction_id(
+            x, f + len(_announce_rpctype), "1:y1:qe")
+        port = int(m.group("port"))
+        if transaction_id is None or port >= 2**16:
+            return None
+        q = Query()
+        q.rpctype = "announce_peer"
+        q._from = basic_coder.btol(m.group("id"))
+        q.target_id = basic_coder.btol(m.group("info_hash"))
+        q.port = port
+        q.token = basic_coder.btol(token)
+        q._transaction_id = transaction_id
+        return q
+    return None
+
+
+def _fast_response_decoder(x):
+    """@see _fast_decode"""
+    m = _response_re.match(x)
+    if m is None:
+        return None
+    # The optional return values, in the order they appear on the wire
+    # (their contents are only looked at once the whole layout checks out)
+    nodes = token = values = None
+    f = m.end()
+    if x.startswith("5:nodes", f):
+        nodes, f = decode_string(x, f + 7)
+    if x.startswith("6:nodes6", f):
+        _, f = decode_string(x, f + 8)
+    if x.startswith("5:token", f):
+        token, f = decode_string(x, f + 7)
+    if x.startswith("6:values", f) and x[f + 8] != "l":
+        values, f = decode_string(x, f + 8)
+    if x[f] != "e":
+        return None
+    transaction_id = _fast_transaction_id(x, f + 1, "1:y1:re")
+    if transaction_id is None:
+        return None
+
+    r = Response()
+    r._transaction_id = transaction_id
+    r._from = basic_coder.btol(m.group("id"))
+    if nodes is not None:
+        r.set_compact_nodes(_check_compact(nodes, 26))
+    if token is not None:
+        r.token = basic_coder.btol(token)
+    if values is not None:
+        r.set_compact_peers(_check_compact(values, 6))
+    return r
+
+
+def _fast_error_decoder(x):
+    """@see _fast_decode"""
+    m = _error_re.match(x)
+    if m is None:
+        return None
+    message, f = decode_string(x, m.end())
+    if not x.startswith("e", f):
+        return None
+    transaction_id = _fast_transaction_id(x, f + 1, "1:y1:ee")
+    if transaction_id is None:
+        return None
+    return Error(transaction_id, int(m.group("code")), message)
+
+
+def _fast_transaction_id(x, f, tail):
+    """
+    Decode the transaction id found at offset f and check the rest of x
+
+    After the transaction id, the packet may only hold an
+    optional client version followed by the given tail
+
+    @return the transaction id (as is) or None if the packet
+        does not end in the expected way
+
+    """
+    if not x.startswith("1:t", f):
+        return None
+    transaction_id, f = decode_string(x, f + 3)
+    if x.startswith("1:v", f):
+        _, f = decode_string(x, f + 3)
+    if f + len(tail) != len(x) or not x.endswith(tail):
+        return None
+    return transaction_id
+
+
 def _query_decoder(rpc_dict):
     """
     Decode the given KRPC dictionary into a valid Query
@@ -143,42 +368,32 @@ def _response_decoder(rpc_dict):
     # find_node always returns a list of nodes
     # get_peers sometimes returns a list of nodes
     if 'nodes' in rpc_dict['r']:
-        r.nodes = _decode_nodes(rpc_dict['r']['nodes'])
+        r.set_compact_nodes(_check_compact(rpc_dict['r']['nodes'], 26))
     # get_peers always returns a list of peers
     if 'values' in rpc_dict['r']:
-        r.peers = _decode_addresses(rpc_dict['r']['values'])
+        r.set_compact_peers(_check_compact(rpc_dict['r']['values'], 6))
     # get_peers returns a token
     if 'token' in rpc_dict['r']:
         r.token = basic_coder.btol(rpc_dict['r']['token'])
     return r
 
 
-def _decode_addresses(address_string):
-    """Decode a concatenated address string into a list of addres tuples"""
-    addresses = []
-    # Each address string has a length of 6
-    encoded_addresses = _chunkify(address_string, 6)
-    for address_string in encoded_addresses:
-        decoded_peer = basic_coder.decode_address(address_string)
-        addresses.append(decoded_peer)
-    return addresses
-
+def _check_compact(string, size):
+    """
+    Check that the string is a concatenation of `size' byte entries
 
-def _decode_nodes(node_string):
-    """Decode a concatenated node string into a list of nodes"""
-    nodes = []
-    # Each node string has a length of 26
-    encoded_nodes = _chunkify(node_string, 26)
-    for node_string in encoded_nodes:
-        decoded_node = contact.decode_node(node_string)
-        nodes.append(decoded_node)
-    return nodes
+    Any compact node (26 bytes) or address (6 bytes) string of the
+    right length decodes, so checking here is all it takes for the
+    lazy decoding in krpc_types.Response to never fail later on
 
+    @return the string
+    @raises InvalidDataError if the string has an improper length
 
-def _chunkify(string, n):
-    """Split the string into n sized chunks"""
-    for i in xrange(0, len(string), n):
-        yield string[i:i+n]
+    """
+    if not isinstance(string, str) or len(string) % size != 0:
+        raise basic_coder.InvalidDataError(
+            "The compact string has an improper length", string)
+    return string
 
 
 def _error_decoder(rpc_dict):
@@ -199,9 +414,8 @@ def _error_decoder(rpc_dict):
 def _encode(message):
     """@see encode"""
     intermediate_msg = {}
-    # Encode and attach the transaction id
-    intermediate_msg['t'] = (
-        basic_coder.ltob(message._transaction_id))
+    # Attach the transaction id
+    intermediate_msg['t'] = _transaction_id(message)
 
     # Determine the type of this KRPC
     if isinstance(message, Query):
@@ -274,3 +488,138 @@ def _error_encoder(error):
     error.message = str(error.message)
     err_dict = {"e": [error.code, error.message]}
     return err_dict
+
+
+##
+## Direct encoding of KRPC messages
+##
+
+
+def _fast_encode(message):
+    """
+    Bencode the given KRPC straight into its network form
+
+    The set of keys of every KRPC type is known in advance, so the
+    messages are written out piece by piece using bencoded keys laid
+    out in their sorted order, without building intermediate dicts
+    and sorting their items the way bencode() has to
+
+    @see encode
+    @return the encoded message, or None if the message is not
+        exactly a Query, Response or Error (and has to go through
+        the generic _encode)
+
+    """
+    message_type = type(message)
+    if message_type is Query:
+        parts, tail = _fast_query_encoder(message), "1:y1:qe"
+    elif message_type is Response:
+        parts, tail = _fast_response_encoder(message), "1:y1:re"
+    elif message_type is Error:
+        parts, tail = _fast_error_encoder(message), "1:y1:ee"
+    else:
+        return None
+    transaction_id = _transaction_id(message)
+    parts.extend(("1:t%d:" % len(transaction_id), transaction_id, tail))
+    return "".join(parts)
+
+
+def _transaction_id(message):
+    """
+    Return the transaction id of the message, checking it is a string
+
+    The transaction id is opaque, replies echo it back byte for byte
+
+    """
+    transaction_id = message._transaction_id
+    if type(transaction_id) is not str:
+        raise _ProtocolFormatError()
+    return transaction_id
+
+
+def _fast_query_encoder(query):
+    """@see _fast_encode"""
+    rpctype = query.rpctype
+    parts = ["d1:ad2:id20:", basic_coder.encode_network_id(query._from)]
+    if rpctype == 'ping':
+        pass
+    elif rpctype == 'find_node':
+        parts.extend(("6:target20:",
+                      basic_coder.encode_network_id(query.target_id)))
+    elif rpctype == 'get_peers':
+        parts.extend(("9:info_hash20:",
+                      basic_coder.encode_network_id(query.target_id)))
+    elif rpctype == 'announce_peer':
+        token = basic_coder.ltob(query.token)
+        # Try encoding the port, to see if it is within range
+        basic_coder.encode_port(query.port)
+        parts.extend(("9:info_hash20:",
+                      basic_coder.encode_network_id(query.target_id),
+                      "4:porti%de" % query.port,
+                      "5:token%d:" % len(token), token))
+    else:
+        raise _ProtocolFormatError()
+    parts.append("e1:q%d:%s" % (len(rpctype), rpctype))
+    return parts
+
+
+def _fast_response_encoder(response):
+    """@see _fast_encode"""
+    parts = ["d1:rd2:id20:", basic_coder.encode_network_id(response._from)]
+    if response.nodes is not None:
+        nodes = "".join([contact.encode_node(node)
+                         for node in response.nodes])
+        parts.extend(("5:nodes%d:" % len(nodes), nodes))
+    if response.token is not None:
+        token = basic_coder.ltob(response.token)
+        parts.extend(("5:token%d:" % len(token), token))
+    if response.peers is not None:
+        values = "".join([basic_coder.encode_address(peer)
+                          for peer in response.peers])
+        parts.extend(("6:values%d:" % len(values), values))
+    parts.append("e")
+    return parts
+
+
+def _fast_error_encoder(error):
+    """@see _fast_encode"""
+    # Verify the error code is in the valid range
+    if error.code not in [201, 202, 203]:
+        raise _ProtocolFormatError()
+    # Make sure the message is actually a string
+    error.message = str(error.message)
+    return ["d1:eli%de%d:" % (error.code, len(error.message)),
+            error.message, "e"]
+
+
+class ResponseTemplates(object):
+    """
+    Pre-bencoded responses to ping and find_node queries of one node id
+
+    Apart from the id of the responding node, which never changes,
+    ping responses only carry the transaction id, and find_node
+    responses the transaction id and the nodes. The bencoded id of
+    the node is kept as a prefix (much like a bencode.Bencached) onto
+    which the transaction id and the cached compact node strings
+    are spliced (@see contact.encode_node)
+
+    The packets are identical to the ones encode() produces
+    for the equivalent Response
+
+    @param node_id: the id of the responding node
+
+    """
+    def __init__(self, node_id):
+        self.prefix = "d1:rd2:id20:" + basic_coder.encode_network_id(node_id)
+
+    def ping(self, transaction_id):
+        """@return the encoded ping response to the given transaction"""
+        return "%se1:t%d:%s1:y1:re" % (
+            self.prefix, len(transaction_id), transaction_id)
+
+    def find_node(self, transaction_id, nodes):
+        """@return the encoded find_node response holding the nodes"""
+        nodes = "".join([contact.encode_node(node) for node in nodes])
+        return "%s5:nodes%d:%se1:t%d:%s1:y1:re" % (
+            self.prefix, len(nodes), nodes,
+            len(transaction_id), transaction_id)
@@ -8,6 +8,8 @@ Objects used to encapsulate the identity of DHT nodes
 """
 import time
 import sys
+import socket
+import struct
 
 from mdht.coding import basic_coder
 from config import constants
@@ -36,16 +38,32 @@ class Node(object):
     successcount:   The number of queries to which this node has responded
     failcount:      The number of queries to which this node has failed
                     (either by sending an Error, or by timing out)
+    rtt:            The average return trip time (@see _rtt), kept up
+                    to date as the statistics change so that nodes
+                    can be compared without recomputing it
+
+    A node's identity is its node_id alone: two nodes are equal when
+    their ids are, whatever their addresses or statistics. The node_id
+    must therefore never change once the node has been created
 
     """
+    __slots__ = ('node_id', '_address', '_compact', '_hash',
+                 'last_updated', 'totalrtt', 'successcount', 'failcount',
+                 'rtt')
+
     def __init__(self, node_id=None, address=None, last_updated=None, totalrtt=None, successcount=None, failcount=None):
         # TODO make check interface.Don't use the encoding funcs directlly
         # So we don't crash here.
-        basic_coder.encode_address(address)
-        basic_coder.encode_network_id(node_id)
+        address_string = basic_coder.encode_address(address)
+        node_id_string = basic_coder.encode_network_id(node_id)
         # Network information
         self.node_id = node_id
-        self.address = address
+        self._hash = hash(node_id)
+        self._address = address
+        # The compact network form of this node, as sent in
+        # find_node/get_peers responses (@see encode_node).
+        # Validating the id and address above already encoded them
+        self._compact = node_id_string + address_string
         # Statistical information
         if last_updated is None:
             self.last_updated = time.time()
@@ -57,6 +75,42 @@ class Node(object):
             self.totalrtt = totalrtt
             self.successcount = successcount
             self.failcount = failcount
+        self.rtt = self._rtt()
+
+    @classmethod
+    def _from_compact(cls, node_id, address, compact, last_updated,
+                      totalrtt=0, successcount=0, failcount=0):
+        """
+        Build a node out of its already decoded network string
+
+        Unlike Node(), the id and address are not encoded back again
+        to validate them (any 26 bytes make up a valid node), and the
+        node keeps compact as its cached network string
+
+        @see decode_nodes
+
+        """
+        node = cls.__new__(cls)
+        node.node_id = node_id
+        node._hash = hash(node_id)
+        node._address = address
+        node._compact = compact
+        node.last_updated = last_updated
+        node.totalrtt = totalrtt
+        node.successcount = successcount
+        node.failcount = failcount
+        node.rtt = node._rtt()
+        return node
+
+    @property
+    def address(self):
+        return self._address
+
+    @address.setter
+    def address(self, address):
+        # The cached compact form is stale once the address changes
+        self._address = address
+        self._compact = None
 
     def distance(self, node_id):
         """
@@ -80,6 +134,7 @@ class Node(object):
         """
         self._touch(origin_time)
         self.successcount += 1
+        self.rtt = self._rtt()
 
     # TODO what about timed out queries, are they "failed"
     # what about the rtt then?
@@ -95,6 +150,7 @@ class Node(object):
         """
         self._touch(origin_time)
         self.failcount += 1
+        self.rtt = self._rtt()
 
     # TODO make another function, something like
     # "preferably_evict" so that we know whether we should
@@ -121,11 +177,12 @@ class Node(object):
         @returns boolean
 
         """
-        if self.fresh() and not other_node.fresh():
+        if not self.fresh():
+            return False
+        if not other_node.fresh():
             return True
 
-        better_rtt = self._rtt() < other_node._rtt()
-        if self.fresh() and better_rtt:
+        if self.rtt < other_node.rtt:
             return True
 
         # Notion of: "good node" vs "bad node"
@@ -156,13 +213,13 @@ class Node(object):
         self.totalrtt += current_time - origin_time
 
     def __eq__(self, other):
-        return not self.__ne__(other)
+        return isinstance(other, Node) and self.node_id == other.node_id
 
     def __hash__(self):
-        return basic_coder.btol(encode_node(self))
+        return self._hash
 
     def __ne__(self, other):
-        return other.__hash__() ^ self.__hash__()
+        return not self.__eq__(other)
 
     def __repr__(self):
         return "%s last_updated=%d successcount=%d failcount=%d" % (
@@ -187,11 +244,18 @@ def encode_node(node):
     The format of the network string is specified in the
     BitTorrent DHT extension specification
 
+    The network string is computed once and then cached on the
+    node, until the node's address changes
+
     @see DHTBot/references/README for the DHT BEP
 
     """
-    return "%s%s" % (basic_coder.encode_network_id(node.node_id),
-                     basic_coder.encode_address(node.address))
+    compact_node = node._compact
+    if compact_node is None:
+        compact_node = node._compact = "%s%s" % (
+            basic_coder.encode_network_id(node.node_id),
+            basic_coder.encode_address(node.address))
+    return compact_node
 
 
 def decode_node(node_string):
@@ -199,8 +263,50 @@ def decode_node(node_string):
     Decodes a network string into a Node object
 
     @see encode_node for the format of this network string
+    @raises InvalidDataError when the network string is invalid
+
+    """
+    if len(node_string) != 26:
+        raise basic_coder.InvalidDataError(
+            "The node string has an improper length",
+            node_string)
+    return decode_nodes(node_string)[0]
+
+
+# node_id, ip, port of a network string (@see encode_node)
+_compact_node = struct.Struct("!20s4sH")
+
+
+def decode_nodes(nodes_string):
+    """
+    Decodes a concatenation of network strings into a list of Nodes
+
+    The whole string is unpacked in one pass, and each node keeps
+    its slice of the string as its cached network string
+    (@see Node._from_compact)
+
+    @see encode_node for the format of each network string
+    @raises InvalidDataError when the input is not a string or
+        its length is not a multiple of 26
 
     """
-    node_id = basic_coder.decode_network_id(node_string[:20])
-    address = basic_coder.decode_address(node_string[20:])
-    return Node(node_id, address)
+    try:
+        if len(nodes_string) % 26 != 0:
+            raise basic_coder.InvalidDataError(
+                "The nodes string has an improper length",
+                nodes_string)
+        nodes = []
+        now = time.time()
+        unpack_from = _compact_node.unpack_from
+        inet_ntoa = socket.inet_ntoa
+        btol = basic_coder.btol
+        from_compact = Node._from_compact
+        for offset in xrange(0, len(nodes_string), 26):
+            node_id, ip, port = unpack_from(nodes_string, offset)
+            nodes.append(from_compact(btol(node_id), (inet_ntoa(ip), port),
+                                      nodes_string[offset:offset+26], now))
+        return nodes
+    except (struct.error, TypeError):
+        raise basic_coder.InvalidDataError(
+            "The nodes string has an invalid format",
+            nodes_string)
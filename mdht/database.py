@@ -65,5 +65,22 @@ class RedisCache(object):
         self.r_db = redis.Connection(host=host, port=port, db=db)
 
 
+class _LazyDatabase(object):
+    """
+    Stands in for the MongoDb database until a collection is needed
+
+    The connection is only made on the first access, so that
+    importing this module does not require a running MongoDB
+
+    """
+    def __init__(self):
+        self._db = None
+
+    def __getitem__(self, collection):
+        if self._db is None:
+            self._db = MongoDb().db
+        return self._db[collection]
+
+
 # the best awesome singleton??
-database = MongoDb().db
+database = _LazyDatabase()
@@ -8,7 +8,8 @@ kademlia reference paper and the BitTorrent DHT BEP
 @see mdht/references
 
 """
-from twisted.python import log
+import time
+from collections import OrderedDict
 
 from config import constants
 
@@ -46,9 +47,35 @@ class KBucket(object):
     Each KBucket also has a maxsize, which determines the maximum
     number of nodes that this KBucket will hold
 
+    The nodes are kept in the order they were last seen: a node goes
+    to the end when it is added, or touched (@see touch_node) with a
+    newer last_updated time, so that the stalest node is always the
+    first one, and the one a better node evicts. Nodes must be touched
+    whenever their statistics are updated to keep it that way
+
+    The last_changed attribute holds the last time (seconds since
+    the epoch) a node was added, touched or removed, which tells
+    whether the KBucket has gone idle, while the epoch counter is
+    bumped whenever nodes join or leave the KBucket (or it splits)
+
+    The nodes a full KBucket turns down are kept in a bounded
+    replacement cache (most recently seen last), from which they
+    are promoted as soon as a slot frees up. The public counters
+    promotions and replacement_hits (candidates seen again while
+    cached) tell how useful the cache is
+
     """
     def __init__(self, range_min, range_max, maxsize=constants.k):
-        self._nodes = set()
+        # node_id => node, least recently seen first
+        self._nodes = OrderedDict()
+        # node_id => the last_updated time a node was put in place with
+        # (which tells whether touching it has to move it at all)
+        self._placed = {}
+        # node_id => node, oldest candidates first
+        self._replacements = OrderedDict()
+        self.promotions = 0
+        self.replacement_hits = 0
+        self.epoch = 0
         if range_min >= range_max:
             raise KBucketError("__init__",
                                "range_min is greater than or" +
@@ -57,6 +84,7 @@ class KBucket(object):
         self.range_min = range_min
         self.range_max = range_max
         self.maxsize = maxsize
+        self.last_changed = time.time()
 
     def offer_node(self, node):
         """
@@ -67,7 +95,8 @@ class KBucket(object):
         one free slot, or this node is better than an existing
         node found in the KBucket
 
-        Note: if `node' is already in this KBucket, True will be returned
+        Note: if `node' is already in this KBucket, True will be returned.
+        A turned down node is kept as a replacement candidate
 
         @throws BucketError when the given node's ID does not
         fall into the range of this KBucket
@@ -81,19 +110,84 @@ class KBucket(object):
                                "The given node has an ID that does" +
                                " not fall into the range of this KBucket",
                                (node,))
-        if node in self._nodes:
+        if node.node_id in self._nodes:
             return True
 
         if self.full():
-            worst_node = self._get_worst_node()
-            if node.better_than(worst_node):
-                self.remove_node(worst_node)
-            else:
-                return False
+            return self.replace_worst_node(node) is not None
+
+        self._replacements.pop(node.node_id, None)
+        self._insert(node)
+        self.epoch += 1
+        return True
+
+    def replace_worst_node(self, node):
+        """
+        Offer the given node to this full KBucket, in place of its worst node
+
+        The node (whose ID falls into the range of this KBucket) is
+        kept as a replacement candidate if it is not better than the
+        worst node (@see _get_worst_node)
+
+        @returns the evicted node, or None if the node was turned down
+
+        """
+        worst_node = self._get_worst_node()
+        if not node.better_than(worst_node):
+            self._add_replacement(node)
+            return None
+        # (removing the worst node bumps the epoch)
+        self.remove_node(worst_node)
+        self._replacements.pop(node.node_id, None)
+        self._insert(node)
+        return worst_node
+
+    def touch_node(self, node):
+        """
+        Record that the given node may have been seen
+
+        The node (as stored in this KBucket) is moved to the end of
+        the last seen order if its last_updated time changed, and
+        left in place if it did not (ie the node was only heard of)
 
-        self._nodes.add(node)
+        @returns boolean telling whether the node is in this KBucket
+            and its last_updated time changed
+
+        """
+        node_id = node.node_id
+        node = self._nodes.get(node_id)
+        if node is None or node.last_updated == self._placed[node_id]:
+            return False
+        del self._nodes[node_id]
+        self._insert(node)
         return True
 
+    def promote_replacement(self):
+        """
+        Move the most recently seen replacement candidate into this KBucket
+
+        Nothing is promoted if this KBucket is full or
+        has no replacement candidates
+
+        @returns the promoted node, or None
+
+        """
+        if self.full() or not self._replacements:
+            return None
+        (node_id, node) = self._replacements.popitem()
+        self._insert(node)
+        self.epoch += 1
+        self.promotions += 1
+        return node
+
+    def get_replacements(self):
+        """
+        Returns a list of the replacement candidates of this KBucket
+        (from the least to the most recently seen)
+
+        """
+        return self._replacements.values()
+
     def splittable(self):
         """Tells whether this KBucket covers enough range to split"""
         new_width = (self.range_max - self.range_min) / 2
@@ -109,6 +203,10 @@ class KBucket(object):
         of the existing KBucket. This KBucket's maxsize
         is set to 0
 
+        The replacement candidates are handed down to the new KBuckets
+        as well, and the counters carry over to the left KBucket (so
+        that the counters of the active KBuckets add up to everything)
+
         @returns tuple of the new KBuckets (lbucket, rbucket), where
         lbucket covers the left half of the existing range and
         rbucket covers the right half of the existing range
@@ -134,6 +232,9 @@ class KBucket(object):
                           maxsize=self.maxsize)
 
         self._distribute_nodes(lbucket, rbucket)
+        self.epoch += 1
+        lbucket.promotions = self.promotions
+        lbucket.replacement_hits = self.replacement_hits
         self.maxsize = 0
         return (lbucket, rbucket)
 
@@ -151,24 +252,29 @@ class KBucket(object):
         """
         Removes the given node from the KBucket
 
-        Nothing happens if the node
-        is not found in the KBucket
+        Nothing happens if the node is not found in the KBucket
+        (apart from dropping it from the replacement candidates).
+        Refilling the freed slot is left to promote_replacement
 
         @returns boolean describing whether the given
         node was found in the KBucket during the removal
 
         """
-        if node in self._nodes:
-            self._nodes.remove(node)
+        if self._nodes.pop(node.node_id, None) is not None:
+            del self._placed[node.node_id]
+            self.last_changed = time.time()
+            self.epoch += 1
             return True
+        self._replacements.pop(node.node_id, None)
         return False
 
     def get_nodes(self):
         """
-        Returns an iterable containing the nodes in this KBucket
+        Returns a list of the nodes in this KBucket
+        (from the least to the most recently seen)
 
         """
-        return set(self._nodes)
+        return self._nodes.values()
 
     def full(self):
         return len(self._nodes) == self.maxsize
@@ -182,7 +288,7 @@ class KBucket(object):
         """
         if self.empty():
             return None
-        return min(self._nodes, key=lambda node: node.last_updated)
+        return next(self._nodes.itervalues())
 
     def empty(self):
         """Tells whether this kbucket is empty"""
@@ -196,20 +302,43 @@ class KBucket(object):
         the `better_than' function
         @see mdht.contact.Node.better_than
 
+        As in the kademlia paper, this is the least recently seen
+        node, ie the first one in the last seen order (which a
+        candidate still has to be better than to evict it)
+
         """
-        worst_node = self._nodes.pop()
-        self._nodes.add(worst_node)
-        for node in self._nodes:
-            if worst_node.better_than(node):
-                worst_node = node
-        return worst_node
+        return self.get_stalest_node()
+
+    def _insert(self, node):
+        """Add the given node at the end of the last seen order"""
+        self.last_changed = time.time()
+        self._nodes[node.node_id] = node
+        self._placed[node.node_id] = node.last_updated
+
+    def _add_replacement(self, node):
+        """Remember the given node as the latest replacement candidate"""
+        if self._replacements.pop(node.node_id, None) is not None:
+            self.replacement_hits += 1
+        self._replacements[node.node_id] = node
+        if len(self._replacements) > constants.replacement_cache_size:
+            self._replacements.popitem(last=False)
 
     def _distribute_nodes(self, lbucket, rbucket):
-        while len(self._nodes) > 0:
-            node = self._nodes.pop()
+        for node in self._nodes.values():
             if lbucket.key_in_range(node.node_id) and not lbucket.full():
                 lbucket.offer_node(node)
             elif rbucket.key_in_range(node.node_id) and not rbucket.full():
                 rbucket.offer_node(node)
+            elif lbucket.key_in_range(node.node_id):
+                lbucket._add_replacement(node)
+            else:
+                rbucket._add_replacement(node)
+        self._nodes.clear()
+        self._placed.clear()
+        # Oldest first, to keep the candidates in order
+        for node in self._replacements.values():
+            if lbucket.key_in_range(node.node_id):
+                lbucket._add_replacement(node)
             else:
-                log.msg("While splitting a KBucket, we threw away a node")
+                rbucket._add_replacement(node)
+        self._replacements.clear()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Scheduler refreshing the idle kbuckets of a routing table
+
+Nodes only find their way into a kbucket when they happen to
+show up in our traffic. A kbucket covering a quiet part of the
+id space slowly fills up with stale nodes, and lookups into it
+miss. Refreshing a kbucket (ie looking up a random id inside
+its range) brings it back up to date
+
+@see references/kademlia.pdf section 2.3
+
+"""
+import time
+import random
+from operator import attrgetter
+
+from twisted.python import log
+from twisted.internet import task, defer
+
+from config import constants
+
+
+class KBucketRefresher(object):
+    """
+    Periodically refreshes the kbucket that has been idle the longest
+
+    Every constants.NICEinterval seconds, the kbucket with the oldest
+    last_changed time is looked at. If it has not changed for
+    constants.kbucket_refresh_timeout seconds, a lookup is started for
+    a random id in its range. At most one refresh lookup is
+    outstanding at a time, so a table full of idle kbuckets gets
+    refreshed one kbucket after the other, rather than in a burst
+
+    routing_table: the IRoutingTable to keep up to date
+    lookup: a function taking an id, that looks it up on the
+        network (it may return a deferred), or None once every
+        lookup was removed (@see add_lookup)
+    refreshes: the number of lookups started
+
+    @see mdht.kademlia.kbucket.KBucket
+
+    """
+    def __init__(self, routing_table, lookup, _reactor=None):
+        self.routing_table = routing_table
+        self.lookup = lookup
+        # The lookups standing by to take over from the current one
+        self._standby = []
+        self.refreshes = 0
+        self._pending = False
+        self._loop = task.LoopingCall(self.refresh)
+        if _reactor is not None:
+            self._loop.clock = _reactor
+
+    def start(self):
+        """Start refreshing kbuckets every constants.NICEinterval seconds"""
+        self._loop.start(constants.NICEinterval, now=False)
+
+    def stop(self):
+        if self._loop.running:
+            self._loop.stop()
+
+    def add_lookup(self, lookup):
+        """
+        Stand another lookup by, to be used once the current one is removed
+
+        (ie the lookups of all the protocols sharing the routing table)
+
+        """
+        if lookup != self.lookup and lookup not in self._standby:
+            self._standby.append(lookup)
+
+    def remove_lookup(self, lookup):
+        """
+        Stop using the given lookup (ie its protocol stopped)
+
+        A lookup standing by takes over if it was the current one
+
+        @returns the current lookup, or None if there is none left
+
+        """
+        if lookup == self.lookup:
+            self.lookup = self._standby.pop(0) if self._standby else None
+        elif lookup in self._standby:
+            self._standby.remove(lookup)
+        return self.lookup
+
+    def refresh(self):
+        """
+        Refresh the kbucket that has been idle the longest, if it is due
+
+        @returns the id that is being looked up, or None if
+            no kbucket needed a refresh
+
+        """
+        if self._pending or self.lookup is None:
+            return None
+        k = min(self.routing_table.get_kbuckets(),
+                key=attrgetter("last_changed"))
+        now = time.time()
+        if now - k.last_changed < constants.kbucket_refresh_timeout:
+            return None
+
+        # Count the refresh as a change, so that the kbucket goes
+        # to the back of the line even if the lookup turns up nothing
+        k.last_changed = now
+        target_id = random.randrange(k.range_min, k.range_max)
+        self.refreshes += 1
+        self._pending = True
+        d = defer.maybeDeferred(self.lookup, target_id)
+        d.addErrback(self._refresh_failed)
+        d.addBoth(self._refresh_done)
+        return target_id
+
+    def _refresh_failed(self, failure):
+        log.msg("KBucketRefresher: refresh lookup failed: %s" %
+                failure.getErrorMessage())
+
+    def _refresh_done(self, result):
+        self._pending = False
@@ -10,15 +10,20 @@ Implementation of a RoutingTable for the Kademlia network
 @see references/README for Rasterbar's BitTorrent Overview
 
 """
+import os
+import heapq
+import bisect
+from operator import attrgetter
 from collections import defaultdict
 
+from pymongo.errors import PyMongoError
 from twisted.python import log
-from twisted.internet import task
+from twisted.internet import reactor, task, threads, defer
 from zope.interface import Interface, implements
 
 from config import constants
 from mdht import contact
-from mdht.kademlia import kbucket
+from mdht.kademlia import kbucket, snapshot
 from mdht.database import database
 
 
@@ -35,7 +40,8 @@ class IRoutingTable(Interface):
         The node may not be accepted, if for example it is stale
         @return boolean indicating if the node was accepted or not.
         If the node is already found in the RoutingTable, True should
-        be returned
+        be returned (and the node is considered to have just been seen,
+        @see mdht.kademlia.kbucket.KBucket.touch_node)
 
         """
 
@@ -73,52 +79,148 @@ class IRoutingTable(Interface):
 
         """
 
+    def add_owner(self, node_id):
+        """
+        Let the RoutingTable know one of the local node ids it serves
+
+        A RoutingTable may use the ids of its owners to decide
+        where it keeps more nodes (ie, which kbuckets to split)
+
+        """
 
-class TreeRoutingTable(object):
+    def remove_owner(self, node_id):
+        """Forget about a local node id (@see add_owner)"""
+
+
+class _RoutingTable(object):
     """
-    Prefix tree based Kademlia routing table
+    Node bookkeeping shared by the routing table implementations
 
-    This implementation follows the standard kademlia routing table
-    design with some improvements noted in the subsecond.pdf paper
-    (see the references in the module docstring, above)
+    Subclasses lay the nodes out into kbuckets by implementing
+    _insert_node, _get_kbucket, _find_closest_nodes, _range_kbuckets
+    and get_kbuckets
 
     """
 
     implements(IRoutingTable)
 
     def __init__(self):
-        k = kbucket.KBucket(0, 2**constants.id_size)
-        self.root = _TreeNode(k)
         self.nodes_dict = {}
         self.nodes_by_addr = defaultdict(set)
-        self.active_kbuckets = [k]
+        # The KBucketRefresher keeping this table's kbuckets from
+        # going idle, if any (@see mdht.kademlia.refresher)
+        self.refresher = None
+        # Ids of the nodes added/changed and of the nodes removed
+        # since the last flush to the database (@see flush)
+        self._changed_ids = set()
+        self._removed_ids = set()
+        self._flushing = False
+        # (kbucket range_min, num_nodes) => (candidates, the kbuckets
+        # they come from along with their epochs)
+        # @see get_closest_nodes
+        self._closest_cache = {}
+        self.closest_cache_hits = 0
+        self.closest_cache_misses = 0
+        self.closest_cache_stale = 0
 
     def offer_node(self, node):
         # If node isn't in the routing table,
         # try adding it
         if node.node_id in self.nodes_dict:
+            # It may have just been seen (in which case its statistics
+            # changed), keep its kbucket's order up to date
+            if self._get_kbucket(node.node_id).touch_node(node):
+                self._changed_ids.add(node.node_id)
             return True
         else:
-            # Try to recursively add node to our tree (rooted at self.root)
-            node_accepted = self._offer_node(self.root, node)
+            node_accepted = self._insert_node(node)
             if node_accepted:
-                # Add the node into two local dictionaries
-                # for quick lookup later
-                self.nodes_dict[node.node_id] = node
-                self.nodes_by_addr[node.address].add(node)
+                self._add_to_dicts(node)
             return node_accepted
 
     def remove_node(self, node):
+        k = self._get_kbucket(node.node_id)
         if node.node_id in self.nodes_dict:
-            del self.nodes_dict[node.node_id]
-            self.nodes_by_addr[node.address].remove(node)
-            if len(self.nodes_by_addr[node.address]) == 0:
-                del self.nodes_by_addr[node.address]
-            self._remove_node(self.root, node)
+            # Work with the node we actually stored, since the given
+            # node only has to share its id (@see contact.Node)
+            node = self.nodes_dict[node.node_id]
+            self._remove_from_dicts(node)
+            k.remove_node(node)
+            # Take the freed slot back from the replacement cache
+            self._fill_kbucket(k)
             return True
         else:
+            # Make sure it won't be promoted later on either
+            k.remove_node(node)
             return False
 
+    def get_closest_nodes(self, node_id, num_nodes=constants.k):
+        """
+        Answer from the candidates cached for the kbucket of node_id
+
+        The first lookup of a kbucket gathers the nodes of its smallest
+        enclosing aligned range that holds num_nodes nodes. Any node
+        outside of that range is further away from every id of the
+        kbucket than the nodes inside of it, so the num_nodes closest
+        nodes of any target falling into the kbucket are found among
+        these candidates. The following lookups into that kbucket (as
+        done for the popular infohashes, or for the ids close to our
+        own) only have to sort the candidates. The candidates of a
+        kbucket are gathered again as soon as nodes joined or left any
+        of the kbuckets they come from (or one of them split), which
+        their epochs tell
+
+        A sparse kbucket may have to borrow a large part of the table.
+        With more than constants.closest_cache_max_candidates of them,
+        its lookups go through the distance ordered walk instead, until
+        the kbucket itself changes
+
+        @see IRoutingTable.get_closest_nodes
+        @see _find_closest_nodes for the uncached lookup
+
+        """
+        if constants.closest_cache_size <= 0:
+            return self._find_closest_nodes(node_id, num_nodes)
+        k = self._get_kbucket(node_id)
+        key = (k.range_min, num_nodes)
+        entry = self._closest_cache.get(key)
+        if entry is not None:
+            candidates, epochs = entry
+            for kbucket, epoch in epochs:
+                if kbucket.epoch != epoch:
+                    self.closest_cache_stale += 1
+                    entry = None
+                    break
+        if entry is None:
+            self.closest_cache_misses += 1
+            candidates, kbuckets = self._closest_candidates(k, num_nodes)
+            if len(candidates) > constants.closest_cache_max_candidates:
+                # Sorting them all would cost more than the walk
+                candidates = None
+                kbuckets = [k]
+            if len(self._closest_cache) >= constants.closest_cache_size:
+                self._closest_cache.clear()
+            self._closest_cache[key] = (
+                candidates, [(kbucket, kbucket.epoch) for kbucket in kbuckets])
+        else:
+            self.closest_cache_hits += 1
+        if candidates is None:
+            return self._find_closest_nodes(node_id, num_nodes)
+        distance = lambda node: node.node_id ^ node_id
+        return sorted(candidates, key=distance)[:num_nodes]
+
+    def get_closest_cache_stats(self):
+        """
+        @return a dict with the hits and misses of the closest nodes
+            cache (stale: the misses due to outdated entries) and its
+            number of entries
+
+        """
+        return {"hits": self.closest_cache_hits,
+                "misses": self.closest_cache_misses,
+                "stale": self.closest_cache_stale,
+                "entries": len(self._closest_cache)}
+
     def get_node(self, node_id):
         if node_id in self.nodes_dict:
             return self.nodes_dict[node_id]
@@ -135,12 +237,375 @@ class TreeRoutingTable(object):
             if len(nodes_set) > 0:
                 return nodes_set
 
-    def get_closest_nodes(self, node_id, num_nodes=constants.k):
-        closest_nodes = []
-        self._get_closest_nodes(node_id, self.root, closest_nodes, num_nodes)
+    def add_owner(self, node_id):
+        # The kbuckets split regardless of our own ids
+        pass
+
+    def remove_owner(self, node_id):
+        pass
+
+    def get_replacement_stats(self):
+        """
+        Sum up the replacement cache counters of the active kbuckets
+
+        @see mdht.kademlia.kbucket.KBucket
+        @return a dict with the number of cached candidates,
+            of promotions and of cache hits
+
+        """
+        stats = {"candidates": 0, "promotions": 0, "hits": 0}
+        for k in self.get_kbuckets():
+            stats["candidates"] += len(k.get_replacements())
+            stats["promotions"] += k.promotions
+            stats["hits"] += k.replacement_hits
+        return stats
+
+    @classmethod
+    def instance(cls):
+        """
+        Return a global `Routing table` instance
+
+        Called on _RoutingTable itself, this returns the instance of
+        the implementation selected by constants.routing_table
+
+        @see table_class
+
+        """
+        if cls is _RoutingTable:
+            return table_class().instance()
+        # Look into this very class, as each implementation
+        # has its own instance
+        if "_instance" not in cls.__dict__:
+            cls._instance = cls()
+            # The stored nodes are restored once the local nodes created
+            # along with the table have registered their ids (@see
+            # add_owner): a table shaped around its owners would not
+            # split for them otherwise, and keep just k of the nodes
+            reactor.callLater(0, cls._init_routing_table)
+
+            # set a routine to keep routing table updated
+            # little data lossing is ok here
+            save_routing_table_loop = task.LoopingCall(cls.routine_save_routing_table)
+            save_routing_table_loop.start(constants.DUMPinterval, now=False)
+
+        return cls._instance
+
+    @classmethod
+    def _init_routing_table(cls):
+        """
+        restore routing table
+
+        The nodes come from the snapshot file saved on shutdown
+        (@see mdht.kademlia.snapshot), or from the database when
+        there is no usable snapshot
+
+        """
+        routing_table = cls._instance
+        stored_ids = set()
+        # Stalest first, so that the kbuckets take them in last seen order
+        for node in sorted(cls._load_nodes(),
+                           key=attrgetter("last_updated")):
+            stored_ids.add(node.node_id)
+            routing_table.offer_node(node)
+        # The restored nodes are stored already. The ones that did not
+        # fit in (or that the restore evicted) stay stored as well, as
+        # they have not been found dead
+        routing_table._changed_ids.difference_update(stored_ids)
+        routing_table._removed_ids.difference_update(stored_ids)
+
+    @classmethod
+    def _load_nodes(cls):
+        """
+        Read back the saved nodes
+
+        @return an iterable of contact.Node
+
+        """
+        if os.path.exists(constants.snapshot_file):
+            try:
+                return snapshot.load(constants.snapshot_file)
+            except (snapshot.SnapshotError, IOError, OSError) as e:
+                log.msg("routing: ignoring the snapshot file: %s" % e)
+        try:
+            node_list = list(
+                database[constants.routing_table_collection].find())
+        except PyMongoError as e:
+            log.msg("routing: starting with an empty table: %s" % e)
+            return []
+        return [contact.Node(node_id=int(_node["_id"]),
+                             address=(_node["ip"], _node["port"]),
+                             last_updated=_node["last_updated"],
+                             totalrtt=_node["totalrtt"],
+                             successcount=_node["successcount"],
+                             failcount=_node["failcount"],
+                             )
+                for _node in node_list]
+
+    @classmethod
+    def persist_routing_table(cls):
+        """
+        persist routing table
+
+        The nodes are saved into the snapshot file, and the remaining
+        changes are written to the database right away (in the
+        calling thread), as this happens on shutdown
+
+        """
+        if not hasattr(cls, "_saved"):
+            log.msg("try to save the routing table.Be patient")
+            cls._saved = True
+            try:
+                snapshot.save(cls._instance.get_nodes().itervalues(),
+                              constants.snapshot_file)
+            except (IOError, OSError) as e:
+                log.err(e, "opps! saving the routing table snapshot broke.")
+            cls._instance.flush(threaded=False)
+
+    @classmethod
+    def routine_save_routing_table(cls):
+        """
+        save routing table every x seconds
+        """
+        log.msg("routing: save routing_table to db")
+        return cls._instance.flush()
+
+    def flush(self, threaded=True):
+        """
+        Write the changes since the last flush to the database
+
+        Only the nodes that were added, changed or removed since the
+        last flush are written, as single node upserts and deletes of
+        at most constants.flush_chunk_size nodes (@see _write_changes).
+        Their documents are built right away, but they are written
+        from a thread of the reactor's threadpool so that the database
+        never holds up the handling of packets (unless threaded is
+        False). While a threaded flush is running, new changes wait
+        for the next flush
+
+        @returns a deferred firing with the number of nodes written
+
+        """
+        if self._flushing and threaded:
+            return defer.succeed(0)
+        changed_ids, self._changed_ids = self._changed_ids, set()
+        removed_ids, self._removed_ids = self._removed_ids, set()
+        nodes_dict = self.nodes_dict
+        documents = [_node_document(nodes_dict[node_id])
+                     for node_id in changed_ids if node_id in nodes_dict]
+        removed = [str(node_id) for node_id in removed_ids]
+        if threaded:
+            self._flushing = True
+            d = threads.deferToThread(_write_changes, documents, removed)
+        else:
+            d = defer.maybeDeferred(_write_changes, documents, removed)
+        d.addCallbacks(self._flush_done, self._flush_failed,
+                       errbackArgs=(changed_ids, removed_ids))
+        return d
+
+    def _flush_done(self, count):
+        self._flushing = False
+        log.msg("routing: %d nodes flushed to routing_table" % count)
+        return count
+
+    def _flush_failed(self, failure, changed_ids, removed_ids):
+        """Keep the changes that failed to be written for the next flush"""
+        self._flushing = False
+        log.err(failure, "opps! flushing nodes to routing_table broke.")
+        for node_id in changed_ids:
+            if node_id in self.nodes_dict:
+                self._changed_ids.add(node_id)
+        for node_id in removed_ids:
+            if node_id not in self.nodes_dict:
+                self._removed_ids.add(node_id)
+        return 0
+
+    def _insert_node(self, node):
+        """
+        Store the given node (not yet in the table) into its kbucket
+
+        @return boolean indicating whether the node was accepted
+
+        """
+        raise NotImplementedError
+
+    def _get_kbucket(self, node_id):
+        """Return the active kbucket whose range holds node_id"""
+        raise NotImplementedError
+
+    def _find_closest_nodes(self, node_id, num_nodes):
+        """
+        Look the closest nodes up in the kbuckets (no caching)
+
+        @see IRoutingTable.get_closest_nodes
+
+        """
+        raise NotImplementedError
+
+    def _range_kbuckets(self, range_min, range_max):
+        """
+        Return the active kbuckets overlapping the given range
+
+        @see mdht.kademlia.kbucket.KBucket
+
+        """
+        raise NotImplementedError
+
+    def _closest_candidates(self, k, num_nodes):
+        """
+        Gather the closest nodes candidates of the ids of kbucket k
+
+        @see get_closest_nodes
+        @return a tuple (candidates, the kbuckets they come from)
+
+        """
+        range_min = k.range_min
+        width = k.range_max - k.range_min
+        while True:
+            kbuckets = self._range_kbuckets(range_min, range_min + width)
+            nodes = []
+            for kbucket in kbuckets:
+                nodes.extend(kbucket.get_nodes())
+            if len(nodes) >= num_nodes or width >= 2**constants.id_size:
+                return nodes, kbuckets
+            # Move up to the aligned range twice as large
+            width <<= 1
+            range_min &= ~(width - 1)
+
+    def _fill_kbucket(self, k):
+        """Promote replacement candidates into the free slots of k"""
+        while not k.full():
+            node = k.promote_replacement()
+            if node is None:
+                break
+            self._add_to_dicts(node)
+
+    def _offer_to_kbucket(self, k, node):
+        """
+        Offer a node (not yet in the table) to the kbucket k
+
+        A full kbucket takes the node in place of its worst node,
+        which then leaves the table just like a removed node
+
+        @return boolean indicating whether k accepted the node
+
+        """
+        if not k.full():
+            return k.offer_node(node)
+        evicted_node = k.replace_worst_node(node)
+        if evicted_node is None:
+            return False
+        self._remove_from_dicts(evicted_node)
+        return True
+
+    def _add_to_dicts(self, node):
+        """Record a node newly accepted into a kbucket"""
+        # Add the node into two local dictionaries
+        # for quick lookup later
+        self.nodes_dict[node.node_id] = node
+        self.nodes_by_addr[node.address].add(node)
+        self._changed_ids.add(node.node_id)
+        self._removed_ids.discard(node.node_id)
+
+    def _remove_from_dicts(self, node):
+        """Record a node (as stored) leaving its kbucket"""
+        del self.nodes_dict[node.node_id]
+        self.nodes_by_addr[node.address].remove(node)
+        if len(self.nodes_by_addr[node.address]) == 0:
+            del self.nodes_by_addr[node.address]
+        self._changed_ids.discard(node.node_id)
+        self._removed_ids.add(node.node_id)
+
+
+def _node_document(node):
+    """The routing_table document of the given node"""
+    return {
+        "_id": str(node.node_id),
+        "ip": node.address[0],
+        "port": node.address[1],
+        "last_updated": node.last_updated,
+        "totalrtt": node.totalrtt,
+        "successcount": node.successcount,
+        "failcount": node.failcount,
+    }
+
+
+def _write_changes(documents, removed_ids):
+    """
+    Upsert the given node documents and delete the removed node ids
+
+    This blocks on the database (@see _RoutingTable.flush)
+
+    Every write is idempotent: a changed node is upserted in place
+    (never deleted to be written again), so a flush that breaks
+    half way through loses nothing and can simply be done again
 
-        closest_nodes.sort(key=lambda node: node.distance(node_id))
-        return closest_nodes[:num_nodes]
+    @returns the number of nodes written
+
+    """
+    collection = database[constants.routing_table_collection]
+    size = constants.flush_chunk_size
+    for i in xrange(0, len(removed_ids), size):
+        collection.remove({"_id": {"$in": removed_ids[i:i + size]}})
+    for doc in documents:
+        collection.update({"_id": doc["_id"]}, doc, upsert=True)
+    return len(documents) + len(removed_ids)
+
+
+class TreeRoutingTable(_RoutingTable):
+    """
+    Prefix tree based Kademlia routing table
+
+    This implementation follows the standard kademlia routing table
+    design with some improvements noted in the subsecond.pdf paper
+    (see the references in the module docstring, above)
+
+    """
+
+    def __init__(self):
+        _RoutingTable.__init__(self)
+        k = kbucket.KBucket(0, 2**constants.id_size)
+        self.root = _TreeNode(k)
+        self.active_kbuckets = [k]
+
+    def _find_closest_nodes(self, node_id, num_nodes):
+        """
+        Visit the leaves of the tree in increasing XOR distance to node_id
+
+        The kbuckets cover aligned power of two ranges, so at every
+        treenode the child on node_id's side of the split bit holds
+        nodes strictly closer to node_id than any node held by the
+        other child. Walking down node_id's side first (and keeping
+        the other sides on a stack) therefore reaches the kbuckets
+        in distance order, and the walk stops as soon as num_nodes
+        nodes have been collected
+
+        @see _RoutingTable._find_closest_nodes
+
+        """
+        distance = lambda node: node.node_id ^ node_id
+        closest_nodes = []
+        # Subtrees left to visit, the closest one on top
+        subtrees = [self.root]
+        while subtrees and len(closest_nodes) < num_nodes:
+            tnode = subtrees.pop()
+            while tnode.lchild is not None:
+                # The children split this treenode's range in two
+                # halves, told apart by the bit of weight `half'
+                half = (tnode.kbucket.range_max - tnode.kbucket.range_min) >> 1
+                if node_id & half:
+                    subtrees.append(tnode.lchild)
+                    tnode = tnode.rchild
+                else:
+                    subtrees.append(tnode.rchild)
+                    tnode = tnode.lchild
+            bucket_nodes = tnode.kbucket.get_nodes()
+            missing = num_nodes - len(closest_nodes)
+            if len(bucket_nodes) <= missing:
+                closest_nodes.extend(sorted(bucket_nodes, key=distance))
+            else:
+                closest_nodes.extend(
+                    heapq.nsmallest(missing, bucket_nodes, key=distance))
+        return closest_nodes
 
     def get_kbuckets(self):
         """
@@ -152,6 +617,33 @@ class TreeRoutingTable(object):
         """
         return self.active_kbuckets
 
+    def _range_kbuckets(self, range_min, range_max):
+        kbuckets = []
+        subtrees = [self.root]
+        while subtrees:
+            tnode = subtrees.pop()
+            k = tnode.kbucket
+            if k.range_max <= range_min or k.range_min >= range_max:
+                continue
+            if tnode.lchild is None:
+                kbuckets.append(k)
+            else:
+                subtrees.extend((tnode.lchild, tnode.rchild))
+        return kbuckets
+
+    def _insert_node(self, node):
+        # Try to recursively add node to our tree (rooted at self.root)
+        return self._offer_node(self.root, node)
+
+    def _get_kbucket(self, node_id):
+        tnode = self.root
+        while tnode.lchild is not None:
+            if tnode.lchild.kbucket.key_in_range(node_id):
+                tnode = tnode.lchild
+            else:
+                tnode = tnode.rchild
+        return tnode.kbucket
+
     def _offer_node(self, tnode, node):
         """
         Recursive helper function for offer_node
@@ -176,7 +668,7 @@ class TreeRoutingTable(object):
         # Try to insert the node into this treenode's kbucket
         # if this treenode is a leaf
         if tnode.is_leaf():
-            node_accepted = tnode.kbucket.offer_node(node)
+            node_accepted = self._offer_to_kbucket(tnode.kbucket, node)
             if node_accepted:
                 return True
             # If the kbucket rejected the node, it is probably
@@ -188,62 +680,6 @@ class TreeRoutingTable(object):
                 return node_accepted
         return False
 
-    def _remove_node(self, tnode, node):
-        """Recursive helper function for remove_node"""
-        if tnode and tnode.kbucket.key_in_range(node.node_id):
-            # Recurse down into the treenode which contains the given node
-            self._remove_node(tnode.lchild, node)
-            self._remove_node(tnode.rchild, node)
-
-            # We have found our kbucket
-            if tnode.is_leaf():
-                tnode.kbucket.remove_node(node)
-
-    def _get_closest_nodes(self, node_id, tnode, closest_nodes, num_nodes):
-        """
-        Recursive helper function for get_closest_nodes
-
-        @param node_id: We are looking for nodes closest to this ID
-        @param tnode: We are recursing down tnode and its subtrees
-        @param closest_nodes: The list where we are storing our results
-        @param num_nodes: How many nodes we are looking for
-
-        @returns None
-
-        """
-        # If we have collected more nodes than we need,
-        # stop searching
-        if len(closest_nodes) >= num_nodes:
-            return
-        if tnode.is_leaf():
-            bucket_nodes = tnode.kbucket.get_nodes()
-            closest_nodes.extend(bucket_nodes)
-            return
-        ## recursive to find a proper kbucket
-        ## BUG extra node finding may always fall into the thrid case.
-        if tnode.lchild.kbucket.key_in_range(node_id):
-            direction = "left"
-            self._get_closest_nodes(
-                node_id, tnode.lchild, closest_nodes, num_nodes)
-        elif tnode.rchild.kbucket.key_in_range(node_id):
-            direction = "right"
-            self._get_closest_nodes(
-                node_id, tnode.rchild, closest_nodes, num_nodes)
-        else:
-            log.msg("RoutingTable: node_id didn't fall into either"
-                    " of a treenode's children.")
-            return
-
-        # If trying the left/right subtree did not yield
-        # enough nodes, try going down the other subtree
-        if direction == "left":
-            self._get_closest_nodes(
-                node_id, tnode.rchild, closest_nodes, num_nodes)
-        elif direction == "right":
-            self._get_closest_nodes(
-                node_id, tnode.lchild, closest_nodes, num_nodes)
-        return
-
     def _split(self, tnode):
         """
         Split the given node into two children nodes
@@ -272,79 +708,175 @@ class TreeRoutingTable(object):
         # process, but it will not store nodes)
         self.active_kbuckets.remove(tnode.kbucket)
         self.active_kbuckets.extend([lbucket, rbucket])
+        self._fill_kbucket(lbucket)
+        self._fill_kbucket(rbucket)
         return True
 
-    @staticmethod
-    def instance():
-        """Return a global `Routing table` instance"""
-        if not hasattr(TreeRoutingTable, "_instance"):
-            TreeRoutingTable._instance = TreeRoutingTable()
-            TreeRoutingTable._init_routing_table()
 
-            # set a routine to keep routing table updated
-            # little data lossing is ok here
-            save_routing_table_loop = task.LoopingCall(TreeRoutingTable.routine_save_routing_table)
-            save_routing_table_loop.start(constants.DUMPinterval, now=False)
+class FlatRoutingTable(_RoutingTable):
+    """
+    Kademlia routing table keeping its kbuckets in a flat sorted array
+
+    The kbuckets split just like the ones of the TreeRoutingTable,
+    but rather than walking down a tree of 160 bit range comparisons,
+    the kbucket of a given id is located by bisecting the sorted
+    lower bounds of the kbuckets (O(log n) comparisons, done in C)
 
-        return TreeRoutingTable._instance
+    @see TreeRoutingTable
 
-    @staticmethod
-    def _init_routing_table():
+    """
+
+    def __init__(self):
+        _RoutingTable.__init__(self)
+        self._id_space = 2**constants.id_size
+        # _kbuckets[i] covers [_bounds[i], _bounds[i + 1])
+        self._kbuckets = [kbucket.KBucket(0, self._id_space)]
+        self._bounds = [0]
+
+    def _find_closest_nodes(self, node_id, num_nodes):
         """
-        restore routing table
+        Visit the kbuckets in increasing XOR distance to node_id
+
+        Starting from the kbucket of node_id, the aligned range around
+        node_id is doubled in width until enough nodes are found. At
+        each step, its other half (ie the sibling range) is visited
+        by splitting it into halves, the one sharing node_id's next
+        bit first, until the halves line up with kbuckets
+
+        @see _RoutingTable._find_closest_nodes
+        @see TreeRoutingTable._find_closest_nodes
+
         """
-        node_list = database["routing_table"].find()
-        for _node in node_list:
-            node = contact.Node(node_id=int(_node["_id"]),
-                                address=(_node["ip"], _node["port"]),
-                                last_updated=_node["last_updated"],
-                                totalrtt=_node["totalrtt"],
-                                successcount=_node["successcount"],
-                                failcount=_node["failcount"],
-                                )
-            TreeRoutingTable._instance.offer_node(node)
-
-    @staticmethod
-    def _save_routing_table():
-        """
-        save routing nodes in db
-        """
-        nodes = TreeRoutingTable._instance.get_nodes()
-        params = []
-        for k in nodes:
-            params.append({
-                "_id":  str(nodes[k].node_id),
-                "ip":   nodes[k].address[0],
-                "port": nodes[k].address[1],
-                "last_updated": nodes[k].last_updated,
-                "totalrtt": nodes[k].totalrtt,
-                "successcount": nodes[k].successcount,
-                "failcount": nodes[k].failcount,
-            })
-        if params:
-            try:
-                database["routing_table"].insert(params, continue_on_error=True)
-                log.msg("done! nodes has saved to routing_table.")
-            except:
-                log.err("opps! save nodes to routing_table break.")
+        distance = lambda node: node.node_id ^ node_id
+        closest_nodes = []
+        first_kbucket = self._kbuckets[self._index(node_id)]
+        width = first_kbucket.range_max - first_kbucket.range_min
+        # Aligned (range_min, width) ranges left to visit,
+        # the closest one on top
+        ranges = [(first_kbucket.range_min, width)]
+        while len(closest_nodes) < num_nodes:
+            if not ranges:
+                if width == self._id_space:
+                    break
+                # Everything in the aligned range of `width' around
+                # node_id has been visited, continue with its sibling
+                ranges.append(((node_id ^ width) & ~(width - 1), width))
+                width <<= 1
+                continue
+            range_min, range_width = ranges.pop()
+            k = self._kbuckets[self._index(range_min)]
+            if k.range_max - k.range_min < range_width:
+                # The range holds several kbuckets, split it up
+                half = range_width >> 1
+                if node_id & half:
+                    ranges.append((range_min, half))
+                    ranges.append((range_min + half, half))
+                else:
+                    ranges.append((range_min + half, half))
+                    ranges.append((range_min, half))
+                continue
+            bucket_nodes = k.get_nodes()
+            missing = num_nodes - len(closest_nodes)
+            if len(bucket_nodes) <= missing:
+                closest_nodes.extend(sorted(bucket_nodes, key=distance))
+            else:
+                closest_nodes.extend(
+                    heapq.nsmallest(missing, bucket_nodes, key=distance))
+        return closest_nodes
 
-    @staticmethod
-    def persist_routing_table():
+    def get_kbuckets(self):
         """
-        persist routing table
+        Return all the active kbuckets in this table (sorted by range)
+
+        @see mdht.kademlia.kbucket.KBucket
+
         """
-        if not hasattr(TreeRoutingTable, "_saved"):
-            log.msg("try to save the routing table.Be patient")
-            TreeRoutingTable._saved = True
-            TreeRoutingTable._save_routing_table()
+        return self._kbuckets
+
+    def _index(self, key):
+        """Return the index of the kbucket whose range holds key"""
+        return bisect.bisect_right(self._bounds, key) - 1
+
+    def _range_kbuckets(self, range_min, range_max):
+        end = bisect.bisect_left(self._bounds, range_max)
+        return self._kbuckets[self._index(range_min):end]
+
+    def _insert_node(self, node):
+        while True:
+            index = self._index(node.node_id)
+            k = self._kbuckets[index]
+            if self._offer_to_kbucket(k, node):
+                return True
+            # If the kbucket rejected the node, it is probably
+            # full. Split it and try again with the half
+            # that covers the node
+            if not self._should_split(k):
+                return False
+            self._split(index)
+
+    def _get_kbucket(self, node_id):
+        return self._kbuckets[self._index(node_id)]
+
+    def _should_split(self, k):
+        """Tells whether the kbucket k, which turned a node down, splits"""
+        return k.full() and k.splittable()
 
-    @staticmethod
-    def routine_save_routing_table():
+    def _split(self, index):
         """
-        save routing table every x seconds
+        Replace the kbucket found at index by its two halves
+
+        @see mdht.kademlia.kbucket.KBucket.split
+
         """
-        log.msg("routing: save routing_table to db")
-        TreeRoutingTable._save_routing_table()
+        (lbucket, rbucket) = self._kbuckets[index].split()
+        self._kbuckets[index:index + 1] = [lbucket, rbucket]
+        self._bounds.insert(index + 1, rbucket.range_min)
+        self._fill_kbucket(lbucket)
+        self._fill_kbucket(rbucket)
+
+
+class MultiOwnerRoutingTable(FlatRoutingTable):
+    """
+    Flat routing table shaped around every one of the local node ids
+
+    Just like in the kademlia paper, a full kbucket only splits when
+    its range holds one of our own ids (@see add_owner). The kbuckets
+    get finer and finer close to each owner id, while the rest of
+    the id space is covered by a few coarse kbuckets (whose spare
+    nodes wait in the replacement caches). Many virtual nodes can
+    thus share a single table of about k nodes per bit of each of
+    their ids, rather than each keeping a table of its own or all
+    of them sharing a table that splits for every node
+
+    @see references/kademlia.pdf section 2.4
+
+    """
+
+    def __init__(self):
+        FlatRoutingTable.__init__(self)
+        # Sorted list of the owner ids
+        self.owner_ids = []
+
+    def add_owner(self, node_id):
+        index = bisect.bisect_left(self.owner_ids, node_id)
+        if index == len(self.owner_ids) or self.owner_ids[index] != node_id:
+            self.owner_ids.insert(index, node_id)
+
+    def remove_owner(self, node_id):
+        # The kbuckets that were split for this owner stay as they are
+        index = bisect.bisect_left(self.owner_ids, node_id)
+        if index < len(self.owner_ids) and self.owner_ids[index] == node_id:
+            del self.owner_ids[index]
+
+    def _should_split(self, k):
+        return (FlatRoutingTable._should_split(self, k) and
+                self._holds_owner(k))
+
+    def _holds_owner(self, k):
+        """Tells whether an owner id falls into the range of kbucket k"""
+        index = bisect.bisect_left(self.owner_ids, k.range_min)
+        return (index < len(self.owner_ids) and
+                self.owner_ids[index] < k.range_max)
 
 
 class _TreeNode(object):
@@ -365,47 +897,86 @@ class _TreeNode(object):
         return (self.lchild, self.rchild) == (None, None)
 
 
-# TODO not use it right now...
-class SubsecondRoutingTable(TreeRoutingTable):
-    def __init__(self, node_id):
-        TreeRoutingTable.__init__(self, node_id)
-        self.other_bucket_count = 0
+class SubsecondRoutingTable(MultiOwnerRoutingTable):
+    """
+    Kademlia routing table with larger kbuckets far from its owners
 
-    def _split(self, tnode):
-        """
-        An optimization of the TreeRoutingTable split function
+    As found in section 5.D of references/subsecond.pdf, keeping more
+    nodes in the kbuckets that cover the far halves of the id space
+    cuts down the number of hops of a lookup: whenever a split leaves
+    a kbucket without any owner id, that kbucket is enlarged depending
+    on how close to the root of the id space it is (@see _newbucketsize).
+    The kbuckets are sized as they split, so the owner ids have to be
+    registered before any node is offered (@see _RoutingTable.instance)
+
+    @see MultiOwnerRoutingTable
+    @see references/subsecond.pdf
 
+    """
 
-        This function extends the TreeRoutingTable.split method
+    def __init__(self, node_id=None):
+        MultiOwnerRoutingTable.__init__(self)
+        if node_id is not None:
+            self.add_owner(node_id)
+
+    def _split(self, index):
+        """
+        An optimization of the FlatRoutingTable split function
+
+        This function extends the FlatRoutingTable._split method
         to modify the size of the created KBuckets (as an
         optimization found in section 5.D of references/subsecond.pdf
 
-        @see TreeRoutingTable.split
+        @see FlatRoutingTable._split
         @see references/subsecond.pdf
 
         """
-        valid_split = TreeRoutingTable._split(self, tnode)
-        if valid_split:
-            lbucket = tnode.lchild.kbucket
-            rbucket = tnode.rchild.kbucket
-            if lbucket.key_in_range(self.node_id):
-                # the only use for self.node_id i can tell is use it to optimize....
-                # may need to rethink a new algorithm to avoid self.node_id using.
-                rbucket.maxsize = self._newbucketsize()
-            else:
-                lbucket.maxsize = self._newbucketsize()
-        self.other_bucket_count += 1
-        return valid_split
+        MultiOwnerRoutingTable._split(self, index)
+        for k in self._kbuckets[index:index + 2]:
+            if not self._holds_owner(k):
+                k.maxsize = self._newbucketsize(k)
+                self._fill_kbucket(k)
 
-    def _newbucketsize(self):
+    def _newbucketsize(self, k):
         """
         Determine the optimal size of a new KBucket
 
-        The first KBucket will have size 128, the following
-        KBuckets will have sizes of 64, 32, 16, and all the
-        remaining KBuckets will have size 8.
+        The KBuckets covering a half of the id space will have size
+        128, the ones covering a quarter will have size 64, then 32,
+        16, and all the remaining KBuckets will have size 8 (for a
+        single owner, that is the order in which they are created)
 
         @see references/subsecond.pdf
 
         """
-        return max(128 / 2 ** self.other_bucket_count, constants.k)
+        # Number of bits of the prefix shared by the ids of k
+        width = k.range_max - k.range_min
+        depth = constants.id_size - (width.bit_length() - 1)
+        return max(128 / 2 ** (depth - 1), constants.k)
+
+
+# The routing table implementations, by constants.routing_table name
+TABLE_CLASSES = {
+    "tree": TreeRoutingTable,
+    "flat": FlatRoutingTable,
+    "multi_owner": MultiOwnerRoutingTable,
+    "subsecond": SubsecondRoutingTable,
+}
+
+
+def table_class(name=None):
+    """
+    The routing table implementation of the given name
+
+    @param name: a key of TABLE_CLASSES, constants.routing_table
+        if it is None
+    @raises ValueError if there is no such implementation
+
+    """
+    if name is None:
+        name = constants.routing_table
+    try:
+        return TABLE_CLASSES[name]
+    except KeyError:
+        raise ValueError("unknown routing table %r (one of %s)" % (
+            name, ", ".join(sorted(TABLE_CLASSES))))
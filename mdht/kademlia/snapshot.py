@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Compact binary snapshots of the nodes of a routing table
+
+A snapshot file starts with a magic string and holds one fixed-size
+record per node: its 26 byte network string (@see contact.encode_node)
+followed by its packed statistics
+
+    last_updated    double
+    totalrtt        double
+    successcount    unsigned int
+    failcount       unsigned int
+
+(all in network byte order). Loading a snapshot maps the file into
+memory and unpacks the records straight into Nodes, which is much
+faster than pulling the nodes back out of the database
+
+"""
+import os
+import mmap
+import struct
+import socket
+
+from mdht import contact
+from mdht.coding import basic_coder
+
+MAGIC = "MDHTRT\x00\x01"
+
+# network string (node_id, ip, port) and statistics of a node
+_record = struct.Struct("!20s4sHddII")
+
+
+class SnapshotError(Exception):
+    """Raised when a snapshot file is not in the expected format"""
+
+
+def save(nodes, path):
+    """
+    Write the given nodes into a snapshot file at path
+
+    The file is written next to path first, then renamed over it,
+    so that path always holds a complete snapshot
+
+    """
+    records = [MAGIC]
+    append = records.append
+    pack = struct.Struct("!ddII").pack
+    for node in nodes:
+        append(contact.encode_node(node))
+        append(pack(node.last_updated, node.totalrtt,
+                    node.successcount, node.failcount))
+    temp_path = "%s.%d.tmp" % (path, os.getpid())
+    with open(temp_path, "wb") as snapshot_file:
+        snapshot_file.write("".join(records))
+        snapshot_file.flush()
+        os.fsync(snapshot_file.fileno())
+    os.rename(temp_path, path)
+
+
+def load(path):
+    """
+    Read the nodes of the snapshot file at path
+
+    @returns a list of contact.Node
+    @raises SnapshotError when the file is not a valid snapshot
+    @raises IOError/OSError when the file cannot be read
+
+    """
+    with open(path, "rb") as snapshot_file:
+        size = os.fstat(snapshot_file.fileno()).st_size
+        if (size < len(MAGIC) or
+                (size - len(MAGIC)) % _record.size != 0):
+            raise SnapshotError("%s has an improper length" % path)
+        data = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        if data[:len(MAGIC)] != MAGIC:
+            raise SnapshotError("%s is not a routing table snapshot" % path)
+        return _unpack_nodes(data, len(MAGIC), size)
+    finally:
+        data.close()
+
+
+def _unpack_nodes(data, start, end):
+    # Nodes are built just like in contact.decode_nodes
+    # (without validating their ids and addresses again)
+    nodes = []
+    append = nodes.append
+    unpack_from = _record.unpack_from
+    inet_ntoa = socket.inet_ntoa
+    btol = basic_coder.btol
+    from_compact = contact.Node._from_compact
+    for offset in xrange(start, end, _record.size):
+        (node_id, ip, port, last_updated, totalrtt,
+         successcount, failcount) = unpack_from(data, offset)
+        append(from_compact(btol(node_id), (inet_ntoa(ip), port),
+                            data[offset:offset+26], last_updated,
+                            totalrtt, successcount, failcount))
+    return nodes
@@ -7,13 +7,16 @@ Module containing classes that encapsulate
 KRPC Queries, Responses, and Errors
 
 """
+from mdht import contact
+from mdht.coding import basic_coder
 
 
 class _KRPC(object):
     """
     A KRPC message always has a transaction ID
 
-    _transaction_id: the transaction ID of this message
+    _transaction_id: the transaction ID of this message (a short
+        byte string, which the replies echo back as is)
 
     """
     def __init__(self, _transaction_id=None):
@@ -126,6 +129,11 @@ class Response(_KRPC):
             as specified in the originating query
     _from: the node that received the original query
 
+    The nodes and peers of a received Response are kept in their compact
+    network form (@see set_compact_nodes and set_compact_peers) and are
+    only decoded when first accessed, so a response whose nodes/peers
+    are never looked at costs nothing to decode
+
     """
     def __init__(self, _transaction_id=None, _from=None,
                  nodes=None, token=None, peers=None, rpctype=None):
@@ -136,6 +144,52 @@ class Response(_KRPC):
         self.peers = peers
         self.rpctype = rpctype
 
+    @property
+    def nodes(self):
+        if self._compact_nodes is not None:
+            self._nodes = contact.decode_nodes(self._compact_nodes)
+            self._compact_nodes = None
+        return self._nodes
+
+    @nodes.setter
+    def nodes(self, nodes):
+        self._nodes = nodes
+        self._compact_nodes = None
+
+    @property
+    def peers(self):
+        if self._compact_peers is not None:
+            self._peers = basic_coder.decode_addresses(self._compact_peers)
+            self._compact_peers = None
+        return self._peers
+
+    @peers.setter
+    def peers(self, peers):
+        self._peers = peers
+        self._compact_peers = None
+
+    def set_compact_nodes(self, nodes_string):
+        """
+        Set the nodes of this Response from their network form
+
+        @param nodes_string: concatenated 26 byte node strings,
+            which have to be valid (@see contact.decode_nodes)
+
+        """
+        self._nodes = None
+        self._compact_nodes = nodes_string
+
+    def set_compact_peers(self, peers_string):
+        """
+        Set the peers of this Response from their network form
+
+        @param peers_string: concatenated 6 byte address strings,
+            which have to be valid (@see basic_coder.decode_addresses)
+
+        """
+        self._peers = None
+        self._compact_peers = peers_string
+
     def __repr__(self):
         printable_attributes = self._get_attrs()
         return "<Response: %s>" % self._build_repr(printable_attributes)
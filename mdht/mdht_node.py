@@ -36,7 +36,7 @@ class MDHT(object):
 
     def __init__(self, node_id,
                  port=constants.dht_port, bootstrap_addresses=None,
-                 db=None):
+                 db=None, multiplexer=None):
         """
         Prepares the MDHT client
 
@@ -46,6 +46,9 @@ class MDHT(object):
         port: the UDP port on which to run the MDHT node
         bootstrap_addresses: an iterable of nodes on
             which to bootstrap this MDHT client
+        multiplexer: the KRPC_Multiplexer whose socket the node
+            shares (the port is then ignored)
+            @see mdht.protocols.krpc_multiplexer
 
         """
         self.node_id = node_id
@@ -72,7 +75,10 @@ class MDHT(object):
 
         # Let Twisted know about our MDHT node listening on a UDP port
         self.proto = KRPC_Iterator(node_id)
-        reactor.listenUDP(port, self.proto)
+        if multiplexer is not None:
+            multiplexer.host(self.proto)
+        else:
+            reactor.listenUDP(port, self.proto)
 
         # Patch in some functions that are found on the protocol
         self._proxy_funcs()
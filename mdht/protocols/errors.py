@@ -28,3 +28,26 @@ class KRPCError(Exception):
     """
     def __init__(self, error):
         self.error = error
+
+
+class TransactionTableFullError(Exception):
+    """
+    Error denoting that a Query could not be sent, as all the
+    transaction ids are taken by outstanding queries
+
+    @see mdht.transaction.TransactionTable
+
+    """
+    pass
+
+
+class SendQueueFullError(Exception):
+    """
+    Error denoting that a Query was dropped before leaving this
+    host, as the send queues held back by the bandwidth limits
+    were full (it tells nothing about the queried node)
+
+    @see mdht.send_scheduler.SendScheduler
+
+    """
+    pass
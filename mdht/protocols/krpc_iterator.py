@@ -11,7 +11,10 @@ from twisted.internet import defer
 from twisted.python import log
 
 from mdht.protocols.krpc_responder import KRPC_Responder, IKRPC_Responder
-from mdht.protocols.errors import TimeoutError, KRPCError
+from mdht.protocols.errors import (TimeoutError, KRPCError,
+                                   TransactionTableFullError,
+                                   SendQueueFullError)
+from mdht.kademlia.refresher import KBucketRefresher
 
 
 class IterationError(Exception):
@@ -33,6 +36,18 @@ class IterationError(Exception):
         self.reason = reason
 
 
+def _found_nodes(results):
+    """
+    The nodes found by a find_iterate
+
+    @param results: the (seed_node, nodes) pairs find_iterate
+        fires with (@see KRPC_Iterator._reconsturct_data)
+    @returns a list of the nodes returned by all the seed nodes
+
+    """
+    return [node for (seed_node, nodes) in results for node in nodes]
+
+
 class IKRPC_Iterator(IKRPC_Responder):
     """
     KRPC_Iterator abstracts the practice of iterating toward a target ID
@@ -100,8 +115,31 @@ class KRPC_Iterator(KRPC_Responder):
 
     implements(IKRPC_Iterator)
 
-    def __init__(self, node_id=None, _reactor=None):
-        KRPC_Responder.__init__(self, node_id=node_id, _reactor=_reactor)
+    def __init__(self, node_id=None, _reactor=None,
+                 routing_table_class=None):
+        KRPC_Responder.__init__(self, routing_table_class=routing_table_class,
+                                node_id=node_id, _reactor=_reactor)
+
+    def startProtocol(self):
+        # The routing table is shared by every protocol, so its
+        # kbuckets are refreshed by the first one to start (the
+        # others standing by to take over once it stops)
+        refresher = self.routing_table.refresher
+        if refresher is None:
+            refresher = KBucketRefresher(self.routing_table,
+                                         self._refresh_lookup, self._reactor)
+            self.routing_table.refresher = refresher
+            refresher.start()
+        else:
+            refresher.add_lookup(self._refresh_lookup)
+
+    def stopProtocol(self):
+        refresher = self.routing_table.refresher
+        if (refresher is not None and
+                refresher.remove_lookup(self._refresh_lookup) is None):
+            refresher.stop()
+            self.routing_table.refresher = None
+        KRPC_Responder.stopProtocol(self)
 
     def find_iterate(self, target_id, nodes=None, timeout=None):
         d = self._iterate(self.find_node, target_id, nodes)
@@ -113,6 +151,24 @@ class KRPC_Iterator(KRPC_Responder):
         d = self._iterate(self.get_peers, target_id, nodes)
         return d
 
+    def _refresh_lookup(self, target_id):
+        """
+        Look up target_id to refresh the kbucket it falls into
+
+        The responding nodes are refreshed in the routing table
+        (@see KRPC_Sender._query_success_callback) and the nodes
+        they return are offered to it
+
+        """
+        d = self.find_iterate(target_id)
+        d.addCallback(_found_nodes)
+        d.addCallback(self._offer_found_nodes)
+        return d
+
+    def _offer_found_nodes(self, found_nodes):
+        for node in found_nodes:
+            self.routing_table.offer_node(node)
+
     def _iterate(self, iterate_func, target_id, nodes=None, timeout=None):
         # Prepare the seed nodes
         if nodes is None:
@@ -218,4 +274,5 @@ class KRPC_Iterator(KRPC_Responder):
         @see mdht.protocols.krpc_sender.sendQuery
 
         """
-        failure.trap(TimeoutError, KRPCError)
+        failure.trap(TimeoutError, KRPCError, TransactionTableFullError,
+                     SendQueueFullError)
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+A protocol serving many virtual node ids from a single UDP socket
+
+Every MDHT node normally listens on a port of its own. The
+KRPC_Multiplexer instead owns one socket and hosts any number of
+KRPC protocols (identities), each running under its own node id:
+
+    * a datagram is decoded once, by the multiplexer
+    * a response/error goes to the identity that sent the query:
+      the identities share a single transaction table, so the
+      transaction id of the reply finds the query (and its from
+      field, the identity)
+    * a query goes to the identity the querying address knows us
+      by (the last one that sent it a packet) or, for an address
+      we never talked to, to the identity owning the piece of the
+      id space the target of the query (or the querier) falls into
+    * the identities write their packets straight to the socket,
+      and time their queries out on a single shared timer wheel
+
+"""
+import bisect
+from collections import defaultdict, OrderedDict
+from twisted.python import log
+from twisted.internet import reactor, protocol
+
+from config import constants
+from mdht.coding import krpc_coder
+from mdht.coding.krpc_coder import InvalidKRPCError
+from mdht.krpc_types import Query
+from mdht.transaction import TransactionTable
+from mdht.timer_wheel import TimerWheel
+
+
+class KRPC_Multiplexer(protocol.DatagramProtocol):
+    """
+    Hosts many KRPC protocols (virtual node ids) on a single socket
+
+    With 2 byte transaction ids, a socket has at most
+    constants.multiplexer_transaction_table_size queries outstanding,
+    across all of its identities
+
+    identities: the hosted protocols, by node id
+    transactions: the transaction table shared by the identities
+    dropped_packets: a dict counting the received datagrams
+        that were dropped, by reason (shared by the identities)
+    unroutable: the number of replies whose query came from
+        an identity that is no longer hosted
+
+    """
+    def __init__(self, _reactor=None):
+        if _reactor is None:
+            _reactor = reactor
+        self._reactor = _reactor
+        self.identities = {}
+        # The sorted node ids of the identities
+        self._node_ids = []
+        self.transactions = TransactionTable(
+            constants.multiplexer_transaction_table_size)
+        self._timeouts = TimerWheel(_reactor=self._reactor)
+        self.dropped_packets = defaultdict(int)
+        # The node id each remote address last heard from
+        self._known_as = OrderedDict()
+        self.unroutable = 0
+        self._started = False
+
+    def host(self, proto):
+        """
+        Serve the given KRPC protocol (not listening on a port itself)
+
+        The protocol is started along with the multiplexer (right
+        away if the multiplexer is running already)
+
+        """
+        if proto.node_id in self.identities:
+            raise ValueError("node id %d is hosted already" % proto.node_id)
+        proto.transactions = self.transactions
+        proto._timeouts = self._timeouts
+        proto.dropped_packets = self.dropped_packets
+        self.identities[proto.node_id] = proto
+        bisect.insort(self._node_ids, proto.node_id)
+        if self._started:
+            proto.makeConnection(_VirtualTransport(self, proto.node_id))
+
+    def unhost(self, proto):
+        """Stop serving the given protocol"""
+        if self.identities.get(proto.node_id) is not proto:
+            return
+        del self.identities[proto.node_id]
+        del self._node_ids[bisect.bisect_left(self._node_ids, proto.node_id)]
+        if self._started:
+            proto.doStop()
+
+    def startProtocol(self):
+        self._started = True
+        for node_id, proto in self.identities.items():
+            proto.makeConnection(_VirtualTransport(self, node_id))
+
+    def stopProtocol(self):
+        self._started = False
+        for proto in self.identities.values():
+            proto.doStop()
+
+    def datagramReceived(self, data, address):
+        """
+        Decode the datagram and pass it on to the right identity
+
+        @see KRPC_Sender.datagramReceived
+
+        """
+        reason = krpc_coder.check_packet(data)
+        if reason is None:
+            try:
+                krpc = krpc_coder.decode(data)
+            except InvalidKRPCError:
+                reason = "malformed"
+        if reason is not None:
+            self.dropped_packets[reason] += 1
+            return
+        if isinstance(krpc, Query):
+            proto = self._identity_for(krpc, address)
+            if proto is not None:
+                proto.krpcReceived(krpc, address)
+            return
+        transaction = self.transactions.get(krpc._transaction_id, address)
+        if transaction is None:
+            log.msg("multiplexer: reply to no outstanding query from "
+                    "%s:%s" % address)
+            return
+        proto = self.identities.get(transaction.query._from)
+        if proto is None:
+            self.unroutable += 1
+            return
+        proto._replyReceived(krpc, transaction, address)
+
+    def _identity_for(self, query, address):
+        """
+        The identity that answers the query from address
+
+        @return a hosted protocol, or None if there is none
+
+        """
+        proto = self.identities.get(self._known_as.get(address))
+        if proto is not None:
+            return proto
+        node_ids = self._node_ids
+        if not node_ids:
+            return None
+        key = query.target_id if query.target_id is not None else query._from
+        # The identity with the largest id not above key (ie the owner of
+        # the piece key falls into, @see main.start_nodes), wrapping around
+        index = bisect.bisect_right(node_ids, key) - 1
+        return self.identities[node_ids[index]]
+
+    def _write(self, node_id, packet, address):
+        """Write out a packet sent by the given identity"""
+        known_as = self._known_as
+        if known_as.get(address) != node_id:
+            known_as.pop(address, None)
+            known_as[address] = node_id
+            if len(known_as) > constants.multiplexer_known_addresses:
+                known_as.popitem(last=False)
+        self.transport.write(packet, address)
+
+
+class _VirtualTransport(object):
+    """
+    The transport of a hosted identity
+
+    Writes to the socket of the multiplexer, under the name of the identity
+
+    """
+    def __init__(self, multiplexer, node_id):
+        self.multiplexer = multiplexer
+        self.node_id = node_id
+
+    def write(self, packet, address):
+        self.multiplexer._write(self.node_id, packet, address)
+
+    def getHost(self):
+        return self.multiplexer.transport.getHost()
@@ -12,10 +12,10 @@ from zope.interface import implements
 from twisted.python import log
 
 from config import constants
-from mdht.coding import basic_coder
+from mdht.coding import basic_coder, krpc_coder
 from mdht.krpc_types import Query
 from mdht.protocols.krpc_sender import KRPC_Sender, IKRPC_Sender
-from mdht.kademlia.routing_table import TreeRoutingTable
+from mdht.send_scheduler import PRIORITY_RESPONSE
 from mdht.source_info import Source_Info
 
 
@@ -28,7 +28,7 @@ class IKRPC_Responder(IKRPC_Sender):
 
     """
 
-    def __init__(self, routing_table_class=TreeRoutingTable, node_id=None):
+    def __init__(self, routing_table_class=None, node_id=None):
         """Specify a routing table and node_id to anchor this protocol"""
 
     def ping_Received(self, query, address):
@@ -144,7 +144,7 @@ class KRPC_Responder(KRPC_Sender):
     implements(IKRPC_Responder)
 
     def __init__(self,
-                 routing_table_class=TreeRoutingTable,
+                 routing_table_class=None,
                  node_id=None,
                  _reactor=None):
 
@@ -158,17 +158,21 @@ class KRPC_Responder(KRPC_Sender):
         # Datastore is used for storing peers on torrents
         self._datastore = Source_Info.instance()
         self._token_generator = _TokenGenerator()
+        # Our ping and find_node responses are spliced
+        # out of templates bencoded ahead of time
+        self._response_templates = krpc_coder.ResponseTemplates(self.node_id)
 
     def stopProtocol(self):
-        TreeRoutingTable.persist_routing_table()
+        self.routing_table.remove_owner(self.node_id)
+        self.routing_table.persist_routing_table()
 
     def ping_Received(self, query, address):
         # The ping response needs no additional protocol
-        # data, so build_response() is empty
+        # data, so it comes straight out of our template
         log.msg("ping_Received from node(%s:%s)" % address)
 
-        response = query.build_response()
-        self.sendResponse(response, address)
+        packet = self._response_templates.ping(query._transaction_id)
+        self._send_packet(packet, address, PRIORITY_RESPONSE)
 
     def find_node_Received(self, query, address):
         log.msg("find_node_Received from node(%s:%s)" % address)
@@ -181,8 +185,9 @@ class KRPC_Responder(KRPC_Sender):
             nodes = self.routing_table.get_closest_nodes(query.target_id)
 
         # Include the nodes in the response
-        response = query.build_response(nodes=nodes)
-        self.sendResponse(response, address)
+        packet = self._response_templates.find_node(
+            query._transaction_id, nodes)
+        self._send_packet(packet, address, PRIORITY_RESPONSE)
 
     def get_peers_Received(self, query, address):
         log.msg("get_peers_Received from node(%s:%s)" % address)
@@ -8,19 +8,26 @@ sending and receiving KRPC Queries, Requests, and Errors. This protocol
 is written with the Twisted Network framework
 
 """
-import random
-import logging
+import time
+from functools import partial
+from collections import defaultdict
 from zope.interface import implements, Interface
 from twisted.python import log
 from twisted.internet import reactor, defer, protocol
 
 from config import constants
 from mdht import contact
+from mdht.kademlia import routing_table
 from mdht.coding import krpc_coder
 from mdht.coding.krpc_coder import InvalidKRPCError
 from mdht.krpc_types import Query, Response, Error
-from mdht.transaction import Transaction
-from mdht.protocols.errors import TimeoutError, KRPCError
+from mdht.transaction import Transaction, TransactionTable
+from mdht.timer_wheel import TimerWheel
+from mdht.send_scheduler import (SendScheduler, PRIORITY_RESPONSE,
+                                 PRIORITY_PING, PRIORITY_QUERY)
+from mdht.protocols.errors import (TimeoutError, KRPCError,
+                                   TransactionTableFullError,
+                                   SendQueueFullError)
 
 
 class IKRPC_Sender(Interface):
@@ -40,6 +47,8 @@ class IKRPC_Sender(Interface):
         Construct a KRPC_Sender with a specific routing table and node_id
 
         @param routing_table_class: class of the routing table to use
+            (None for the one selected by constants.routing_table,
+            @see mdht.kademlia.routing_table.table_class)
         @param node_id: the node_id that this protocol will use
             for operating on the DHT network
 
@@ -47,6 +56,16 @@ class IKRPC_Sender(Interface):
             routing_table: an object implementing IRoutingTable
                 @see mdht.kademlia.routing_table.IRoutingTable
             node_id: the id of this node that this protocol is representing
+            dropped_packets: a dict counting the received datagrams
+                that were dropped, by reason
+                @see mdht.coding.krpc_coder.check_packet
+            transactions: the table of the outstanding queries
+                (and of its occupancy counters)
+                @see mdht.transaction.TransactionTable
+            send_scheduler: the SendScheduler the packets go out
+                through, within the bandwidth limits (and its
+                queue depth and shaped bytes counters)
+                @see mdht.send_scheduler.SendScheduler
 
         """
 
@@ -61,7 +80,9 @@ class IKRPC_Sender(Interface):
         find the original query. If it is found, the krpc is passed
         onto either responseReceived or errorReceived (along with
         the transaction). If the original query is not found (for
-        example because of a timeout), the orphan krpc is logged
+        example because of a timeout, or because the krpc does not
+        come from the address the query was sent to), the orphan
+        krpc is logged
 
         @param krpc: the krpc message that has been received
         @param address: the origin of this krpc
@@ -110,6 +131,9 @@ class IKRPC_Sender(Interface):
         """
         Encode the given krpc and send it to the given address
 
+        The packet may be held back for a while by the bandwidth
+        limits (@see mdht.send_scheduler)
+
         If the given krpc is invalid, an exception will be thrown
         in the encoding process
 
@@ -131,17 +155,25 @@ class IKRPC_Sender(Interface):
         @see krpc_types.Error
         @see protocols.errors.KRPCError
         @see protocols.errors.TimeoutError
+        @see protocols.errors.SendQueueFullError
         @see mdht.coding.krpc_coder.InvalidKRPCError
         @see mdht.constants.rpctimeout
         @see twisted.python.failure.Failure
 
         @returns a deferred whose callback is called with the Response that
             was received, and whose errback is called with a Failure
-            object that wraps one of TimeoutError, KRPCError, or
-            InvalidKRPCError. TimeoutError when the Query times out.
-            KRPCError when a KRPC Error is received in response to the
-            outbound Query. InvalidKRPCError when an error was encountered
-            during the encoding process
+            object that wraps one of TimeoutError, KRPCError,
+            InvalidKRPCError, TransactionTableFullError or
+            SendQueueFullError. TimeoutError when the Query times out
+            (the timeout runs from the moment the Query is actually
+            written out, past the bandwidth limits). KRPCError when a
+            KRPC Error is received in response to the outbound Query.
+            InvalidKRPCError when an error was encountered during the
+            encoding process. TransactionTableFullError when too many
+            queries are outstanding already. SendQueueFullError when
+            the Query was dropped by the send scheduler before it
+            could be written out (or twisted's CancelledError when
+            the protocol stopped before that)
 
         """
 
@@ -181,10 +213,19 @@ class KRPC_Sender(protocol.DatagramProtocol):
         # If the user doesn't specify a reactor, we will use
         # one from twisted.internet
         if _reactor is None:
-            self._reactor = reactor
+            _reactor = reactor
+        self._reactor = _reactor
         self.node_id = long(node_id)
-        self._transactions = dict()
+        self.transactions = TransactionTable()
+        # Times the outstanding transactions out
+        # (@see mdht.timer_wheel.TimerWheel)
+        self._timeouts = TimerWheel(_reactor=self._reactor)
+        if routing_table_class is None:
+            routing_table_class = routing_table.table_class()
         self.routing_table = routing_table_class.instance()
+        self.routing_table.add_owner(self.node_id)
+        self.dropped_packets = defaultdict(int)
+        self.send_scheduler = SendScheduler.instance()
 
     def datagramReceived(self, data, address):
         """
@@ -192,15 +233,20 @@ class KRPC_Sender(protocol.DatagramProtocol):
 
         This implementation tries to decode the datagram. If it succeeds,
         it is passed onto self.krpcReceived for further processing, otherwise
-        the encoding exception is captured and logged
+        the datagram is dropped and counted in self.dropped_packets
+        (obvious garbage is dropped before even trying to decode it)
 
         @see krpcReceived
 
         """
-        try:
-            krpc = krpc_coder.decode(data)
-        except InvalidKRPCError:
-            log.msg("Malformed packet received from %s:%d" % address, logLevel=logging.WARNING)
+        reason = krpc_coder.check_packet(data)
+        if reason is None:
+            try:
+                krpc = krpc_coder.decode(data)
+            except InvalidKRPCError:
+                reason = "malformed"
+        if reason is not None:
+            self.dropped_packets[reason] += 1
             return
         self.krpcReceived(krpc, address)
 
@@ -209,17 +255,28 @@ class KRPC_Sender(protocol.DatagramProtocol):
             self._save_received_node(krpc, address)
             self.queryReceived(krpc, address)
         else:
-            transaction = self._transactions.get(krpc._transaction_id, None)
-            if transaction is not None:
-                if isinstance(krpc, Response):
-                    self._save_received_node(krpc, address)
-                    self.responseReceived(krpc, transaction, address)
-                elif isinstance(krpc, Error):
-                    self.errorReceived(krpc, transaction, address)
-            else:
-                log.msg("Received a reply not corresponding to an" +
-                        " outstanding query from: %s, reply: %s" % (
-                            contact.address_str(address), str(krpc)))
+            transaction = self.transactions.get(krpc._transaction_id,
+                                                address)
+            self._replyReceived(krpc, transaction, address)
+
+    def _replyReceived(self, krpc, transaction, address):
+        """
+        Process a response/error to the given outstanding transaction
+
+        @param transaction: the transaction of the query, or None
+            if the reply does not refer to any (it is then logged)
+
+        """
+        if transaction is not None:
+            if isinstance(krpc, Response):
+                self._save_received_node(krpc, address)
+                self.responseReceived(krpc, transaction, address)
+            elif isinstance(krpc, Error):
+                self.errorReceived(krpc, transaction, address)
+        else:
+            log.msg("Received a reply not corresponding to an" +
+                    " outstanding query from: %s, reply: %s" % (
+                        contact.address_str(address), str(krpc)))
 
     def queryReceived(self, query, address):
         method_name = "%s_Received" % query.rpctype
@@ -238,41 +295,81 @@ class KRPC_Sender(protocol.DatagramProtocol):
     def sendKRPC(self, krpc, address):
         encoded_packet = krpc_coder.encode(krpc)
         log.msg("sendKRPC", encoded_packet, address, "\n")
-        self.transport.write(encoded_packet, address)
+        self._send_packet(encoded_packet, address, _send_priority(krpc))
+
+    def _send_packet(self, packet, address, priority):
+        """
+        Send an already encoded packet out to the given address
+
+        @param priority: the priority class of the packet
+            @see mdht.send_scheduler
+
+        """
+        self.send_scheduler.send(self.transport.write, packet, address,
+                                 priority)
 
     def sendQuery(self, query, address, timeout):
         # Fill in the "from" field of the query
         query._from = self.node_id
-        query._transaction_id = self._generate_transaction_id()
-        # Try to send the krpc, there is an encoding error
-        # immediately return the error to the user
-        try:
-            self.sendKRPC(query, address)
-        except InvalidKRPCError as encoding_error:
-            return defer.fail(encoding_error)
-
         # Record this transaction so that later the original
         # query may be referenced when a response/error is received
+        # (this also hands out its transaction id)
         t = Transaction()
         t.query = query
         t.address = address
+        query._transaction_id = self.transactions.add(t)
+        if query._transaction_id is None:
+            return defer.fail(TransactionTableFullError())
+        # Try to encode the krpc, there is an encoding error
+        # immediately return the error to the user
+        try:
+            packet = krpc_coder.encode(query)
+        except InvalidKRPCError as encoding_error:
+            self.transactions.remove(t)
+            return defer.fail(encoding_error)
+
         t.deferred = defer.Deferred()
         # Handle successful responses / errors
         # (supply the address and transaction for extra processing)
         t.deferred.addCallback(self._query_success_callback, address, t)
         t.deferred.addErrback(self._query_failure_errback, address, t)
-        # Set up a timeout during which this transaction has to complete
-        # (ie: receive a response or error)
-        t.timeout_call = self._reactor.callLater(constants.rpctimeout,
-                                                 t.deferred.errback, TimeoutError())
-        # Store this transaction, so when we receive responses back,
-        # we can check whether their rightness
-        self._transactions[query._transaction_id] = t
         # Add a callback that removes this transaction
         # after it has been processed
         t.deferred.addBoth(self._remove_transaction_bothback, t)
+
+        log.msg("sendKRPC", packet, address, "\n")
+        # The query may wait in the send scheduler for a while: its
+        # timeout (and rtt) only start once it is written out, and
+        # it fails right away if the scheduler drops it instead
+        self.send_scheduler.send(
+            partial(self._write_query, t, timeout or constants.rpctimeout),
+            packet, address, _send_priority(query),
+            partial(t.deferred.errback, SendQueueFullError()))
         return t.deferred
 
+    def _write_query(self, transaction, timeout, packet, address):
+        """
+        Write out the packet of the query of the given transaction
+
+        Called by the send scheduler, once the packet fits within the
+        bandwidth limits. The transaction is timed from here on, and
+        has to complete (ie: receive a response or error) within timeout
+
+        Nothing is written if the query is over already, and a query
+        whose protocol stopped in the meantime is cancelled instead
+
+        """
+        if (transaction.deferred.called or
+                not self.transactions.outstanding(transaction)):
+            return
+        if self.transport is None:
+            transaction.deferred.cancel()
+            return
+        transaction.time = time.time()
+        transaction.timeout_call = self._timeouts.call_later(
+            timeout, transaction.deferred.errback, TimeoutError())
+        self.transport.write(packet, address)
+
     def sendResponse(self, response, address):
         # Fill out the "from" field on the response before sending
         response._from = self.node_id
@@ -319,12 +416,12 @@ class KRPC_Sender(protocol.DatagramProtocol):
         # is either a TimeoutError or a KRPCError
         f = failure.trap(TimeoutError, KRPCError)
 
-        import copy
-        errornodes = copy.deepcopy(self.routing_table.get_node_by_address(address))
+        errornodes = self.routing_table.get_node_by_address(address)
         if errornodes is None:
             return failure
 
-        for errornode in errornodes:
+        # Copy the set, since removing nodes changes it
+        for errornode in list(errornodes):
             if f == TimeoutError:
                 # TODO multi-factor eviction (freshness is good,
                 # but what about (ie) number of failed queries?)
@@ -332,6 +429,8 @@ class KRPC_Sender(protocol.DatagramProtocol):
                     self.routing_table.remove_node(errornode)
             elif f == KRPCError:
                 errornode.failed_query(transaction.time)
+                # Let the routing table know the node was seen
+                self.routing_table.offer_node(errornode)
 
         return failure
 
@@ -342,32 +441,18 @@ class KRPC_Sender(protocol.DatagramProtocol):
         """
         Callback/errback that removes an outstanding transaction
 
-        The corresponding timeout delayed call is also cancelled
-        if it has not yet been called
+        The corresponding timeout (on the timer wheel) is also
+        cancelled if it has not yet been called
 
         """
-        transaction_id = transaction.query._transaction_id
-        if transaction_id in self._transactions:
-            del self._transactions[transaction_id]
+        self.transactions.remove(transaction)
 
-        if transaction.timeout_call.active():
+        if (transaction.timeout_call is not None and
+                transaction.timeout_call.active()):
             transaction.timeout_call.cancel()
 
         return result
 
-    def _generate_transaction_id(self):
-        """
-        Generate a transaction_id unique to our transaction table
-
-        @see mdht.constants.transaction_id_size
-        @returns a unique transaction_id of constants.transaction_id_size size
-
-        """
-        while True:
-            transaction_id = random.getrandbits(constants.transaction_id_size)
-            if transaction_id not in self._transactions:
-                return transaction_id
-
     def _save_received_node(self, krpc, address):
         """
         save node from the out request node if it is not in routing table yet
@@ -377,3 +462,19 @@ class KRPC_Sender(protocol.DatagramProtocol):
         node = contact.Node(node_id=krpc._from, address=address)
         self.routing_table.offer_node(node)
         log.msg("save the request from node(%s:%s) done" % address)
+
+
+def _send_priority(krpc):
+    """
+    The priority class of the given krpc
+
+    Our replies to the queries of other nodes go first, then
+    our pings (which check on the nodes of the routing table),
+    then all our other queries
+
+    """
+    if isinstance(krpc, Query):
+        if krpc.rpctype == "ping":
+            return PRIORITY_PING
+        return PRIORITY_QUERY
+    return PRIORITY_RESPONSE
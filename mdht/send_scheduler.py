@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Outbound bandwidth shaping of the KRPC packets
+
+Every packet goes out through the SendScheduler, which holds it back
+whenever sending it would exceed either the global budget
+(constants.global_bandwidth_rate) or the budget of its destination
+host (constants.host_bandwidth_rate). Held back packets wait in one
+queue per priority class: our responses to the queries of other
+nodes go first, then our liveness pings, then the rest of our
+queries (the find_node/get_peers of the lookups)
+
+The budgets are token buckets, each kept as a single theoretical
+arrival time (the generic cell rate algorithm): a packet of n bytes
+fits into a budget of r bytes/second as long as that time is at most
+constants.bandwidth_burst seconds ahead of now, and pushes it n/r
+seconds further
+
+"""
+from collections import deque
+
+from twisted.python import log
+from twisted.internet import reactor
+
+from config import constants
+
+# The priority classes, most urgent first
+PRIORITY_RESPONSE = 0
+PRIORITY_PING = 1
+PRIORITY_QUERY = 2
+_priorities = (PRIORITY_RESPONSE, PRIORITY_PING, PRIORITY_QUERY)
+
+# Number of hosts tracked before forgetting the ones back to full budget
+_min_host_sweep = 1024
+
+
+class SendScheduler(object):
+    """
+    Sends packets within the global and per host bandwidth budgets
+
+    A rate of 0 (or None) disables the corresponding budget. At
+    most constants.send_queue_size packets wait in the queues, past
+    that a packet pushes out the oldest packet of a lower priority
+    class, or is dropped if there is none
+
+    sent_bytes: the number of bytes sent
+    shaped_bytes: the number of bytes sent after waiting in a queue
+    dropped: the number of packets that did not fit in the queues
+    dropped_bytes: the number of bytes of these packets
+
+    """
+    def __init__(self, global_rate=None, host_rate=None, _reactor=None):
+        self._reactor = _reactor if _reactor is not None else reactor
+        if global_rate is None:
+            global_rate = constants.global_bandwidth_rate
+        if host_rate is None:
+            host_rate = constants.host_bandwidth_rate
+        self.global_rate = global_rate
+        self.host_rate = host_rate
+        self._global_tat = 0.0
+        # Theoretical arrival time of the budget of each host (ip)
+        self._host_tat = {}
+        self._host_sweep = _min_host_sweep
+        self._queues = [deque() for _ in _priorities]
+        self._queued = 0
+        self._drain_call = None
+        # Whether a queued packet waits for the global budget
+        # (in which case every new packet has to queue up as well)
+        self._global_blocked = False
+        self.sent_bytes = 0
+        self.shaped_bytes = 0
+        self.dropped = 0
+        self.dropped_bytes = 0
+
+    @classmethod
+    def instance(cls):
+        """Return the SendScheduler shared by all the local nodes"""
+        if "_instance" not in cls.__dict__:
+            cls._instance = cls()
+        return cls._instance
+
+    def send(self, write, packet, address, priority, dropped=None):
+        """
+        Send the packet to address through write, now or once it fits
+
+        @param write: the function writing a packet to an address
+            (ie the write method of a transport)
+        @param priority: one of the PRIORITY_* classes
+        @param dropped: a function called (without arguments) if
+            the packet ends up dropped instead
+
+        """
+        entry = (write, packet, address, dropped)
+        if self._global_blocked:
+            # The pending drain will take care of it
+            self._enqueue(entry, priority)
+            return
+        global_wait, host_wait = self._reserve(
+            len(packet), address[0], self._reactor.seconds())
+        if global_wait:
+            self._global_blocked = True
+        elif not host_wait:
+            write(packet, address)
+            self.sent_bytes += len(packet)
+            return
+        if self._enqueue(entry, priority):
+            self._schedule_drain(max(global_wait, host_wait))
+
+    def queue_depths(self):
+        """@return the number of packets waiting in each priority class"""
+        return [len(queue) for queue in self._queues]
+
+    def get_stats(self):
+        """
+        @return a dict with the queue depths (by priority class) and
+            the sent, shaped and dropped counters
+
+        """
+        return {"queue_depths": self.queue_depths(),
+                "sent_bytes": self.sent_bytes,
+                "shaped_bytes": self.shaped_bytes,
+                "dropped": self.dropped,
+                "dropped_bytes": self.dropped_bytes}
+
+    def _reserve(self, size, host, now):
+        """
+        Take size bytes out of the global budget and the budget of host
+
+        Nothing is taken unless both budgets hold the bytes
+
+        @returns a (global wait, host wait) tuple of the seconds
+            to wait for each budget (0 for a budget that allowed
+            the packet through)
+
+        """
+        global_wait = host_wait = 0
+        burst = constants.bandwidth_burst
+        if self.global_rate:
+            global_wait = max(self._global_tat - burst - now, 0)
+        if self.host_rate:
+            host_tat = self._host_tat.get(host, 0.0)
+            host_wait = max(host_tat - burst - now, 0)
+        if global_wait or host_wait:
+            return global_wait, host_wait
+        if self.global_rate:
+            self._global_tat = (max(self._global_tat, now) +
+                                float(size) / self.global_rate)
+        if self.host_rate:
+            self._host_tat[host] = (max(host_tat, now) +
+                                    float(size) / self.host_rate)
+            if len(self._host_tat) > self._host_sweep:
+                self._sweep_hosts(now)
+        return 0, 0
+
+    def _sweep_hosts(self, now):
+        """Forget about the hosts whose budget is full again"""
+        for host, tat in self._host_tat.items():
+            if tat <= now:
+                del self._host_tat[host]
+        self._host_sweep = max(_min_host_sweep, 2 * len(self._host_tat))
+
+    def _enqueue(self, entry, priority):
+        """
+        Queue the (write, packet, address, dropped) entry up
+
+        @returns boolean indicating whether it was queued (rather
+            than dropped)
+
+        """
+        if self._queued >= constants.send_queue_size:
+            # Make room by pushing out a less urgent packet
+            for queue in reversed(self._queues[priority + 1:]):
+                if queue:
+                    self._drop(queue.popleft())
+                    self._queued -= 1
+                    break
+            else:
+                self._drop(entry)
+                return False
+        self._queues[priority].append(entry)
+        self._queued += 1
+        return True
+
+    def _drop(self, entry):
+        self.dropped += 1
+        self.dropped_bytes += len(entry[1])
+        dropped = entry[3]
+        if dropped is not None:
+            try:
+                dropped()
+            except Exception:
+                log.err(None, "send_scheduler: dropping a packet broke")
+
+    def _drain(self):
+        """
+        Send the queued packets that fit into the budgets, most urgent first
+
+        A packet waiting for its host leaves its place to the packets
+        behind it, while a packet waiting for the global budget holds
+        up every packet behind it (and every less urgent packet)
+
+        """
+        self._drain_call = None
+        self._global_blocked = False
+        now = self._reactor.seconds()
+        wait = None
+        for queue in self._queues:
+            waiting = deque()
+            while queue:
+                entry = queue[0]
+                write, packet, address, dropped = entry
+                global_wait, host_wait = self._reserve(
+                    len(packet), address[0], now)
+                if global_wait:
+                    queue.extendleft(reversed(waiting))
+                    self._global_blocked = True
+                    self._schedule_drain(global_wait)
+                    return
+                queue.popleft()
+                if host_wait:
+                    waiting.append(entry)
+                    wait = host_wait if wait is None else min(wait, host_wait)
+                    continue
+                self._queued -= 1
+                self.sent_bytes += len(packet)
+                self.shaped_bytes += len(packet)
+                try:
+                    write(packet, address)
+                except Exception:
+                    log.err(None, "send_scheduler: writing a packet broke")
+            queue.extend(waiting)
+        if wait is not None:
+            self._schedule_drain(wait)
+
+    def _schedule_drain(self, delay):
+        """Drain the queues in delay seconds (unless that is due sooner)"""
+        if self._drain_call is None:
+            self._drain_call = self._reactor.callLater(delay, self._drain)
+        elif self._drain_call.getTime() > self._reactor.seconds() + delay:
+            self._drain_call.reset(delay)
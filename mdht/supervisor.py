@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Spread the virtual nodes over several worker processes
+
+A single reactor runs on a single core (and under a single GIL).
+The Supervisor starts a number of worker processes instead, each
+running its share of the virtual nodes (a contiguous block of their
+piece based id ranges, on their own ports) with its own reactor,
+sockets and routing table. Dead workers are restarted, and every
+worker reports its statistics to the supervisor (as json lines on
+a pipe), which logs their totals
+
+@see main.py for the launcher
+
+"""
+import os
+import sys
+import json
+import time
+
+from twisted.python import log
+from twisted.internet import reactor, protocol, task
+
+from config import constants
+
+# The file descriptor of a worker onto which it reports its stats
+STATS_FD = 3
+
+
+def worker_nums(worker, workers, nodes_num):
+    """
+    The numbers of the nodes (ie of their pieces) run by a worker
+
+    Each worker gets a contiguous block of pieces, so that the
+    owner ids of its routing table cover a single part of the
+    id space
+
+    @return a list of node numbers
+
+    """
+    return range(worker * nodes_num // workers,
+                 (worker + 1) * nodes_num // workers)
+
+
+def worker_stats(protos):
+    """
+    Gather the statistics of the local nodes run by the given protocols
+
+    The routing table and the send scheduler are shared by all the
+    protocols of a process, and the transaction table and dropped
+    packet counters by the protocols sharing a socket (they are
+    all counted once)
+
+    @return a dict of counters
+
+    """
+    stats = {"nodes": len(protos), "outstanding": 0, "dropped_packets": 0}
+    for table in _unique(proto.transactions for proto in protos):
+        stats["outstanding"] += table.occupied
+    for dropped in _unique(proto.dropped_packets for proto in protos):
+        stats["dropped_packets"] += sum(dropped.values())
+    if protos:
+        stats["routing_table"] = len(protos[0].routing_table.get_nodes())
+        scheduler = protos[0].send_scheduler.get_stats()
+        for key in ("sent_bytes", "shaped_bytes", "dropped"):
+            stats["send_" + key] = scheduler[key]
+        stats["send_queued"] = sum(scheduler["queue_depths"])
+    return stats
+
+
+def _unique(objects):
+    """@return a list of the distinct (by identity) objects"""
+    return dict((id(obj), obj) for obj in objects).values()
+
+
+class StatsReporter(object):
+    """
+    Writes the stats of the worker to the supervisor, as json lines
+
+    @see worker_stats
+
+    """
+    def __init__(self, protos, stream):
+        self.protos = protos
+        self.stream = stream
+        self._loop = task.LoopingCall(self.report)
+
+    def start(self):
+        self._loop.start(constants.worker_stats_interval, now=False)
+
+    def report(self):
+        try:
+            self.stream.write(json.dumps(worker_stats(self.protos)) + "\n")
+            self.stream.flush()
+        except IOError as e:
+            # The supervisor is gone, we will be stopped soon
+            log.msg("supervisor: could not report the stats: %s" % e)
+
+
+class Supervisor(object):
+    """
+    Runs and restarts the worker processes, and aggregates their stats
+
+    A worker that dies is restarted after constants.worker_restart_delay
+    seconds, twice that if it dies again without having stayed up for
+    constants.worker_restart_max_delay seconds, and so on (up to that
+    many seconds)
+
+    workers: the number of workers
+    command: a function returning the argv starting a given worker
+    stats: the latest stats reported by each worker
+    restarts: the number of restarts of each worker
+
+    """
+    def __init__(self, workers, command, _reactor=None):
+        self._reactor = _reactor if _reactor is not None else reactor
+        self.workers = workers
+        self.command = command
+        self.stats = {}
+        self.restarts = [0] * workers
+        self._processes = {}
+        self._started = [0] * workers
+        self._delays = [constants.worker_restart_delay] * workers
+        self._stopping = False
+        self._loop = task.LoopingCall(self.log_stats)
+        self._loop.clock = self._reactor
+
+    def start(self):
+        """Start every worker, and stop them along with the reactor"""
+        for worker in range(self.workers):
+            self._spawn(worker)
+        self._reactor.addSystemEventTrigger("before", "shutdown", self.stop)
+        self._loop.start(constants.worker_stats_interval, now=False)
+
+    def stop(self):
+        """Stop the workers (for good)"""
+        self._stopping = True
+        if self._loop.running:
+            self._loop.stop()
+        for process in self._processes.values():
+            try:
+                process.signalProcess("TERM")
+            except OSError:
+                pass
+
+    def aggregate(self):
+        """
+        Sum up the latest stats of the workers that are running
+
+        @return a dict of counters, along with the number of workers
+            running and the total number of restarts
+
+        """
+        totals = {"workers": len(self._processes),
+                  "restarts": sum(self.restarts)}
+        for worker, stats in self.stats.items():
+            if worker not in self._processes:
+                continue
+            for key, value in stats.items():
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def log_stats(self):
+        totals = self.aggregate()
+        log.msg("supervisor: " + ", ".join(
+            "%s=%s" % item for item in sorted(totals.items())))
+
+    def _spawn(self, worker):
+        argv = self.command(worker)
+        # The worker shares our stdout/stderr and
+        # reports its stats on STATS_FD
+        process = self._reactor.spawnProcess(
+            _WorkerProtocol(self, worker), argv[0], argv,
+            env=os.environ, childFDs={0: "w", 1: 1, 2: 2, STATS_FD: "r"})
+        self._processes[worker] = process
+        self._started[worker] = time.time()
+        log.msg("supervisor: worker %d started (pid %d)" % (
+            worker, process.pid))
+
+    def _stats_received(self, worker, stats):
+        self.stats[worker] = stats
+
+    def _worker_ended(self, worker, reason):
+        del self._processes[worker]
+        self.stats.pop(worker, None)
+        if self._stopping:
+            return
+        if time.time() - self._started[worker] > (
+                constants.worker_restart_max_delay):
+            # It had been running fine for a while
+            self._delays[worker] = constants.worker_restart_delay
+        delay = self._delays[worker]
+        self._delays[worker] = min(2 * delay,
+                                   constants.worker_restart_max_delay)
+        log.msg("supervisor: worker %d ended (%s), restarting it in %gs" % (
+            worker, reason.getErrorMessage(), delay))
+        self.restarts[worker] += 1
+        self._reactor.callLater(delay, self._restart, worker)
+
+    def _restart(self, worker):
+        if not self._stopping:
+            self._spawn(worker)
+
+
+class _WorkerProtocol(protocol.ProcessProtocol):
+    """Reads the stats reported by a worker, and notices its end"""
+
+    def __init__(self, supervisor, worker):
+        self.supervisor = supervisor
+        self.worker = worker
+        self._buffer = ""
+
+    def childDataReceived(self, fd, data):
+        if fd != STATS_FD:
+            return
+        lines = (self._buffer + data).split("\n")
+        self._buffer = lines.pop()
+        for line in lines:
+            try:
+                stats = json.loads(line)
+            except ValueError:
+                log.msg("supervisor: garbled stats from worker %d" % (
+                    self.worker))
+                continue
+            self.supervisor._stats_received(self.worker, stats)
+
+    def processEnded(self, reason):
+        self.supervisor._worker_ended(self.worker, reason)
+
+
+def open_stats_stream(stats_fd=STATS_FD):
+    """Return the stream onto which a worker reports its stats"""
+    return os.fdopen(stats_fd, "w")
+
+
+def python_command(script, *args):
+    """@return the argv running the given python script with args"""
+    return [sys.executable, script] + [str(arg) for arg in args]
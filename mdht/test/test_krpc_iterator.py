@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Tests for the kbucket refreshing of mdht.protocols.krpc_iterator
+
+The find_node queries are answered locally (no packet goes out),
+and the refresher runs on a fake clock
+
+"""
+import random
+
+from twisted.trial import unittest
+from twisted.internet import task, defer
+
+from config import constants
+from mdht import contact
+from mdht.krpc_types import Response
+from mdht.source_info import Source_Info
+from mdht.send_scheduler import SendScheduler
+from mdht.kademlia import routing_table
+from mdht.protocols.errors import TimeoutError
+from mdht.protocols.krpc_iterator import KRPC_Iterator, IterationError
+
+
+class _RoutingTable(routing_table.FlatRoutingTable):
+    """A routing table that is neither restored nor persisted"""
+    _saved = True
+
+
+def random_node(rng):
+    return contact.Node(rng.getrandbits(constants.id_size),
+                        ("10.0.%d.%d" % (rng.randrange(256),
+                                         rng.randrange(1, 255)), 6881))
+
+
+class RefreshTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = random.Random(0)
+        self.clock = task.Clock()
+        self._set_singleton(_RoutingTable, _RoutingTable())
+        self._set_singleton(SendScheduler,
+                            SendScheduler(0, 0, _reactor=self.clock))
+        # The peers datastore is never used by these tests
+        self._set_singleton(Source_Info, None)
+        self.table = _RoutingTable.instance()
+        self.seed = random_node(self.rng)
+        self.table.offer_node(self.seed)
+        # The nodes the seed node answers every find_node with
+        self.found = [random_node(self.rng) for _ in range(constants.k)]
+
+    def _set_singleton(self, cls, instance):
+        """Install the global instance of cls for this test only"""
+        if "_instance" in cls.__dict__:
+            self.addCleanup(setattr, cls, "_instance", cls._instance)
+        else:
+            self.addCleanup(delattr, cls, "_instance")
+        cls._instance = instance
+
+    def _iterator(self, find_node=None):
+        proto = KRPC_Iterator(node_id=self.rng.getrandbits(160),
+                              routing_table_class=_RoutingTable,
+                              _reactor=self.clock)
+        proto.find_node = find_node or self._answer_find_node
+        return proto
+
+    def _answer_find_node(self, address, target_id, timeout=None):
+        return defer.succeed(Response(_from=self.seed.node_id,
+                                      nodes=list(self.found)))
+
+    def _assert_found_nodes_offered(self):
+        for node in self.found:
+            self.assertIdentical(self.table.get_node(node.node_id), node)
+
+    def test_refresh_lookup_offers_the_found_nodes(self):
+        proto = self._iterator()
+        results = []
+        proto._refresh_lookup(self.rng.getrandbits(160)).addBoth(
+            results.append)
+        self.assertEqual(results, [None])
+        self._assert_found_nodes_offered()
+
+    def test_refresher_refreshes_idle_kbuckets(self):
+        proto = self._iterator()
+        proto.startProtocol()
+        refresher = self.table.refresher
+        self.assertEqual(refresher.lookup, proto._refresh_lookup)
+        # A fresh table needs no refresh
+        self.clock.advance(constants.NICEinterval)
+        self.assertEqual(refresher.refreshes, 0)
+        for k in self.table.get_kbuckets():
+            k.last_changed -= constants.kbucket_refresh_timeout + 1
+        self.clock.advance(constants.NICEinterval)
+        self.assertEqual(refresher.refreshes, 1)
+        self._assert_found_nodes_offered()
+        refresher.stop()
+
+    def test_failed_refresh_lookup(self):
+        proto = self._iterator(
+            lambda address, target_id, timeout=None:
+            defer.fail(TimeoutError()))
+        failures = []
+        proto._refresh_lookup(1).addErrback(failures.append)
+        self.assertEqual(len(failures), 1)
+        failures[0].trap(IterationError)
+        # The refresher gets over it, and refreshes again once due
+        proto.startProtocol()
+        refresher = self.table.refresher
+        for _ in range(2):
+            for k in self.table.get_kbuckets():
+                k.last_changed -= constants.kbucket_refresh_timeout + 1
+            self.clock.advance(constants.NICEinterval)
+        self.assertEqual(refresher.refreshes, 2)
+        refresher.stop()
+
+    def test_refresher_is_handed_over(self):
+        protos = [self._iterator() for _ in range(3)]
+        for proto in protos:
+            proto.startProtocol()
+        refresher = self.table.refresher
+        protos[0].stopProtocol()
+        self.assertIdentical(self.table.refresher, refresher)
+        self.assertEqual(refresher.lookup, protos[1]._refresh_lookup)
+        protos[2].stopProtocol()
+        self.assertEqual(refresher.lookup, protos[1]._refresh_lookup)
+        for k in self.table.get_kbuckets():
+            k.last_changed -= constants.kbucket_refresh_timeout + 1
+        self.clock.advance(constants.NICEinterval)
+        self.assertEqual(refresher.refreshes, 1)
+        self._assert_found_nodes_offered()
+        protos[1].stopProtocol()
+        self.assertIdentical(self.table.refresher, None)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
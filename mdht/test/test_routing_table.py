@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Tests for the routing tables of mdht.kademlia.routing_table
+
+The closest nodes of every implementation are checked against a
+brute force sort of all the nodes of the table
+
+"""
+import random
+
+from twisted.trial import unittest
+
+from config import constants
+from mdht import contact
+from mdht.kademlia import routing_table
+
+NODES = 1000
+TARGETS = 150
+
+
+def random_node(rng):
+    address = ("%d.%d.%d.%d" % tuple(rng.randrange(1, 255) for _ in range(4)),
+               rng.randrange(1, 2**16))
+    return contact.Node(rng.getrandbits(constants.id_size), address)
+
+
+def brute_closest(table, target, num_nodes):
+    nodes = table.get_nodes().values()
+    return sorted(nodes, key=lambda node: node.node_id ^ target)[:num_nodes]
+
+
+class _ClosestNodesMixin(object):
+    """
+    Brute force checks of the closest nodes of table_class
+
+    The tables shaped around their owners get a few of them
+
+    """
+    table_class = None
+    owners = 0
+
+    def setUp(self):
+        self.rng = random.Random(self.table_class.__name__)
+        self.table = self.table_class()
+        for _ in range(self.owners):
+            self.table.add_owner(self.rng.getrandbits(constants.id_size))
+        self.nodes = [random_node(self.rng) for _ in range(NODES)]
+        for node in self.nodes:
+            self.table.offer_node(node)
+
+    def _targets(self):
+        """Random ids, and ids right next to the nodes (and owners)"""
+        for _ in range(TARGETS):
+            yield self.rng.getrandbits(constants.id_size)
+        for node in self.rng.sample(self.nodes, TARGETS):
+            yield node.node_id ^ self.rng.getrandbits(8)
+
+    def _check(self, lookup, num_nodes=constants.k):
+        for target in self._targets():
+            expected = brute_closest(self.table, target, num_nodes)
+            self.assertEqual(lookup(target, num_nodes), expected)
+
+    def test_find_closest_nodes(self):
+        for num_nodes in (1, constants.k, 20):
+            self._check(self.table._find_closest_nodes, num_nodes)
+
+    def test_get_closest_nodes(self):
+        for num_nodes in (1, constants.k, 20):
+            self._check(self.table.get_closest_nodes, num_nodes)
+            # Again, now that the candidates are cached
+            self._check(self.table.get_closest_nodes, num_nodes)
+        self.assertTrue(self.table.get_closest_cache_stats()["hits"] > 0)
+
+    def test_get_closest_nodes_under_churn(self):
+        self._check(self.table.get_closest_nodes)
+        for node in self.rng.sample(self.nodes, NODES // 4):
+            self.table.remove_node(node)
+        for _ in range(NODES // 4):
+            self.table.offer_node(random_node(self.rng))
+        self._check(self.table.get_closest_nodes)
+
+    def test_get_closest_nodes_of_sparse_kbuckets(self):
+        # Send (nearly) every kbucket through the walk
+        self.patch(constants, "closest_cache_max_candidates", constants.k)
+        self._check(self.table.get_closest_nodes)
+        self._check(self.table.get_closest_nodes)
+
+    def test_get_closest_nodes_uncached(self):
+        self.patch(constants, "closest_cache_size", 0)
+        self._check(self.table.get_closest_nodes)
+        self.assertEqual(self.table.get_closest_cache_stats()["entries"], 0)
+
+    def test_few_nodes(self):
+        table = self.table_class()
+        nodes = [random_node(self.rng) for _ in range(3)]
+        for node in nodes:
+            table.offer_node(node)
+        target = self.rng.getrandbits(constants.id_size)
+        self.assertEqual(table.get_closest_nodes(target),
+                         brute_closest(table, target, constants.k))
+        self.assertEqual(len(table.get_closest_nodes(target)), 3)
+
+    def test_bookkeeping_matches_the_kbuckets(self):
+        # Evicting offers (fresh nodes taking the place of stale ones)
+        for node in self.rng.sample(self.nodes, NODES // 2):
+            node.last_updated -= constants.node_timeout + 1
+            self.table.offer_node(node)
+        for _ in range(NODES):
+            node = random_node(self.rng)
+            node.successful_query(node.last_updated - 0.1)
+            self.table.offer_node(node)
+        kbucket_ids = set()
+        for k in self.table.get_kbuckets():
+            kbucket_ids.update(node.node_id for node in k.get_nodes())
+        self.assertEqual(set(self.table.nodes_dict), kbucket_ids)
+        self.assertEqual(len(self.table.nodes_dict), len(kbucket_ids))
+        addresses = set(node.address for node in
+                        self.table.nodes_dict.itervalues())
+        self.assertEqual(set(self.table.nodes_by_addr), addresses)
+
+
+class TreeRoutingTableTestCase(_ClosestNodesMixin, unittest.TestCase):
+    table_class = routing_table.TreeRoutingTable
+
+
+class FlatRoutingTableTestCase(_ClosestNodesMixin, unittest.TestCase):
+    table_class = routing_table.FlatRoutingTable
+
+
+class MultiOwnerRoutingTableTestCase(_ClosestNodesMixin, unittest.TestCase):
+    table_class = routing_table.MultiOwnerRoutingTable
+    owners = 10
+
+
+class SubsecondRoutingTableTestCase(_ClosestNodesMixin, unittest.TestCase):
+    table_class = routing_table.SubsecondRoutingTable
+    owners = 10
+
+
+class TableClassTestCase(unittest.TestCase):
+
+    def test_selected_by_the_config(self):
+        for name, table_class in routing_table.TABLE_CLASSES.items():
+            self.patch(constants, "routing_table", name)
+            self.assertIdentical(routing_table.table_class(), table_class)
+
+    def test_unknown(self):
+        self.assertRaises(ValueError, routing_table.table_class, "nope")
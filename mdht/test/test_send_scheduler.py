@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Tests for mdht.send_scheduler, driven by a fake clock
+
+"""
+from twisted.trial import unittest
+from twisted.internet import task
+
+from config import constants
+from mdht.send_scheduler import (SendScheduler, PRIORITY_RESPONSE,
+                                 PRIORITY_PING, PRIORITY_QUERY)
+
+HOST_A = ("10.0.0.1", 6881)
+HOST_B = ("10.0.0.2", 6881)
+
+
+class SendSchedulerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.patch(constants, "bandwidth_burst", 1)
+        self.sent = []
+
+    def _scheduler(self, global_rate, host_rate):
+        return SendScheduler(global_rate=global_rate, host_rate=host_rate,
+                             _reactor=self.clock)
+
+    def _write(self, packet, address):
+        self.sent.append((packet, address, self.clock.seconds()))
+
+    def _times(self):
+        return [when for (packet, address, when) in self.sent]
+
+    def test_unlimited(self):
+        scheduler = self._scheduler(0, 0)
+        for _ in range(100):
+            scheduler.send(self._write, "x" * 1000, HOST_A, PRIORITY_QUERY)
+        self.assertEqual(self._times(), [0] * 100)
+        self.assertEqual(scheduler.sent_bytes, 100000)
+        self.assertEqual(scheduler.shaped_bytes, 0)
+
+    def test_global_rate(self):
+        # 50 byte packets at 100 bytes/second: a second worth of
+        # burst on top of the first packet, then one every 0.5s
+        scheduler = self._scheduler(100, 0)
+        for i in range(6):
+            address = (HOST_A, HOST_B)[i % 2]
+            scheduler.send(self._write, "x" * 50, address, PRIORITY_QUERY)
+        self.assertEqual(self._times(), [0, 0, 0])
+        self.clock.pump([0.5] * 4)
+        self.assertEqual(self._times(), [0, 0, 0, 0.5, 1.0, 1.5])
+        self.assertEqual(scheduler.shaped_bytes, 150)
+        self.assertEqual(scheduler.queue_depths(), [0, 0, 0])
+
+    def test_host_rate_holds_back_only_its_host(self):
+        scheduler = self._scheduler(0, 100)
+        for address in (HOST_A, HOST_A, HOST_A, HOST_A, HOST_B):
+            scheduler.send(self._write, "x" * 50, address, PRIORITY_QUERY)
+        self.assertEqual([a for (p, a, w) in self.sent],
+                         [HOST_A, HOST_A, HOST_A, HOST_B])
+        self.clock.advance(0.5)
+        self.assertEqual(self.sent[-1], ("x" * 50, HOST_A, 0.5))
+
+    def test_most_urgent_first(self):
+        scheduler = self._scheduler(100, 0)
+        # Use the whole burst up
+        for _ in range(3):
+            scheduler.send(self._write, "x" * 50, HOST_A, PRIORITY_QUERY)
+        for packet, priority in [("q", PRIORITY_QUERY), ("p", PRIORITY_PING),
+                                 ("r", PRIORITY_RESPONSE)]:
+            scheduler.send(self._write, packet * 50, HOST_A, priority)
+        self.clock.pump([0.5] * 4)
+        self.assertEqual([p[0] for (p, a, w) in self.sent[3:]],
+                         ["r", "p", "q"])
+
+    def test_full_queues_drop_the_least_urgent(self):
+        self.patch(constants, "send_queue_size", 2)
+        scheduler = self._scheduler(100, 0)
+        dropped = []
+        for _ in range(3):
+            scheduler.send(self._write, "x" * 50, HOST_A, PRIORITY_QUERY)
+        for packet, priority in [("q", PRIORITY_QUERY), ("p", PRIORITY_PING),
+                                 ("r", PRIORITY_RESPONSE),
+                                 ("s", PRIORITY_QUERY)]:
+            scheduler.send(self._write, packet * 50, HOST_A, priority,
+                           lambda packet=packet: dropped.append(packet))
+        # The response pushed the query out, and the last
+        # query did not find a less urgent packet to push out
+        self.assertEqual(dropped, ["q", "s"])
+        self.assertEqual(scheduler.dropped, 2)
+        self.assertEqual(scheduler.dropped_bytes, 100)
+        self.clock.pump([0.5] * 4)
+        self.assertEqual([p[0] for (p, a, w) in self.sent[3:]], ["r", "p"])
+
+    def test_a_raising_drop_callback_is_logged(self):
+        self.patch(constants, "send_queue_size", 0)
+        scheduler = self._scheduler(100, 0)
+        for _ in range(3):
+            scheduler.send(self._write, "x" * 50, HOST_A, PRIORITY_QUERY)
+
+        def boom():
+            raise ValueError("boom")
+        scheduler.send(self._write, "x" * 50, HOST_A, PRIORITY_QUERY, boom)
+        self.assertEqual(scheduler.dropped, 1)
+        self.assertEqual(len(self.flushLoggedErrors(ValueError)), 1)
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Tests for mdht.timer_wheel, driven by a fake clock
+
+"""
+from twisted.trial import unittest
+from twisted.internet import task
+
+from mdht.timer_wheel import TimerWheel
+
+
+class TimerWheelTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        # 1 second ticks, 8 slots: the wheel goes around every 8 seconds
+        self.wheel = TimerWheel(tick=1, slots=8, _reactor=self.clock)
+        self.fired = []
+
+    def _fire(self, name):
+        self.fired.append((name, self.clock.seconds()))
+
+    def test_fires_on_the_first_tick_past_its_deadline(self):
+        self.wheel.call_later(2.5, self._fire, "a")
+        self.clock.advance(2)
+        self.assertEqual(self.fired, [])
+        self.clock.advance(1)
+        self.assertEqual(self.fired, [("a", 3)])
+
+    def test_fires_in_deadline_order(self):
+        for delay, name in [(3, "c"), (1, "a"), (2, "b")]:
+            self.wheel.call_later(delay, self._fire, name)
+        self.clock.pump([1] * 4)
+        self.assertEqual(self.fired, [("a", 1), ("b", 2), ("c", 3)])
+
+    def test_timers_beyond_the_wheel_are_not_fired_early(self):
+        # 20 seconds is further away than the 8 slots of the wheel
+        self.wheel.call_later(20, self._fire, "far")
+        self.wheel.call_later(4, self._fire, "near")
+        self.clock.pump([1] * 19)
+        self.assertEqual(self.fired, [("near", 4)])
+        self.clock.advance(1)
+        self.assertEqual(self.fired, [("near", 4), ("far", 20)])
+
+    def test_cancel(self):
+        timer = self.wheel.call_later(2, self._fire, "a")
+        self.assertTrue(timer.active())
+        self.assertEqual(self.wheel.pending, 1)
+        timer.cancel()
+        self.assertFalse(timer.active())
+        self.assertEqual(self.wheel.pending, 0)
+        self.clock.pump([1] * 4)
+        self.assertEqual(self.fired, [])
+
+    def test_fired_timers_are_inactive(self):
+        timer = self.wheel.call_later(1, self._fire, "a")
+        self.clock.advance(1)
+        self.assertFalse(timer.active())
+        # Cancelling it late does no harm
+        timer.cancel()
+        self.assertEqual(self.wheel.pending, 0)
+
+    def test_stops_ticking_when_idle(self):
+        self.wheel.call_later(1, self._fire, "a")
+        self.clock.advance(1)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        # And starts again with the next timer
+        self.clock.advance(100)
+        self.wheel.call_later(1, self._fire, "b")
+        self.clock.advance(1)
+        self.assertEqual(self.fired, [("a", 1), ("b", 102)])
+
+    def test_catches_up_after_a_stall(self):
+        for delay in (1, 5, 12):
+            self.wheel.call_later(delay, self._fire, delay)
+        # The reactor was held up for longer than the whole wheel
+        self.clock.advance(30)
+        self.assertEqual(sorted(name for name, when in self.fired),
+                         [1, 5, 12])
+        self.assertEqual(self.wheel.pending, 0)
+
+    def test_a_raising_timer_does_not_stop_the_others(self):
+        def boom():
+            raise ValueError("boom")
+        self.wheel.call_later(1, boom)
+        self.wheel.call_later(1, self._fire, "a")
+        self.clock.advance(1)
+        self.assertEqual(self.fired, [("a", 1)])
+        self.assertEqual(len(self.flushLoggedErrors(ValueError)), 1)
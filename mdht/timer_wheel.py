@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+A hashed timer wheel, for the many short lived timeouts of a protocol
+
+Every outstanding query has to time out unless it is answered,
+which with many virtual nodes means tens of thousands of live
+timers. Kept as reactor DelayedCalls, each of them is pushed into
+(and cancelled out of) the reactor's heap in O(log n). The timer
+wheel hashes timers into slots by their expiry tick instead: a timer
+is scheduled and cancelled in O(1), and a single periodic call
+(every tick) expires the timers of the current slot
+
+"""
+import math
+
+from twisted.python import log
+from twisted.internet import reactor, task
+
+from config import constants
+
+
+class TimerWheel(object):
+    """
+    Expires timers with a resolution of `tick' seconds
+
+    A timer fires during the first tick that starts at or after its
+    deadline (ie at most a tick late). Timers further away than the
+    number of slots times the tick share slots with nearer timers,
+    and are simply skipped over until their tick comes up
+
+    pending: the number of scheduled timers
+
+    """
+    def __init__(self, tick=None, slots=None, _reactor=None):
+        self._reactor = _reactor if _reactor is not None else reactor
+        self.tick = tick or constants.timer_wheel_tick
+        self._slots = [set() for _ in xrange(
+            slots or constants.timer_wheel_slots)]
+        # The last tick whose slot was expired
+        self._current = self._now_tick()
+        self.pending = 0
+        self._loop = task.LoopingCall(self._advance)
+        self._loop.clock = self._reactor
+
+    def call_later(self, delay, func, *args):
+        """
+        Call func(*args) in delay seconds (rounded up to the next tick)
+
+        @returns a timer that can be cancelled, just like the
+            DelayedCall returned by reactor.callLater
+
+        """
+        if not self._loop.running:
+            # The wheel has been idle, nothing is left to expire
+            self._current = self._now_tick()
+        deadline = self._reactor.seconds() + delay
+        expiry = max(int(math.ceil(deadline / self.tick)), self._current + 1)
+        timer = _Timer(expiry, func, args)
+        timer._slot = self._slots[expiry % len(self._slots)]
+        timer._slot.add(timer)
+        timer._wheel = self
+        self.pending += 1
+        if not self._loop.running:
+            self._loop.start(self.tick, now=False)
+        return timer
+
+    def stop(self):
+        """Stop ticking (the remaining timers never fire)"""
+        if self._loop.running:
+            self._loop.stop()
+
+    def _now_tick(self):
+        return int(self._reactor.seconds() / self.tick)
+
+    def _advance(self):
+        """Expire the timers of every tick up to now"""
+        now_tick = self._now_tick()
+        # After a stall, going around the wheel once covers every slot
+        self._current = max(self._current, now_tick - len(self._slots))
+        while self._current < now_tick:
+            self._current += 1
+            slot = self._slots[self._current % len(self._slots)]
+            expired = [timer for timer in slot
+                       if timer.expiry <= self._current]
+            for timer in expired:
+                slot.remove(timer)
+                timer._slot = None
+            self.pending -= len(expired)
+            for timer in expired:
+                try:
+                    timer.func(*timer.args)
+                except Exception:
+                    log.err(None, "timer_wheel: a timer raised")
+        if self.pending == 0 and self._loop.running:
+            self._loop.stop()
+
+
+class _Timer(object):
+    """
+    A timer scheduled on a TimerWheel
+
+    expiry: the tick during which it fires
+    func, args: what it calls
+
+    """
+    __slots__ = ("expiry", "func", "args", "_slot", "_wheel")
+
+    def __init__(self, expiry, func, args):
+        self.expiry = expiry
+        self.func = func
+        self.args = args
+        self._slot = None
+        self._wheel = None
+
+    def active(self):
+        """Tells whether this timer has neither fired nor been cancelled"""
+        return self._slot is not None
+
+    def cancel(self):
+        if self._slot is not None:
+            self._slot.remove(self)
+            self._slot = None
+            self._wheel.pending -= 1
@@ -4,10 +4,18 @@
 @author Greg Skoczek
 
 A class containing a loose collection of attributes
-associated with a transaction in the DHT network
+associated with a transaction in the DHT network, and
+the table of the outstanding transactions of a socket
 
 """
 import time
+import struct
+from binascii import hexlify
+
+from config import constants
+
+# Transaction ids are 2 bytes long (@see TransactionTable)
+_pack_transaction_id = struct.Struct("!H").pack
 
 
 class Transaction(object):
@@ -17,12 +25,16 @@ class Transaction(object):
     query: the query this transaction refers to
     deferred: the deferred that will be fired once a response/error is
               received corresponding to the query (or the query times out)
-    timeout_call: the delayed call that is used to time this query out
+    timeout_call: the timer that is used to time this query out
                  (and remove this transaction from the transaction table)
+                 @see mdht.timer_wheel.TimerWheel
     address: the address of the target node of this transaction
-    time: the time that this transaction originated
+    time: the time that the query of this transaction was written
+          out (once past the bandwidth limits of the send scheduler)
 
     """
+    __slots__ = ("query", "deferred", "timeout_call", "address", "time")
+
     def __init__(self):
         self.query = None
         self.deferred = None
@@ -30,15 +42,123 @@ class Transaction(object):
         self.address = None
         self.time = time.time()
 
-    def __eq__(self, other):
-        return not self.__ne__(other)
+    def __str__(self):
+        return "transaction: id=%s, time=%d" % (
+            hexlify(self.query._transaction_id), self.time)
 
-    def __ne__(self, other):
-        return self.__hash__() ^ other.__hash__()
 
-    def __hash__(self):
-        return long(round(float("%d%f" % (self.query.transaction_id, self.time))))
+class TransactionTable(object):
+    """
+    The outstanding transactions of a socket, under 2 byte ids
 
-    def __str__(self):
-        return "transaction: id=%d, time=%d" % (
-            self.query.transaction_id, self.time)
+    The ids are handed out by a counter going round the 2**16 ids
+    (skipping the ones still taken), so a given id only comes back
+    once every other id has been used, ie after about 2**16 queries.
+    A late reply to a query that timed out therefore finds either
+    no transaction, or (once the counter went around) a transaction
+    of a newer generation of its id, sent to another node: its
+    address has to match the one the transaction was sent to
+
+    At most constants.transaction_table_size transactions may be
+    outstanding, which keeps free ids easy to come across
+
+    occupied: the number of outstanding transactions
+    peak: the largest number of outstanding transactions seen
+    allocated: the number of transaction ids handed out
+    stale: the number of replies to unknown transaction ids (late
+        replies, mostly) or coming from the wrong address
+    exhausted: the number of transactions turned down
+        because the table was full
+
+    """
+    def __init__(self, size=None):
+        self.size = size or constants.transaction_table_size
+        if not 0 < self.size <= 2**15:
+            raise ValueError("the transaction table size must be "
+                             "within 1..2**15")
+        self._transactions = {}
+        self._counter = 0
+        self.peak = 0
+        self.allocated = 0
+        self.stale = 0
+        self.exhausted = 0
+
+    def __len__(self):
+        return len(self._transactions)
+
+    @property
+    def occupied(self):
+        return len(self._transactions)
+
+    def add(self, transaction):
+        """
+        Store the transaction under a new transaction id
+
+        @returns the transaction id (a 2 byte string), or None
+            if the table is full
+
+        """
+        transactions = self._transactions
+        if len(transactions) >= self.size:
+            self.exhausted += 1
+            return None
+        counter = self._counter
+        while True:
+            counter = (counter + 1) & 0xffff
+            transaction_id = _pack_transaction_id(counter)
+            if transaction_id not in transactions:
+                break
+        self._counter = counter
+        transactions[transaction_id] = transaction
+        self.allocated += 1
+        occupied = len(transactions)
+        if occupied > self.peak:
+            self.peak = occupied
+        return transaction_id
+
+    def get(self, transaction_id, address):
+        """
+        Return the outstanding transaction a reply from address refers to
+
+        @returns a Transaction or None (the reply is counted as stale)
+
+        """
+        transaction = self._transactions.get(transaction_id)
+        if transaction is None or transaction.address != address:
+            self.stale += 1
+            return None
+        return transaction
+
+    def outstanding(self, transaction):
+        """Tells whether the given transaction is still in this table"""
+        return (self._transactions.get(transaction.query._transaction_id)
+                is transaction)
+
+    def remove(self, transaction):
+        """
+        Drop the given transaction, if it is still outstanding
+
+        @returns boolean indicating whether it was
+
+        """
+        if not self.outstanding(transaction):
+            return False
+        del self._transactions[transaction.query._transaction_id]
+        return True
+
+    def transactions(self):
+        """@return a list of the outstanding transactions"""
+        return self._transactions.values()
+
+    def get_stats(self):
+        """
+        @return a dict with the occupancy counters of the table
+            and its size
+
+        """
+        return {"size": self.size,
+                "occupied": self.occupied,
+                "peak": self.peak,
+                "allocated": self.allocated,
+                "stale": self.stale,
+                "exhausted": self.exhausted}